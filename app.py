@@ -11,6 +11,12 @@ from opentapioca.wikidatagraph import WikidataGraph
 from opentapioca.languagemodel import BOWLanguageModel
 from opentapioca.tagger import Tagger
 from opentapioca.classifier import SimpleTagClassifier
+from opentapioca.transport import HttpTransport
+from opentapioca.candidatecache import CandidateCache
+from opentapioca.annotationcache import AnnotationCache
+from opentapioca.annotationcache import model_version
+from opentapioca.lexicon import Lexicon
+from opentapioca.lexicon import LexiconTagBackend
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s')
@@ -20,16 +26,43 @@ tapioca_dir = os.path.dirname(__file__)
 bow = BOWLanguageModel()
 if settings.LANGUAGE_MODEL_PATH:
     bow.load(settings.LANGUAGE_MODEL_PATH)
+if getattr(settings, 'LANGUAGE_MODEL_DELTAS_PATH', None):
+    bow.refresh_periodically(settings.LANGUAGE_MODEL_DELTAS_PATH,
+        getattr(settings, 'LANGUAGE_MODEL_REFRESH_INTERVAL', 600))
 graph = WikidataGraph()
 if settings.PAGERANK_PATH:
-    graph.load_pagerank(settings.PAGERANK_PATH)
+    graph.load_pagerank(settings.PAGERANK_PATH, mmap_mode='r')
+graph_edges = bool(getattr(settings, 'GRAPH_EDGES_PATH', None))
+if graph_edges:
+    graph.load_edges(settings.GRAPH_EDGES_PATH)
+transport = HttpTransport(
+    pool_size=getattr(settings, 'SOLR_POOL_SIZE', 10),
+    timeout=getattr(settings, 'SOLR_TIMEOUT', 60),
+    max_retries=getattr(settings, 'SOLR_MAX_RETRIES', 3))
+candidate_cache = None
+if getattr(settings, 'CANDIDATE_CACHE_SIZE', None):
+    candidate_cache = CandidateCache(
+        max_bytes=settings.CANDIDATE_CACHE_SIZE*1024*1024,
+        ttl=getattr(settings, 'CANDIDATE_CACHE_TTL', None))
 tagger = None
 classifier = None
-if settings.SOLR_COLLECTION:
-    tagger = Tagger(settings.SOLR_COLLECTION, bow, graph)
+if getattr(settings, 'LEXICON_PATH', None):
+    tagger = Tagger(None, bow, graph, backend=LexiconTagBackend(Lexicon(settings.LEXICON_PATH)),
+                    windowed=getattr(settings, 'WINDOWED_TAGGING', False),
+                    candidate_cache=candidate_cache, graph_edges=graph_edges)
+elif settings.SOLR_COLLECTION:
+    tagger = Tagger(settings.SOLR_COLLECTION, bow, graph, transport=transport,
+                    windowed=getattr(settings, 'WINDOWED_TAGGING', False),
+                    candidate_cache=candidate_cache, graph_edges=graph_edges)
+if tagger:
     classifier = SimpleTagClassifier(tagger)
     if settings.CLASSIFIER_PATH:
         classifier.load(settings.CLASSIFIER_PATH)
+annotation_cache = None
+if getattr(settings, 'ANNOTATION_CACHE_SIZE', None):
+    annotation_cache = AnnotationCache(lambda: model_version(bow, graph, classifier),
+        max_entries=settings.ANNOTATION_CACHE_SIZE,
+        path=getattr(settings, 'ANNOTATION_CACHE_PATH', None))
 
 def jsonp(view):
     """
@@ -69,15 +102,20 @@ def jsonp(view):
 @jsonp
 def annotate_api(args):
     text = args['query']
-    if not classifier:
-        mentions = tagger.tag_and_rank(text)
-    else:
-        mentions = classifier.create_mentions(text)
-        classifier.classify_mentions(mentions)
+    annotations = annotation_cache.get(text) if annotation_cache else None
+    if annotations is None:
+        if not classifier:
+            mentions = tagger.tag_and_rank(text)
+        else:
+            mentions = classifier.create_mentions(text)
+            classifier.classify_mentions(mentions)
+        annotations = [m.json() for m in mentions]
+        if annotation_cache:
+            annotation_cache.put(text, annotations)
 
     return {
         'text':text,
-        'annotations': [m.json() for m in mentions]
+        'annotations': annotations
     }
 
 @route('/api/nif', method=['GET','POST'])
@@ -102,6 +140,16 @@ def nif_api(*args, **kwargs):
     response.set_header('content-type', content_format)
     return nif_doc.dumps()
 
+@route('/api/stats', method=['GET'])
+@jsonp
+def stats_api(args):
+    return {
+        'solr_transport': transport.pool_stats(),
+        'candidate_cache': candidate_cache.stats() if candidate_cache else None,
+        'annotation_cache': annotation_cache.stats() if annotation_cache else None,
+        'language_model': bow.cache_stats(),
+    }
+
 @route('/')
 def home():
     return static_file('index.html', root=os.path.join(tapioca_dir, 'html/'))
@@ -0,0 +1,155 @@
+"""
+ASGI version of the web app, which handles many requests concurrently
+in a single process. Run it with any ASGI server, for instance:
+
+    uvicorn asgi:app --port 8457
+
+This requires aiohttp to be installed.
+"""
+import asyncio
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+from pynif import NIFCollection
+import settings
+
+from app import bow, tagger, classifier, transport, candidate_cache, annotation_cache
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(max_workers=getattr(settings, 'RANKING_THREADS', None))
+
+async def read_body(receive):
+    """
+    Reads the entire body of an HTTP request.
+    """
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+    return body
+
+async def send_response(send, status, body, content_type='application/json'):
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', content_type.encode('utf-8')),
+            (b'content-length', str(len(body)).encode('utf-8')),
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+def request_args(scope, body):
+    """
+    Collects the arguments of the request, from the form body
+    and the query string (which takes precedence).
+    """
+    args = {}
+    headers = dict(scope.get('headers') or [])
+    if headers.get(b'content-type', b'').startswith(b'application/x-www-form-urlencoded'):
+        args.update(parse_qsl(body.decode('utf-8')))
+    args.update(parse_qsl(scope.get('query_string', b'').decode('utf-8')))
+    return args
+
+async def annotate(args):
+    text = args['query']
+    annotations = annotation_cache.get(text) if annotation_cache else None
+    if annotations is None:
+        if not classifier:
+            mentions = await tagger.tag_and_rank_async(text, executor=executor)
+        else:
+            mentions = await classifier.create_mentions_async(text, executor=executor)
+            await asyncio.get_running_loop().run_in_executor(executor, classifier.classify_mentions, mentions)
+        annotations = [m.json() for m in mentions]
+        if annotation_cache:
+            annotation_cache.put(text, annotations)
+
+    return {
+        'text':text,
+        'annotations': annotations
+    }
+
+async def annotate_api(scope, receive, send):
+    args = request_args(scope, await read_body(receive))
+    callback = args.get('callback')
+    status_code = 200
+    try:
+        result = await annotate(args)
+    except KeyError as e:
+        logger.exception('Invalid query')
+        result = {'status':'error',
+                'message':'invalid query',
+                'details': str(e)}
+        status_code = 403
+    if callback:
+        await send_response(send, status_code, '%s(%s);' % (callback, json.dumps(result)), 'application/javascript')
+    else:
+        await send_response(send, status_code, json.dumps(result))
+
+async def nif_api(scope, receive, send):
+    headers = dict(scope.get('headers') or [])
+    content_format = headers.get(b'content', b'application/x-turtle').decode('utf-8')
+    query = dict(parse_qsl(scope.get('query_string', b'').decode('utf-8')))
+    # for backwards compatibility we assume that only_matching=true by default
+    only_matching = query.get('only_matching', 'true') == 'true'
+
+    nif_body = await read_body(receive)
+    nif_doc = NIFCollection.loads(nif_body)
+    contexts = list(nif_doc.contexts)
+    all_mentions = await asyncio.gather(*[
+        classifier.create_mentions_async(context.mention, executor=executor)
+        for context in contexts
+    ])
+    await asyncio.get_running_loop().run_in_executor(executor, classifier.classify_mentions_many, all_mentions)
+    for context, mentions in zip(contexts, all_mentions):
+        for mention in mentions:
+            mention.add_phrase_to_nif_context(context, only_matching=only_matching)
+
+    await send_response(send, 200, nif_doc.dumps(), content_format)
+
+async def stats_api(scope, receive, send):
+    await send_response(send, 200, json.dumps({
+        'solr_transport': transport.pool_stats(),
+        'solr_async_transport': tagger.backend.async_transport.pool_stats() if tagger and getattr(tagger.backend, 'async_transport', None) else None,
+        'candidate_cache': candidate_cache.stats() if candidate_cache else None,
+        'annotation_cache': annotation_cache.stats() if annotation_cache else None,
+        'language_model': bow.cache_stats(),
+    }))
+
+routes = {
+    '/api/annotate': annotate_api,
+    '/api/nif': nif_api,
+    '/api/stats': stats_api,
+}
+
+async def lifespan(scope, receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if tagger:
+                await tagger.backend.close()
+            executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(scope, receive, send)
+        return
+    view = routes.get(scope['path'])
+    if view is None:
+        await send_response(send, 404, json.dumps({'status':'error', 'message':'not found'}))
+    elif scope['method'] not in ('GET', 'POST'):
+        await send_response(send, 405, json.dumps({'status':'error', 'message':'method not allowed'}))
+    else:
+        await view(scope, receive, send)
+
+application = app
@@ -0,0 +1,148 @@
+import hashlib
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+
+def model_version(*models):
+    """
+    Combines the versions of the models used to annotate text
+    (language model, graph, classifier…) into a single version.
+    Models which were not loaded from a file have no version.
+    """
+    return '|'.join(str(getattr(model, 'version', None)) for model in models)
+
+class AnnotationCache(object):
+    """
+    A cache of the annotations returned for texts, so that texts
+    which are submitted again (retweets, boilerplate, syndicated news…)
+    are not tagged and classified again.
+
+    Annotations are kept in a bounded in-memory LRU, and optionally in
+    an SQLite database, which survives restarts of the web app.
+
+    Entries are keyed by a hash of the text and of the version of the
+    models. The version is obtained from the version function on each
+    lookup: when it changes (because a model was reloaded), all entries
+    computed with previous models are discarded.
+    """
+
+    def __init__(self, version, max_entries=10000, path=None):
+        """
+        :param version: a function returning the current version of the models,
+            such as a call to model_version
+        :param max_entries: the maximum number of annotated texts kept in memory
+        :param path: the path of the SQLite database storing the annotations
+            on disk, or None to only keep them in memory
+        """
+        self.version = version
+        self.max_entries = max_entries
+        self.path = path
+        self.entries = OrderedDict()
+        self.current_version = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+        self.db = None
+        if path is not None:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute('CREATE TABLE IF NOT EXISTS annotations (key TEXT PRIMARY KEY, version TEXT, annotations TEXT)')
+            self.db.commit()
+
+    def key(self, text, version):
+        """
+        The key under which the annotations of a text are stored.
+        The text is hashed as it is: annotations contain offsets and
+        surface forms, so they cannot be shared between texts which only
+        differ by their case or spacing.
+        """
+        h = hashlib.sha1(version.encode('utf-8'))
+        h.update(b'\0')
+        h.update(text.encode('utf-8'))
+        return h.hexdigest()
+
+    def _check_version(self):
+        """
+        Discards the entries computed with other models
+        if the version of the models has changed.
+        Must be called with the lock held.
+        """
+        version = self.version()
+        if version != self.current_version:
+            if self.current_version is not None:
+                self.invalidations += 1
+            self.entries.clear()
+            if self.db is not None:
+                self.db.execute('DELETE FROM annotations WHERE version != ?', (version,))
+                self.db.commit()
+            self.current_version = version
+        return version
+
+    def get(self, text):
+        """
+        Returns the cached annotations of a text, or None if they are not cached.
+        """
+        with self._lock:
+            version = self._check_version()
+            key = self.key(text, version)
+            annotations = self.entries.get(key)
+            if annotations is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return annotations
+            if self.db is not None:
+                row = self.db.execute('SELECT annotations FROM annotations WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    annotations = json.loads(row[0])
+                    self._put_in_memory(key, annotations)
+                    self.disk_hits += 1
+                    return annotations
+            self.misses += 1
+            return None
+
+    def put(self, text, annotations):
+        """
+        Stores the annotations of a text (as a JSON-serializable list).
+        """
+        with self._lock:
+            version = self._check_version()
+            key = self.key(text, version)
+            self._put_in_memory(key, annotations)
+            if self.db is not None:
+                self.db.execute('INSERT OR REPLACE INTO annotations VALUES (?, ?, ?)',
+                    (key, version, json.dumps(annotations)))
+                self.db.commit()
+
+    def _put_in_memory(self, key, annotations):
+        self.entries[key] = annotations
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Empties the cache, in memory and on disk (statistics are kept).
+        """
+        with self._lock:
+            self.entries.clear()
+            if self.db is not None:
+                self.db.execute('DELETE FROM annotations')
+                self.db.commit()
+
+    def stats(self):
+        """
+        Returns hit rate statistics.
+        """
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': float(self.hits + self.disk_hits) / lookups if lookups else 0.,
+                'invalidations': self.invalidations,
+            }
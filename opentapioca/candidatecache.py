@@ -0,0 +1,107 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+class CandidateCache(object):
+    """
+    An in-memory cache of the Solr documents of candidate items,
+    keyed by Qid, shared by all the requests served by a Tagger.
+
+    The cache is bounded by a memory budget: when it is exceeded, the
+    least recently used documents are evicted. Documents can also expire
+    after a given time, so that updates to the Solr index are eventually
+    picked up.
+    """
+
+    def __init__(self, max_bytes=256*1024*1024, ttl=None):
+        """
+        :param max_bytes: the memory budget of the cache. The size of a document
+            is estimated from the length of its JSON serialization.
+        :param ttl: the number of seconds after which a document expires, or None
+            if documents never expire.
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.docs = OrderedDict()
+        self.nb_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._lock = threading.Lock()
+
+    def get_many(self, qids):
+        """
+        Looks up the documents of the given items.
+
+        :returns: a pair made of the list of documents found in the cache,
+            and the list of qids which were not found.
+        """
+        found = []
+        missing = []
+        now = time.monotonic()
+        with self._lock:
+            for qid in qids:
+                entry = self.docs.get(qid)
+                if entry is not None and self.ttl is not None and now - entry[2] > self.ttl:
+                    self._remove(qid)
+                    self.expirations += 1
+                    entry = None
+                if entry is None:
+                    missing.append(qid)
+                    self.misses += 1
+                else:
+                    self.docs.move_to_end(qid)
+                    found.append(entry[0])
+                    self.hits += 1
+        return found, missing
+
+    def put_many(self, docs):
+        """
+        Adds documents to the cache, evicting the least
+        recently used ones if the memory budget is exceeded.
+        """
+        now = time.monotonic()
+        with self._lock:
+            for doc in docs:
+                size = len(json.dumps(doc))
+                if size > self.max_bytes:
+                    continue
+                if doc['id'] in self.docs:
+                    self._remove(doc['id'])
+                self.docs[doc['id']] = (doc, size, now)
+                self.nb_bytes += size
+            while self.nb_bytes > self.max_bytes:
+                qid = next(iter(self.docs))
+                self._remove(qid)
+                self.evictions += 1
+
+    def _remove(self, qid):
+        doc, size, _ = self.docs.pop(qid)
+        self.nb_bytes -= size
+
+    def clear(self):
+        """
+        Empties the cache (statistics are kept).
+        """
+        with self._lock:
+            self.docs.clear()
+            self.nb_bytes = 0
+
+    def stats(self):
+        """
+        Returns hit rate and eviction statistics.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'documents': len(self.docs),
+                'bytes': self.nb_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': float(self.hits) / lookups if lookups else 0.,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
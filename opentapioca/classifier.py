@@ -1,12 +1,14 @@
+import json
 import numpy
 import logging
+import multiprocessing
 from collections import defaultdict
-from sklearn import svm
-from sklearn import preprocessing
-from sklearn.pipeline import Pipeline
+from .linearscorer import LinearScorer
 from .similarities import EdgeRatioSimilarity
 from .similarities import OneStepSimilarity
 from .similarities import DirectLinkSimilarity
+from .similarities import similarity_matrix
+from .utils import file_version
 import pickle
 
 logger = logging.getLogger(__name__)
@@ -14,7 +16,12 @@ logger = logging.getLogger(__name__)
 class SimpleTagClassifier(object):
     """
     A linear support vector classifier to predict the validity of a tag in a mention.
+
+    Training requires scikit-learn, which is only imported when needed:
+    a classifier exported to JSON (see export) is loaded and run with Numpy only.
     """
+    # the parameters saved along with the weights in exported classifiers
+    exported_parameters = ['beta', 'nb_steps', 'C', 'max_similarity_distance', 'similarity_smoothing', 'similarity']
     def __init__(self, tagger, beta=0.85, nb_steps=2, C=0.001, max_similarity_distance=100, similarity_smoothing=0.1, similarity="direct_link"):
         self.tagger = tagger
         self.beta = beta
@@ -23,13 +30,20 @@ class SimpleTagClassifier(object):
         self.identifier_space = 'http://www.wikidata.org/entity/'
         self.similarity = similarity
         self.max_similarity_distance = max_similarity_distance
-        if similarity == "direct_link":
-            self.similarity_method = DirectLinkSimilarity()
-        elif similarity == "edge_ratio":
-            self.similarity_method = EdgeRatioSimilarity()
-        else:
-            self.similarity_method = OneStepSimilarity(beta)
+        self.similarity_method = self.create_similarity_method()
         self.similarity_smoothing = similarity_smoothing
+        self.version = None
+
+    def create_similarity_method(self):
+        """
+        Creates the similarity measure selected by the similarity parameter.
+        """
+        if self.similarity == "direct_link":
+            return DirectLinkSimilarity()
+        elif self.similarity == "edge_ratio":
+            return EdgeRatioSimilarity()
+        else:
+            return OneStepSimilarity(self.beta)
 
     def feature_vectors_from_mention(self, mention):
         """
@@ -52,14 +66,49 @@ class SimpleTagClassifier(object):
 
     def load(self, fname):
         """
-        Loads the classifier from a file (.pkl format).
-        The tagger must be restored manually afterwards.
+        Loads the classifier from a file (.pkl format, or .json
+        format as written by export). The tagger must be restored
+        manually afterwards.
         """
-        with open(fname, 'rb') as f:
-            dct = pickle.load(f)
-        if 'tagger' in dct:
-            del dct['tagger']
-        self.__dict__.update(dct)
+        if fname.endswith('.json'):
+            with open(fname, 'r') as f:
+                dct = json.load(f)
+            for param in self.exported_parameters:
+                setattr(self, param, dct['parameters'][param])
+            self.similarity_method = self.create_similarity_method()
+            self.fit = LinearScorer.from_json(dct['scorer'])
+        else:
+            with open(fname, 'rb') as f:
+                dct = pickle.load(f)
+            if 'tagger' in dct:
+                del dct['tagger']
+            self.__dict__.update(dct)
+        self.version = file_version(fname)
+
+    def export(self, fname):
+        """
+        Exports the trained classifier to a small JSON file, which can be
+        loaded without scikit-learn. The feature scaling is folded into
+        the weights of the linear classifier.
+        """
+        scorer = self.fit
+        if not isinstance(scorer, LinearScorer):
+            scorer = LinearScorer.from_pipeline(scorer)
+        parameters = {param: getattr(self, param) for param in self.exported_parameters}
+        # describe the similarity measure which is actually used
+        # (it was not updated with the parameters by earlier versions)
+        if isinstance(self.similarity_method, DirectLinkSimilarity):
+            parameters['similarity'] = 'direct_link'
+        elif isinstance(self.similarity_method, EdgeRatioSimilarity):
+            parameters['similarity'] = 'edge_ratio'
+        else:
+            parameters['similarity'] = 'one_step'
+            parameters['beta'] = self.similarity_method.beta
+        with open(fname, 'w') as f:
+            json.dump({
+                'parameters': parameters,
+                'scorer': scorer.json(),
+            }, f, indent=1)
 
     def save(self, fname):
         """
@@ -72,13 +121,25 @@ class SimpleTagClassifier(object):
 
     def create_mentions(self, phrase):
         """
-        Runs the Solr tagger to create the mentions
-        and compute the similarities between them.
+        Runs the Solr tagger to create the mentions. The similarities
+        between them are computed when they are classified.
         """
-        mentions = self.tagger.tag_and_rank(phrase)
-        for mention in mentions:
-            self.compute_similarities(mention, mentions)
-        return mentions
+        return self.tagger.tag_and_rank(phrase)
+
+    async def create_mentions_async(self, phrase, executor=None):
+        """
+        Asynchronous version of create_mentions.
+        """
+        return await self.tagger.tag_and_rank_async(phrase, executor=executor)
+
+    def create_mentions_many(self, phrases, max_workers=None):
+        """
+        Same as create_mentions, for many documents at once.
+        The documents are tagged concurrently.
+
+        :returns: the list of mentions of each document, in the same order as the input
+        """
+        return self.tagger.tag_and_rank_many(phrases, max_workers=max_workers)
 
     def tag_dataset(self, dataset):
         """
@@ -91,11 +152,25 @@ class SimpleTagClassifier(object):
             docid_to_mentions[docid] = self.create_mentions(context.mention)
         return docid_to_mentions
 
-    def crossfit_model(self, dataset, parameters=None, max_iter=100):
+    def crossfit_model(self, dataset, parameters=None, max_iter=100, jobs=1, mention_store=None):
         """
         Learns the model and report F1 score
         with cross-validation.
+
+        The parameter settings are grouped by the parameters which change the
+        similarities between tags: the similarities are computed once per group,
+        and the propagated features once per setting of the parameters other than C.
+        Groups are evaluated in parallel by forked processes, which share the
+        tagged documents.
+
+        :param parameters: the list of parameter settings to evaluate
+        :param max_iter: the maximum number of iterations of the final training
+        :param jobs: the number of processes evaluating parameter settings
+        :param mention_store: a MentionStore where the mentions of the documents
+            are read if they were already tagged, and saved otherwise
+        :returns: the best parameter setting and its F1 score
         """
+        global _crossfit_state
         k = 5
         chunks = [ set() for i in range(k) ]
         for idx, context in enumerate(dataset.contexts):
@@ -110,68 +185,114 @@ class SimpleTagClassifier(object):
         for idx, context in enumerate(all_contexts):
             if idx % 100 == 0:
                 logger.info("{}...".format(idx))
-            docid_to_mentions[str(context.uri)] = self.create_mentions(context.mention)
+            docid = str(context.uri)
+            mentions = mention_store.get(docid) if mention_store is not None else None
+            if mentions is None:
+                mentions = self.create_mentions(context.mention)
+                if mention_store is not None:
+                    mention_store.put(docid, mentions)
+            docid_to_mentions[docid] = mentions
+        if mention_store is not None and mention_store.modified:
+            mention_store.save()
 
         if parameters is None:
             parameters = [{}]
 
-        best_params = {}
-        best_f1 = 0.
-        best_classifier = None
+        # Group the settings by similarity parameters
+        groups = {}
         for idx, param_setting in enumerate(parameters):
-            # Set the parameters
-            for param, val in param_setting.items():
-                setattr(self, param, val)
-
-            # Recompute similarities
-            for uri, mentions in docid_to_mentions.items():
-                for mention in mentions:
-                    self.compute_similarities(mention, mentions)
-
-            # Run cross-validation
-            scores = defaultdict(float)
-            for chunk_id in range(k):
-                training_chunks = all_contexts - chunks[chunk_id]
-                self.train_model(dataset, training_chunks, docid_to_mentions)
-                chunk_scores = self.evaluate_model(chunks[chunk_id], docid_to_mentions)
-                for method, score in chunk_scores.items():
-                    scores[method] += score/k
+            groups.setdefault(self.similarity_key(param_setting), []).append((idx, param_setting))
+
+        _crossfit_state = (self, dataset, chunks, docid_to_mentions)
+        try:
+            if jobs > 1:
+                with multiprocessing.get_context('fork').Pool(jobs) as pool:
+                    results = [result for group_results in pool.imap_unordered(_crossfit_group, groups.values())
+                               for result in group_results]
+            else:
+                results = [result for group in groups.values() for result in _crossfit_group(group)]
+        finally:
+            _crossfit_state = None
+
+        best_idx = None
+        best_f1 = 0.
+        for idx, scores in sorted(results, key=lambda result: result[0]):
             logger.info('----- {}/{}'.format(idx, len(parameters)))
-            logger.info(param_setting)
-            logger.info(dict(scores.items()))
+            logger.info(parameters[idx])
+            logger.info(scores)
             if scores['f1'] > best_f1:
-                print('(best so far)')
-                best_params = param_setting
+                best_idx = idx
                 best_f1 = scores['f1']
-                # Retrain on whole dev set with these parameters
-                self.train_model(dataset, None, docid_to_mentions, max_iter=max_iter)
-                best_classifier = self.fit
-                self.save('data/best_classifier_so_far.pkl')
-            else:
-                self.save('data/latest_classifier.pkl')
 
+        if best_idx is None:
+            self.fit = None
+            return {}, best_f1
 
-        self.fit = best_classifier
-        # Fix Issue #59: set the best parameters  
-        for param, val in best_params.items():
-            setattr(self, param, val)
+        # Fix Issue #59: set the best parameters
+        best_params = parameters[best_idx]
+        self.set_parameters(best_params)
+        # Retrain on whole dev set with these parameters
+        self.train_model(dataset, None, docid_to_mentions, max_iter=max_iter)
         return best_params, best_f1
 
-    def train_model(self, dataset, docids=None, docid_to_mentions=None, max_iter=100):
+    def similarity_key(self, param_setting):
+        """
+        The values of the parameters which change the similarities
+        between tags, in a parameter setting (or in the current parameters
+        of the classifier, for the parameters which are not set).
+        """
+        params = {param: param_setting.get(param, getattr(self, param))
+                  for param in ['similarity', 'beta', 'max_similarity_distance', 'similarity_smoothing']}
+        if params['similarity'] in ('direct_link', 'edge_ratio'):
+            params['beta'] = None
+        return tuple(sorted(params.items()))
+
+    def set_parameters(self, param_setting):
+        """
+        Sets the parameters of the classifier, and updates the similarity measure.
+        """
+        for param, val in param_setting.items():
+            setattr(self, param, val)
+        self.similarity_method = self.create_similarity_method()
+
+    def cross_validate(self, dataset, chunks, docid_to_mentions, docid_to_features=None):
+        """
+        Trains and evaluates the model on each of the chunks of the dataset
+        (training it on the other chunks).
+
+        :returns: a dictionary, mapping each scoring method to its average value
+        """
+        all_contexts = set(dataset.contexts)
+        scores = defaultdict(float)
+        for chunk in chunks:
+            self.train_model(dataset, all_contexts - chunk, docid_to_mentions, docid_to_features=docid_to_features)
+            chunk_scores = self.evaluate_model(chunk, docid_to_mentions, docid_to_features)
+            for method, score in chunk_scores.items():
+                scores[method] += score/len(chunks)
+        return dict(scores.items())
+
+    def train_model(self, dataset, docids=None, docid_to_mentions=None, max_iter=100, docid_to_features=None):
         """
         Train the model on the given NIF dataset, restricting the training
-        to the given document identifiers.
+        to the given documents.
 
+        :param docids: the contexts of the documents to train on (all the
+            documents of the dataset if None)
         :param docid_to_mentions: a map from document ids to pre-computed
             mentions, to avoid re-tagging the dataset multiple times if training
-            is running multiple times.
+            is running multiple times. It can be a MentionStore.
+        :param docid_to_features: a map from document ids to the pre-computed
+            feature vectors of their mentions (see build_feature_vectors_for_doc)
         """
         docid_to_mentions = docid_to_mentions or {}
+        docid_to_features = docid_to_features or {}
 
         design_matrix = []
         classes = []
         nb_valid = 0
         for context in dataset.contexts:
+            if docids is not None and context not in docids:
+                continue
 
             # Obtain all the suggested mentions from the tagger (or the cache)
             mentions = docid_to_mentions.get(str(context.uri))
@@ -179,7 +300,10 @@ class SimpleTagClassifier(object):
                 mentions = self.tagger.tag_and_rank(context.mention)
 
             # Build the feature vectors for these mentions
-            feature_vectors, tag_indices = self.build_feature_vectors_for_doc(mentions)
+            features = docid_to_features.get(str(context.uri))
+            if features is None:
+                features = self.build_feature_vectors_for_doc(mentions)
+            feature_vectors, tag_indices = features
 
             # Match the phrases in the dataset to mentions and mark them as valid
             mention_index = {
@@ -211,6 +335,11 @@ class SimpleTagClassifier(object):
             print('No positive sample found, exiting')
             return
 
+        # Imported here, so that trained classifiers can run without scikit-learn
+        from sklearn import svm
+        from sklearn import preprocessing
+        from sklearn.pipeline import Pipeline
+
         scaler = preprocessing.StandardScaler()
         clf = svm.LinearSVC(class_weight='balanced',C=self.C, max_iter=max_iter)
         pipeline = Pipeline([('scaler',scaler),('svm',clf)])
@@ -218,11 +347,15 @@ class SimpleTagClassifier(object):
         fit = pipeline.fit(design_matrix, classes)
         self.fit = fit
 
-    def evaluate_model(self, contexts, docid_to_mentions=None):
+    def evaluate_model(self, contexts, docid_to_mentions=None, docid_to_features=None):
         """
         Returns performance metrics for the learned model on the given dataset
 
         :param ids: restricts the evaluation to the given context ids
+        :param docid_to_mentions: a map from document ids to pre-computed
+            mentions (or a MentionStore)
+        :param docid_to_features: a map from document ids to the pre-computed
+            feature vectors of their mentions
         :returns: a dictionary, mapping each scoring method to its value (precision, recall, f1)
         """
         nb_valid_predictions = 0
@@ -238,7 +371,11 @@ class SimpleTagClassifier(object):
             }
             nb_item_judgments += len(mention_id_to_qid)
             mentions = docid_to_mentions[context_id]
-            self.classify_mentions(mentions)
+            features = (docid_to_features or {}).get(context_id)
+            if features is None:
+                self.classify_mentions(mentions)
+            else:
+                self.classify_features([mentions], [features])
             for mention in mentions:
                 mention_id = mention.key()
                 target_item = mention_id_to_qid.get(mention_id)
@@ -259,117 +396,188 @@ class SimpleTagClassifier(object):
                 'f1':f1
                 }
 
-    def build_feature_vectors_for_doc(self, mentions):
+    def build_feature_vectors_for_doc(self, mentions, similarities=None):
         """
         Given a list of mentions, create the matrix
         of input vectors for each of the tags in these
         mentions, with a dict mapping tag ids to row
         indices
+
+        :param similarities: the similarity matrix of the mentions,
+            computed with compute_similarity_matrix if it is not provided
         """
         # Build matrix of raw feature vectors
-        all_feature_vectors = {}
-        for mention in mentions:
-            all_feature_vectors.update(self.feature_vectors_from_mention(mention))
-
-        if not all_feature_vectors:
-            return [], {}
-
-        feature_array = []
-
+        raw_features = []
         tag_key_to_idx = {}
         for mention in mentions:
+            mention_features = self.feature_vectors_from_mention(mention)
             for tag in mention.tags:
                 tag_key = mention.tag_key(tag.id)
-                tag_key_to_idx[tag_key] = len(feature_array)
-                feature_array.append(all_feature_vectors[tag_key])
+                tag_key_to_idx[tag_key] = len(raw_features)
+                raw_features.append(mention_features[tag_key])
 
-        feature_array = numpy.array(feature_array)
+        if not raw_features:
+            return [], {}
 
-        # Build graph adjacency matrix
-        adj_matrix = numpy.zeros(shape=(len(feature_array),len(feature_array)))
-        for mention in mentions:
-            for tag in mention.tags:
-                tag_idx = tag_key_to_idx[mention.tag_key(tag.id)]
-                for similarity in tag.similarities:
-                    if not similarity['tag'] in tag_key_to_idx:
-                        continue # the tag was pruned
-                    other_tag_idx = tag_key_to_idx[similarity['tag']]
-                    adj_matrix[other_tag_idx,tag_idx] = similarity['score']
+        raw_features = numpy.array(raw_features, dtype=float)
+        nb_features = raw_features.shape[1]
 
-        mixed_features = feature_array
-        mixed_features_array = [feature_array]
-        mixed_features = mixed_features.astype(float)
+        # Build graph adjacency matrix: the similarities of the other
+        # tags to each tag (the transpose of the CSR matrix is in CSC format,
+        # so the products below only visit its non-zero similarities)
+        if similarities is None:
+            similarities = self.compute_similarity_matrix(mentions)
+        adj_matrix = similarities.T
 
+        # Propagate the features along the similarities
+        feature_array = numpy.empty((len(raw_features), nb_features * (self.nb_steps + 1)))
+        feature_array[:, :nb_features] = raw_features
+        mixed_features = raw_features
         for i in range(self.nb_steps):
-            mixed_features = numpy.dot(adj_matrix, mixed_features)
-            mixed_features_array.append(mixed_features)
-        feature_array = numpy.hstack(mixed_features_array)
+            mixed_features = adj_matrix.dot(mixed_features)
+            feature_array[:, (i+1)*nb_features:(i+2)*nb_features] = mixed_features
 
         return feature_array, tag_key_to_idx
 
-    def classify_mentions(self, mentions):
+    def classify_mentions(self, mentions, similarities=None):
         """
         Given a list of mentions for a document,
         run the classifier on them and annotate
         them with their scores and decisions
+
+        :param similarities: the similarity matrix of the mentions, if it was pre-computed
         """
-        feature_array, tag_key_to_idx = self.build_feature_vectors_for_doc(mentions)
+        self.classify_mentions_many([mentions], None if similarities is None else [similarities])
+
+    def classify_mentions_many(self, all_mentions, all_similarities=None):
+        """
+        Same as classify_mentions, for a list of documents
+        (each represented by its list of mentions). The feature
+        vectors of all documents are stacked so that the classifier
+        is run only once.
+
+        :param all_similarities: the similarity matrices of the documents, if they were pre-computed
+        """
+        if all_similarities is None:
+            all_similarities = [None] * len(all_mentions)
+        self.classify_features(all_mentions, [
+            self.build_feature_vectors_for_doc(mentions, similarities)
+            for mentions, similarities in zip(all_mentions, all_similarities)
+        ])
+
+    def classify_features(self, all_mentions, all_features):
+        """
+        Runs the classifier on the feature vectors of the mentions of
+        documents, as returned by build_feature_vectors_for_doc.
+        """
+        feature_arrays = []
+        offsets = []
+        nb_rows = 0
+        for feature_array, tag_key_to_idx in all_features:
+            offsets.append((nb_rows, tag_key_to_idx))
+            if tag_key_to_idx:
+                feature_arrays.append(feature_array)
+                nb_rows += len(feature_array)
 
         logger.debug('Classifying mentions')
-        if tag_key_to_idx:
-            predicted_classes = self.fit.decision_function(feature_array)
+        if feature_arrays:
+            predicted_classes = self.fit.decision_function(numpy.vstack(feature_arrays))
         nb_tags = 0
 
-        for mention in mentions:
-            start = mention.start
-            end = mention.end
-            max_score = 0
-            best_tag = None
-            best_tag_label = None
-            for tag in mention.tags:
-                nb_tags += 1
-                tag_key = (start, end, tag.id)
-                tag.score = predicted_classes[tag_key_to_idx[tag_key]]
-                if tag.score > max_score:
-                    max_score = tag.score
-                    best_tag = tag.id
-                    best_tag_label = tag.label
-            mention.best_qid = best_tag
-            mention.best_tag_label = best_tag_label
+        for mentions, (offset, tag_key_to_idx) in zip(all_mentions, offsets):
+            for mention in mentions:
+                start = mention.start
+                end = mention.end
+                max_score = 0
+                best_tag = None
+                best_tag_label = None
+                for tag in mention.tags:
+                    nb_tags += 1
+                    tag_key = (start, end, tag.id)
+                    tag.score = predicted_classes[offset + tag_key_to_idx[tag_key]]
+                    if tag.score > max_score:
+                        max_score = tag.score
+                        best_tag = tag.id
+                        best_tag_label = tag.label
+                mention.best_qid = best_tag
+                mention.best_tag_label = best_tag_label
         logger.debug('Mentions classified ({} tags)'.format(nb_tags))
 
-    def compute_similarities(self, mention, all_mentions):
+    def compute_similarity_matrix(self, mentions):
         """
-        Compute similarity on each tag of a mention, to other tags in the same document
+        Computes the similarities between the tags of the mentions of a document,
+        as a sparse matrix indexed by the tags of all mentions, in order.
+        See similarities.similarity_matrix.
         """
-        start = mention.start
-        end = mention.end
-        for tag in mention.tags:
-            similarities = [{'tag':mention.tag_key(tag.id), 'score':self.similarity_smoothing}]
-            other_tag_ids = []
-            for other_mention in all_mentions:
-                other_start = other_mention.start
-                other_end = other_mention.end
-                distance = max(start - other_end, other_start - end)
-                # distance = abs((other_end + other_start - end - start) / 2)
-                if (other_start == start and other_end == end) or distance > self.max_similarity_distance:
-                    continue
-                for other_tag in other_mention.tags:
-                    other_tag_id = other_mention.tag_key(other_tag.id)
-                    similarity = self.similarity_smoothing + self.similarity_method.compute_similarity(tag, other_tag)
-                    similarity *= float(self.max_similarity_distance - distance) / self.max_similarity_distance
-                    other_tag_ids.append(other_tag_id)
-                    if similarity > 0.:
-                        similarities.append(
-                                {'tag': other_tag_id,
-                                 'score': similarity })
-
-            # Normalize
-            weight_sum = sum(similarity['score'] for similarity in similarities)
-
-            if weight_sum > 0.:
-                tag.similarities = [
-                        {'tag':sim['tag'],'score': sim['score']/weight_sum}
-                        for sim in similarities
-                ]
+        graph = self.tagger.graph if getattr(self.tagger, 'graph_edges', False) else None
+        return similarity_matrix(mentions, self.similarity_method,
+            self.max_similarity_distance, self.similarity_smoothing, graph=graph)
+
+    def compute_similarities(self, mention, all_mentions, similarities=None):
+        """
+        Compute similarity on each tag of a mention, to other tags in the same document,
+        and stores them in the similarities of the tags, as lists of {'tag':..., 'score':...} dicts.
+        The classifier itself uses the matrix returned by compute_similarity_matrix.
+
+        :param similarities: the similarity matrix of all_mentions, as returned by
+            compute_similarity_matrix. It should be computed once and passed when this
+            method is called for each mention of a document: otherwise it is computed again.
+        """
+        matrix = similarities
+        if matrix is None:
+            matrix = self.compute_similarity_matrix(all_mentions)
+        tag_keys = [
+            other_mention.tag_key(tag.id)
+            for other_mention in all_mentions
+            for tag in other_mention.tags
+        ]
+        offset = 0
+        for other_mention in all_mentions:
+            if other_mention is mention:
+                break
+            offset += len(other_mention.tags)
+        for idx, tag in enumerate(mention.tags, offset):
+            row = matrix.getrow(idx)
+            # the similarity of the tag to itself comes first
+            tag.similarities = [{'tag': tag_keys[idx], 'score': float(matrix[idx, idx])}] + [
+                {'tag': tag_keys[other_idx], 'score': float(score)}
+                for other_idx, score in sorted(zip(row.indices, row.data))
+                if other_idx != idx
+            ]
+
 
+# The classifier, dataset, chunks and tagged documents of the running
+# grid search, inherited by the forked worker processes
+_crossfit_state = None
+
+def _crossfit_group(settings):
+    """
+    Cross-validates parameter settings which share their similarity parameters.
+
+    :param settings: a list of (index, parameter setting) pairs
+    :returns: a list of (index, scores) pairs
+    """
+    classifier, dataset, chunks, docid_to_mentions = _crossfit_state
+    classifier.set_parameters(settings[0][1])
+    docid_to_similarities = {
+        uri: classifier.compute_similarity_matrix(mentions)
+        for uri, mentions in docid_to_mentions.items()
+    }
+
+    # Group the settings by the parameters which change the features
+    feature_groups = {}
+    for idx, param_setting in settings:
+        feature_key = tuple(sorted((param, repr(val)) for param, val in param_setting.items() if param != 'C'))
+        feature_groups.setdefault(feature_key, []).append((idx, param_setting))
+
+    results = []
+    for group in feature_groups.values():
+        classifier.set_parameters(group[0][1])
+        docid_to_features = {
+            uri: classifier.build_feature_vectors_for_doc(mentions, docid_to_similarities[uri])
+            for uri, mentions in docid_to_mentions.items()
+        }
+        for idx, param_setting in group:
+            classifier.set_parameters(param_setting)
+            results.append((idx, classifier.cross_validate(dataset, chunks, docid_to_mentions, docid_to_features)))
+    return results
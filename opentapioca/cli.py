@@ -3,15 +3,25 @@ import click
 import logging
 import dateutil.parser
 import os
+import shutil
+import numpy
 
 from opentapioca.wikidatagraph import WikidataGraph
+from opentapioca.wikidatagraph import GraphUpdater
 from opentapioca.languagemodel import BOWLanguageModel
+from opentapioca.languagemodel import LanguageModelUpdater
 from opentapioca.taggerfactory import TaggerFactory
 from opentapioca.taggerfactory import CollectionAlreadyExists
 from opentapioca.tagger import Tagger
 from opentapioca.classifier import SimpleTagClassifier
+from opentapioca.mentionstore import MentionStore
 from opentapioca.indexingprofile import IndexingProfile
-from opentapioca.readers.dumpreader import WikidataDumpReader
+from opentapioca.typematcher import TypeMatcher
+from opentapioca.lexicon import Lexicon
+from opentapioca.tagbackends import SolrTagBackend
+from opentapioca.tagbackends import RecordingTagBackend
+from opentapioca.tagbackends import ReplayTagBackend
+from opentapioca.readers.paralleldumpreader import open_dump
 from opentapioca.readers.streamreader import WikidataStreamReader
 from opentapioca.readers.sparqlreader import SparqlReader
 from pynif import NIFCollection
@@ -24,16 +34,53 @@ def cli():
 @click.command()
 @click.argument('filename')
 @click.option('-o', '--outfile', default=None, help='Output file to save the language model to.')
-def train_bow(filename, outfile):
+@click.option('-j', '--jobs', default=1, help='Number of processes counting words in parallel.')
+@click.option('-m', '--max-memory', default=None, type=int, help='Count words approximately, using at most this amount of memory (in MB), and keep the most frequent ones.')
+def train_bow(filename, outfile, jobs, max_memory):
     """
     Trains a bag of words language model from the terms of the entities in a dump.
     """
     if outfile is None:
         offset = 2 if filename.endswith('.json.bz2') else 1
         outfile = '.'.join(filename.split('.')[:-offset]+['bow.pkl'])
-    bow = BOWLanguageModel.train_from_dump(filename)
+    bow = BOWLanguageModel.train_from_dump(filename, jobs=jobs,
+        max_memory=max_memory*1024*1024 if max_memory else None)
+    if max_memory:
+        bounds = bow.word_count.error_bounds()
+        print('Counts overestimated by at most {:.1f} with probability {:.4f}'.format(
+            bounds['max_overcount'], 1 - bounds['delta']))
     bow.save(outfile)
 
+@click.command()
+@click.argument('filename')
+@click.option('-o', '--outdir', default=None, help='Output directory to save the compact language model to.')
+def convert_bow(filename, outdir):
+    """
+    Converts a pickled language model to the compact format, which is memory-mapped by the web app.
+    """
+    if outdir is None:
+        outdir = '.'.join(filename.split('.')[:-1])
+    bow = BOWLanguageModel()
+    bow.load(filename)
+    bow.save_compact(outdir)
+
+@click.command()
+@click.argument('delta_log')
+@click.option('-a', '--after', default=None, help='Start following the stream after the given point in time (in the past)')
+def update_bow(delta_log, after):
+    """
+    Listens to the Wikidata edit stream and appends the changes of labels and aliases
+    to a delta log, which is applied to the language model by the web app.
+    """
+    updater = LanguageModelUpdater(delta_log)
+    if after is not None:
+        after = dateutil.parser.parse(after)
+    with WikidataStreamReader(from_time=after, fetch_previous=True) as stream:
+        for item in stream:
+            qid = item.get('id')
+            updater.update(item, created=qid in stream.created_qids, previous=stream.previous_items.get(qid))
+            stream.created_qids.discard(qid)
+
 @click.command()
 @click.argument('filename')
 def bow_shell(filename):
@@ -49,14 +96,15 @@ def bow_shell(filename):
 @click.command()
 @click.argument('filename')
 @click.option('-o', '--outfile', default=None, help='Output file to save the preprocessed graph to.')
-def preprocess(filename, outfile):
+@click.option('-j', '--jobs', default=1, help='Number of processes decompressing and parsing the dump.')
+def preprocess(filename, outfile, jobs):
     """
     Preprocesses a Wikidata .json.bz2 dump into a TSV format representing its adjacency matrix.
     """
     if outfile is None:
         outfile = '.'.join(filename.split('.')[:-2]+["unsorted.tsv"])
     g = WikidataGraph()
-    g.preprocess_dump(filename, outfile)
+    g.preprocess_dump(filename, outfile, jobs=jobs)
 
 @click.command()
 @click.argument('filename')
@@ -71,20 +119,109 @@ def compile(filename, outfile):
     g.load_from_preprocessed_dump(filename)
     g.save_matrix(outfile)
 
+@click.command()
+@click.argument('filename')
+@click.option('-o', '--outprefix', default=None, help='Prefix of the output files to save the adjacency matrix to.')
+@click.option('-c', '--chunk-size', default=10000000, help='Number of edges sorted in memory at once.')
+@click.option('-j', '--jobs', default=1, help='Number of processes decompressing and parsing the dump.')
+def compile_graph(filename, outprefix, chunk_size, jobs):
+    """
+    Compiles a JSON Wikidata dump to an adjacency matrix stored as memory-mappable Numpy arrays, in one pass.
+    """
+    if outprefix is None:
+        outprefix = '.'.join(filename.split('.')[:-2])
+    chunk_dir = outprefix+'.chunks'
+    WikidataGraph.preprocess_dump_binary(filename, chunk_dir, chunk_size=chunk_size, jobs=jobs)
+    g = WikidataGraph()
+    g.compile_binary_chunks(chunk_dir, outprefix)
+    shutil.rmtree(chunk_dir)
+
 @click.command()
 @click.argument('filename')
 @click.option('-o', '--outfile', default=None, help='Output file to save the pagerank vector to.')
-def compute_pagerank(filename, outfile):
+@click.option('-d', '--damping', default=1., help='Probability of following an edge rather than jumping to a random item.')
+@click.option('-t', '--tolerance', default=1e-10, help='Stop iterating when the L1 distance between two iterations is below this value.')
+@click.option('-m', '--max-iterations', default=100, help='Maximum number of iterations.')
+@click.option('-j', '--threads', default=1, help='Number of threads used to compute the iterations.')
+@click.option('--float32', is_flag=True, help='Compute with single precision floats, using less memory.')
+@click.option('--max-memory', default=None, type=int, help='Memory used to read the blocks of the matrix (in MB).')
+def compute_pagerank(filename, outfile, damping, tolerance, max_iterations, threads, float32, max_memory):
+    """
+    Computes the pagerank of a Wikidata adjacency matrix as represented by a Numpy sparse matrix in NPZ format,
+    or by the prefix of the arrays written by compile-graph.
+    """
+    g = WikidataGraph()
+    if filename.endswith('.npz'):
+        if outfile is None:
+            outfile = '.'.join(filename.split('.')[:-1] + ['pgrank.npy'])
+        g.load_from_matrix(filename)
+    else:
+        if outfile is None:
+            outfile = filename+'.pgrank.npy'
+        g.load_csr(filename)
+    g.compute_pagerank(damping=damping, tolerance=tolerance, max_iterations=max_iterations,
+        dtype=numpy.float32 if float32 else numpy.float64, threads=threads,
+        max_memory=max_memory*1024*1024 if max_memory else None)
+    g.save_pagerank(outfile)
+
+@click.command()
+@click.argument('delta_log')
+@click.option('-a', '--after', default=None, help='Start following the stream after the given point in time (in the past)')
+def update_graph(delta_log, after):
+    """
+    Listens to the Wikidata edit stream and appends the changes of edges of items
+    to a delta log, which is used by refresh-pagerank.
     """
-    Computes the pagerank of a Wikidata adjacency matrix as represented by a Numpy sparse matrix in NPZ format.
+    updater = GraphUpdater(delta_log)
+    if after is not None:
+        after = dateutil.parser.parse(after)
+    with WikidataStreamReader(from_time=after) as stream:
+        for item in stream:
+            updater.update(item)
+
+@click.command()
+@click.argument('graph')
+@click.argument('pagerank')
+@click.argument('delta_log')
+@click.option('-o', '--outfile', default=None, help='Output file to save the refreshed pagerank vector to.')
+@click.option('-d', '--damping', default=1., help='Damping used to compute the pagerank vector.')
+@click.option('-t', '--tolerance', default=1e-10, help='Residuals below this value divided by the number of items are not propagated.')
+@click.option('-m', '--max-iterations', default=100, help='Maximum number of iterations.')
+def refresh_pagerank(graph, pagerank, delta_log, outfile, damping, tolerance, max_iterations):
+    """
+    Updates a pagerank vector computed on a graph (NPZ matrix or prefix of the arrays
+    written by compile-graph) with the changes of edges recorded by update-graph.
     """
     if outfile is None:
-        outfile = '.'.join(filename.split('.')[:-1] + ['pgrank.npy'])
+        outfile = '.'.join(pagerank.split('.')[:-1] + ['refreshed.npy'])
     g = WikidataGraph()
-    g.load_from_matrix(filename)
-    g.compute_pagerank()
+    if graph.endswith('.npz'):
+        g.load_from_matrix(graph)
+    else:
+        g.load_csr(graph)
+    g.load_pagerank(pagerank)
+    rows, delta = g.apply_edge_deltas(delta_log)
+    g.refresh_pagerank(rows, delta, damping=damping, tolerance=tolerance, max_iterations=max_iterations)
     g.save_pagerank(outfile)
 
+@click.command()
+@click.argument('filename')
+@click.option('-o', '--outprefix', default=None, help='Prefix of the output files to save the edges to.')
+@click.option('--weights', is_flag=True, help='Also export the weights of the edges, for compute-pagerank.')
+def export_edges(filename, outprefix, weights):
+    """
+    Exports the edges of a Wikidata adjacency matrix in NPZ format to arrays which can be memory-mapped by the web app,
+    or by compute-pagerank if the weights are exported.
+    """
+    if outprefix is None:
+        outprefix = '.'.join(filename.split('.')[:-1] + ['edges'])
+    g = WikidataGraph()
+    g.load_from_matrix(filename)
+    if weights:
+        g.save_csr(outprefix)
+    else:
+        g.save_edges(outprefix)
+
 @click.command()
 @click.argument('filename')
 def pagerank_shell(filename):
@@ -104,7 +241,8 @@ def pagerank_shell(filename):
 @click.option('-p', '--profile', help='Filename of the indexing profile to use')
 @click.option('-s', '--shards', default=1, help='Number of shards to use when creating the collection, if needed')
 @click.option('-k', '--skip', default=0, help='Number of documents to skip because they are already indexed')
-def index_dump(collection_name, filename, profile, shards, skip, solr='http://localhost:8983/solr/'):
+@click.option('-j', '--jobs', default=1, help='Number of processes decompressing and parsing the dump.')
+def index_dump(collection_name, filename, profile, shards, skip, jobs, solr='http://localhost:8983/solr/'):
     """
     Indexes a Wikidata dump in a new Solr collection with the given name.
     """
@@ -114,7 +252,7 @@ def index_dump(collection_name, filename, profile, shards, skip, solr='http://lo
         tagger.create_collection(collection_name, num_shards=shards, configset=indexing_profile.solrconfig)
     except CollectionAlreadyExists:
         pass
-    dump = WikidataDumpReader(filename)
+    dump = open_dump(filename, jobs=jobs)
     tagger.index_stream(collection_name, dump, indexing_profile,
                         batch_size=2000, commit_time=10, delete_excluded=False, skip_docs=skip)
 
@@ -160,6 +298,22 @@ def index_stream(collection_name, profile, shards, after, solr='http://localhost
     tagger.index_stream(collection_name, stream, indexing_profile,
                         batch_size=50, commit_time=1, delete_excluded=True)
 
+@click.command()
+@click.argument('filename')
+@click.option('-p', '--profile', help='Filename of the indexing profile to use')
+@click.option('-o', '--outdir', default=None, help='Directory where the lexicon should be written.')
+@click.option('-j', '--jobs', default=1, help='Number of processes decompressing and parsing the dump.')
+def build_lexicon(filename, profile, outdir, jobs):
+    """
+    Compiles the items of a Wikidata dump into a lexicon, which can be used to tag text without Solr.
+    """
+    if outdir is None:
+        outdir = '.'.join(filename.split('.')[:-2]+['lexicon'])
+    indexing_profile = IndexingProfile.load(profile)
+    type_matcher = TypeMatcher()
+    with open_dump(filename, jobs=jobs) as reader:
+        Lexicon.build((indexing_profile.entity_to_document(item, type_matcher) for item in reader), outdir)
+
 @click.command()
 @click.argument('collection_name')
 def delete_collection(collection_name, solr='http://localhost:8983/solr/'):
@@ -171,9 +325,13 @@ def delete_collection(collection_name, solr='http://localhost:8983/solr/'):
 @click.option('-b', '--bow', default=None, help='Path of the trained bag of words language model (.pkl file)')
 @click.option('-p', '--pagerank', default=None, help='Path of the trained PageRank (.npy file)')
 @click.option('-d', '--dataset', default=None, help='Path to the NIF dataset to use as training dataset.')
-@click.option('-o', '--output', default=None, help='Path where the trained classifier should be written.')
+@click.option('-o', '--output', default=None, help='Path where the trained classifier should be written (.pkl, or .json to export it).')
 @click.option('-m', '--max-iter', default=500, help='Maximum number of iterations for SVM training.')
-def train_classifier(collection, bow, pagerank, dataset, output, max_iter):
+@click.option('--record', default=None, help='Record the responses of Solr to this file, to replay them later.')
+@click.option('--replay', default=None, help='Replay responses recorded with --record instead of querying Solr.')
+@click.option('-j', '--jobs', default=1, help='Number of processes evaluating the parameter settings.')
+@click.option('--mentions', default=None, help='Store the tagged documents in this file (.npz), to train again without tagging them.')
+def train_classifier(collection, bow, pagerank, dataset, output, max_iter, record, replay, jobs, mentions):
     """
     Trains a tag classifier on a NIF dataset.
     """
@@ -183,10 +341,17 @@ def train_classifier(collection, bow, pagerank, dataset, output, max_iter):
     b.load(bow)
     graph = WikidataGraph()
     graph.load_pagerank(pagerank)
-    tagger = Tagger(collection, b, graph)
+    if replay:
+        backend = ReplayTagBackend(replay)
+    else:
+        backend = SolrTagBackend(collection)
+        if record:
+            backend = RecordingTagBackend(backend, record)
+    tagger = Tagger(collection, b, graph, backend=backend)
     d = NIFCollection.load(dataset)
     clf = SimpleTagClassifier(tagger)
     max_iter = int(max_iter)
+    mention_store = MentionStore.for_tagger(mentions, tagger) if mentions else None
 
     parameter_grid = []
     for max_distance in [50, 75, 150, 200]:
@@ -202,22 +367,46 @@ def train_classifier(collection, bow, pagerank, dataset, output, max_iter):
                         'similarity_smoothing': smoothing,
                         })
 
-    best_params = clf.crossfit_model(d, parameter_grid, max_iter=max_iter)
+    best_params = clf.crossfit_model(d, parameter_grid, max_iter=max_iter, jobs=jobs, mention_store=mention_store)
     print('#########')
     print(best_params)
-    clf.save(output)
+    if output.endswith('.json'):
+        clf.export(output)
+    else:
+        clf.save(output)
+
+@click.command()
+@click.argument('filename')
+@click.option('-o', '--output', default=None, help='Path where the exported classifier should be written.')
+def export_classifier(filename, output):
+    """
+    Exports a trained classifier (.pkl file) to a small JSON file, which the web app loads without scikit-learn.
+    """
+    if output is None:
+        output = '.'.join(filename.split('.')[:-1] + ['json'])
+    clf = SimpleTagClassifier(None)
+    clf.load(filename)
+    clf.export(output)
 
 cli.add_command(train_bow)
 cli.add_command(bow_shell)
+cli.add_command(convert_bow)
+cli.add_command(update_bow)
 cli.add_command(preprocess)
 cli.add_command(compile)
+cli.add_command(compile_graph)
 cli.add_command(compute_pagerank)
+cli.add_command(update_graph)
+cli.add_command(refresh_pagerank)
+cli.add_command(export_edges)
 cli.add_command(pagerank_shell)
 cli.add_command(index_dump)
 cli.add_command(index_sparql)
 cli.add_command(index_stream)
+cli.add_command(build_lexicon)
 cli.add_command(delete_collection)
 cli.add_command(train_classifier)
+cli.add_command(export_classifier)
 
 if __name__ == '__main__':
     cli()
@@ -0,0 +1,200 @@
+import heapq
+import math
+import numpy
+from collections import Counter
+
+FNV_OFFSET = numpy.uint64(0xcbf29ce484222325)
+FNV_PRIME = numpy.uint64(0x100000001b3)
+
+# words longer than this (in bytes) are hashed one at a time
+MAX_VECTORIZED_LENGTH = 64
+
+def fnv1a(data):
+    """
+    The 64-bit FNV-1a hash of a byte string.
+    """
+    h = int(FNV_OFFSET)
+    for byte in data:
+        h = ((h ^ byte) * int(FNV_PRIME)) & 0xffffffffffffffff
+    return h
+
+def hash_words(words):
+    """
+    Computes two 64-bit hashes of each word: the FNV-1a hash of its
+    UTF-8 encoding, and a SplitMix64 mix of it. The words of the same
+    length are hashed together, one byte position at a time, so that
+    no word is padded to the length of the longest one.
+
+    :returns: a pair of arrays of hashes
+    """
+    encoded = [word.encode('utf-8') for word in words]
+    lengths = numpy.array([len(data) for data in encoded], dtype=numpy.int64)
+    h1 = numpy.full(len(encoded), FNV_OFFSET, dtype=numpy.uint64)
+    for length in numpy.unique(lengths).tolist():
+        indices = numpy.flatnonzero(lengths == length)
+        if length > MAX_VECTORIZED_LENGTH:
+            for idx in indices.tolist():
+                h1[idx] = fnv1a(encoded[idx])
+            continue
+        chars = numpy.frombuffer(b''.join(encoded[idx] for idx in indices.tolist()),
+            dtype=numpy.uint8).reshape(len(indices), length)
+        h = h1[indices]
+        for i in range(length):
+            h = (h ^ chars[:, i].astype(numpy.uint64)) * FNV_PRIME
+        h1[indices] = h
+
+    h2 = h1 + numpy.uint64(0x9e3779b97f4a7c15)
+    h2 = (h2 ^ (h2 >> numpy.uint64(30))) * numpy.uint64(0xbf58476d1ce4e5b9)
+    h2 = (h2 ^ (h2 >> numpy.uint64(27))) * numpy.uint64(0x94d049bb133111eb)
+    h2 = h2 ^ (h2 >> numpy.uint64(31))
+    return h1, h2 | numpy.uint64(1)
+
+class ApproximateCounts(object):
+    """
+    Word counts stored in a count-min sketch with conservative updates,
+    which uses a bounded amount of memory whatever the number of words.
+
+    It behaves like the defaultdict of word counts of a language model:
+    counts are read with `counts[word]`, and incremented in batches with
+    `counts.add(word_counts)` (or one at a time with `counts[word] += 1`).
+    Estimated counts are never lower than the true counts, and exceed them
+    by at most epsilon times the total of all counts, with probability 1 - delta.
+
+    The sketch does not store the words themselves: the words whose estimated
+    count reaches the threshold are remembered as candidates, so that they
+    can be listed by items(). The number of candidates is bounded: when
+    there are too many of them, the candidate with the lowest estimate is
+    evicted (as in the Space-Saving algorithm), so the candidates are the words
+    with the highest estimates. A part of max_bytes is reserved for them.
+    """
+
+    #: estimated memory used by each candidate: the word, its dict entry and its heap entry
+    candidate_bytes = 256
+
+    def __init__(self, max_bytes, depth=5, threshold=2, candidate_fraction=0.5):
+        """
+        :param max_bytes: the memory used by the sketch and the candidates
+        :param depth: the number of hash functions. The probability
+            that an estimate exceeds the error bound decreases exponentially with it.
+        :param threshold: the minimum count of the words listed by items()
+        :param candidate_fraction: the part of max_bytes used by the candidates
+        """
+        candidate_budget = int(max_bytes * candidate_fraction)
+        self.max_candidates = max(1, candidate_budget // self.candidate_bytes)
+        self.depth = depth
+        self.width = max(1, (max_bytes - candidate_budget) // (4 * depth))
+        self.table = numpy.zeros((depth, self.width), dtype=numpy.uint32)
+        self.rows = numpy.arange(depth)
+        self.threshold = threshold
+        # estimated count of each candidate, and a min-heap of (count, word) pairs
+        # with one entry per candidate. The counts in the heap can be outdated:
+        # they are only refreshed when the entry reaches the top of the heap.
+        self.candidates = {}
+        self.heap = []
+        self.total_count = 0
+
+    def _cells(self, words):
+        """
+        The columns of each word in each row of the table,
+        obtained by double hashing.
+
+        :returns: an array of shape (number of words, depth)
+        """
+        h1, h2 = hash_words(words)
+        steps = numpy.arange(self.depth, dtype=numpy.uint64)
+        return ((h1[:, None] + steps[None, :] * h2[:, None]) % numpy.uint64(self.width)).astype(numpy.int64)
+
+    def estimates(self, words):
+        """
+        Returns the array of the estimated counts of the given words.
+        """
+        return self.table[self.rows, self._cells(words)].min(axis=1)
+
+    def add(self, word_counts):
+        """
+        Adds counts to words, with conservative updates: each cell of a word
+        is only raised up to the new estimate of its count.
+
+        :param word_counts: a dict mapping words to the counts to add,
+            or an iterable of words (each occurrence adding one)
+        """
+        if not isinstance(word_counts, dict):
+            word_counts = Counter(word_counts)
+        if not word_counts:
+            return
+        words = list(word_counts.keys())
+        counts = numpy.fromiter(word_counts.values(), dtype=numpy.int64, count=len(words))
+        cells = self._cells(words)
+        rows = numpy.broadcast_to(self.rows, cells.shape)
+        current = self.table[rows, cells].astype(numpy.int64)
+        estimates = numpy.minimum(current.min(axis=1) + counts, numpy.iinfo(numpy.uint32).max)
+        numpy.maximum.at(self.table, (rows, cells),
+            numpy.broadcast_to(estimates[:, None], cells.shape).astype(numpy.uint32))
+        self.total_count += int(counts.sum())
+        # words sharing cells may have raised each other's estimates
+        self._update_candidates(words, self.table[rows, cells].min(axis=1))
+
+    def _smallest_candidate(self):
+        """
+        Returns the (count, word) pair of the candidate with the lowest estimate.
+        """
+        while True:
+            count, word = self.heap[0]
+            if self.candidates[word] == count:
+                return count, word
+            heapq.heapreplace(self.heap, (self.candidates[word], word))
+
+    def _update_candidates(self, words, estimates):
+        min_count = self.threshold
+        if len(self.candidates) >= self.max_candidates:
+            min_count = max(min_count, self._smallest_candidate()[0])
+        for idx in numpy.flatnonzero(estimates >= min_count):
+            word = words[idx]
+            count = int(estimates[idx])
+            if word in self.candidates:
+                self.candidates[word] = count
+            elif len(self.candidates) < self.max_candidates:
+                self.candidates[word] = count
+                heapq.heappush(self.heap, (count, word))
+            else:
+                smallest_count, smallest_word = self._smallest_candidate()
+                if count > smallest_count:
+                    heapq.heapreplace(self.heap, (count, word))
+                    del self.candidates[smallest_word]
+                    self.candidates[word] = count
+
+    def __getitem__(self, word):
+        return int(self.estimates([word])[0])
+
+    def __setitem__(self, word, count):
+        """
+        Sets the count of a word, which must not be lower than its current estimate.
+        """
+        current = self[word]
+        if count < current:
+            raise ValueError('Counts of a count-min sketch cannot be decreased')
+        self.add({word: count - current})
+
+    def __contains__(self, word):
+        return self[word] > 0
+
+    def __len__(self):
+        return len(self.candidates)
+
+    def items(self):
+        words = list(self.candidates)
+        for word, count in zip(words, self.estimates(words).tolist()):
+            yield word, count
+
+    def error_bounds(self):
+        """
+        Returns the bounds on the error of the estimated counts: with probability
+        1 - delta, each estimate exceeds the true count by at most max_overcount.
+        """
+        epsilon = math.e / self.width
+        return {
+            'epsilon': epsilon,
+            'delta': math.exp(-self.depth),
+            'max_overcount': epsilon * self.total_count,
+            'total_count': self.total_count,
+        }
@@ -1,10 +1,28 @@
+import bz2
+import json
+import multiprocessing
+import os
 import pickle
+import threading
+import time
+import logging
 
 import re
+import numpy
 from unidecode import unidecode
 from collections import defaultdict
+from functools import lru_cache
+from itertools import islice
 from math import log
 from opentapioca.readers.dumpreader import WikidataDumpReader
+from opentapioca.readers.paralleldumpreader import is_multistream
+from opentapioca.readers.paralleldumpreader import list_partitions
+from opentapioca.readers.paralleldumpreader import split_partition
+from opentapioca.utils import file_version
+from opentapioca.sortedtable import SortedStringTable
+from opentapioca.countmin import ApproximateCounts
+
+logger = logging.getLogger(__name__)
 
 separator_re = re.compile(r'[,\-_/:;!?)]? [,\-_/:;!?(]?')
 
@@ -18,38 +36,193 @@ def tokenize(phrase):
     ]
     return [w for w in words if w]
 
+def phrases_words(phrases):
+    """
+    The set of words of a list of phrases.
+    """
+    words = set()
+    for phrase in phrases:
+        words |= set(tokenize(phrase))
+    return words
+
+def item_words(item):
+    """
+    The set of words of the English label and aliases of
+    a Wikidata item, as counted by the language model.
+    """
+    enlabel = item.get('labels', {}).get('en', {}).get('value')
+    if not enlabel:
+        return set()
+    enaliases = [
+        alias['value']
+        for alias in item.get('aliases', {}).get('en', [])
+    ]
+    return phrases_words(enaliases + [enlabel])
+
+class CompactVocabulary(object):
+    """
+    A read-only mapping from words to their counts, stored as a sorted
+    string table and an array of counts. All files are memory-mapped,
+    so the vocabulary is not loaded in memory and its pages are shared
+    between all the processes which use it.
+
+    As with a defaultdict, words which are not in the vocabulary have a count of 0.
+    Counts can be updated, in which case the differences with the counts
+    stored on disk are kept in memory.
+    """
+
+    def __init__(self, path):
+        self.words = SortedStringTable.load(
+            os.path.join(path, 'words.bin'), os.path.join(path, 'word_offsets.npy'))
+        self.counts = numpy.load(os.path.join(path, 'counts.npy'), mmap_mode='r')
+        self.overlay = {}
+        self.nb_new_words = 0
+
+    def __len__(self):
+        return len(self.words) + self.nb_new_words
+
+    def _stored_count(self, word):
+        idx = self.words.find(word.encode('utf-8'))
+        if idx is None:
+            return None
+        return int(self.counts[idx])
+
+    def __getitem__(self, word):
+        return (self._stored_count(word) or 0) + self.overlay.get(word, 0)
+
+    def __setitem__(self, word, count):
+        stored = self._stored_count(word)
+        if stored is None and word not in self.overlay:
+            self.nb_new_words += 1
+        self.overlay[word] = count - (stored or 0)
+
+    def __contains__(self, word):
+        return self.words.find(word.encode('utf-8')) is not None or word in self.overlay
+
+    def items(self):
+        for idx in range(len(self.words)):
+            word = self.words[idx].decode('utf-8')
+            yield word, int(self.counts[idx]) + self.overlay.get(word, 0)
+        for word, count in self.overlay.items():
+            if self.words.find(word.encode('utf-8')) is None:
+                yield word, count
+
+    @classmethod
+    def write(cls, word_count, path):
+        """
+        Writes (word, count) pairs to a vocabulary in the given directory.
+        """
+        if not os.path.exists(path):
+            os.makedirs(path)
+        entries = sorted((word.encode('utf-8'), count) for word, count in word_count)
+        SortedStringTable.write((word for word, _ in entries),
+            os.path.join(path, 'words.bin'), os.path.join(path, 'word_offsets.npy'))
+        counts = numpy.array([count for _, count in entries], dtype=numpy.int64)
+        if not len(counts) or counts.max() < 2**32:
+            counts = counts.astype(numpy.uint32)
+        numpy.save(os.path.join(path, 'counts.npy'), counts)
+
 class BOWLanguageModel(object):
-    def __init__(self):
+    def __init__(self, cache_size=100000):
+        """
+        :param cache_size: the number of tokenized phrases, and the number
+            of log-likelihoods of words, memoized by the model
+        """
         self.total_count = 0
         self.word_count = defaultdict(int)
         self.smoothing = 1
         self.log_quotient = None
         self.threshold = 2
+        self.version = None
+        self.base_version = None
+        self.deltas_offset = 0
+        self.cache_size = cache_size
+        self._tokenize = lru_cache(maxsize=cache_size)(lambda phrase: tuple(tokenize(phrase)))
+        self._word_scores = {}
+        self._word_hits = 0
+        self._word_misses = 0
+        self._lock = threading.Lock()
 
     def ingest(self, words):
         """
         Ingests a sequence of words in the language model
         """
-        for word in words:
-            self.word_count[word] += 1
+        if isinstance(self.word_count, ApproximateCounts):
+            self.word_count.add(words)
+        else:
+            for word in words:
+                self.word_count[word] += 1
         self.total_count += len(words)
+        self._word_scores = {}
 
     def ingest_phrases(self, phrases):
         """
         Given a list of strings (phrases), deduplicate all
         their words and ingest them.
         """
-        word_set = set()
-        for phrase in phrases:
-            word_set |= set(tokenize(phrase))
-        self.ingest(word_set)
+        self.ingest(phrases_words(phrases))
 
     def log_likelihood(self, phrase):
         """
         Returns the log-likelihood of the phrase
         """
-        words = tokenize(phrase)
-        return sum(self._word_log_likelihood(word) for word in words)
+        return self.log_likelihood_many([phrase])[0]
+
+    def log_likelihood_many(self, phrases):
+        """
+        Returns the log-likelihoods of many phrases (for instance, all the
+        mentions of a document). The log-likelihoods of the words which
+        were not seen recently are computed in one go.
+        """
+        # the cache and the quotient are replaced together when the counts change
+        with self._lock:
+            if self.log_quotient is None:
+                self._update_log_quotient()
+            word_scores = self._word_scores
+            log_quotient = self.log_quotient
+        tokenized = [self._tokenize(phrase) for phrase in phrases]
+        scores = {}
+        missing = []
+        for words in tokenized:
+            for word in words:
+                if word in scores:
+                    continue
+                score = word_scores.get(word)
+                if score is None:
+                    missing.append(word)
+                    scores[word] = None
+                else:
+                    scores[word] = score
+        if missing:
+            counts = numpy.array([self._count(word) for word in missing], dtype=numpy.float64)
+            new_scores = dict(zip(missing, (numpy.log(self.smoothing + counts) - log_quotient).tolist()))
+            scores.update(new_scores)
+        with self._lock:
+            # new scores are not cached if the counts were updated in the meantime
+            if missing and self._word_scores is word_scores:
+                if len(word_scores) + len(new_scores) > self.cache_size:
+                    self._word_scores = {}
+                self._word_scores.update(new_scores)
+            self._word_misses += len(missing)
+            self._word_hits += len(scores) - len(missing)
+        return [sum(scores[word] for word in words) for words in tokenized]
+
+    def cache_stats(self):
+        """
+        Returns the hit rates of the memoized tokenization
+        and log-likelihoods of words.
+        """
+        tokenize_info = self._tokenize.cache_info()
+        tokenize_lookups = tokenize_info.hits + tokenize_info.misses
+        word_lookups = self._word_hits + self._word_misses
+        return {
+            'tokenize_hits': tokenize_info.hits,
+            'tokenize_misses': tokenize_info.misses,
+            'tokenize_hit_rate': float(tokenize_info.hits) / tokenize_lookups if tokenize_lookups else 0.,
+            'word_hits': self._word_hits,
+            'word_misses': self._word_misses,
+            'word_hit_rate': float(self._word_hits) / word_lookups if word_lookups else 0.,
+        }
 
     def _word_log_likelihood(self, word):
         """
@@ -57,23 +230,36 @@ class BOWLanguageModel(object):
         """
         if self.log_quotient is None:
             self._update_log_quotient()
-        return log(float(self.smoothing + self.word_count[word])) - self.log_quotient
+        return log(float(self.smoothing + self._count(word))) - self.log_quotient
+
+    def _count(self, word):
+        """
+        The count of a word. Unlike word_count[word], it does not add
+        unknown words to a defaultdict, which would change log_quotient.
+        """
+        return self.word_count[word] if word in self.word_count else 0
 
     def _update_log_quotient(self):
         """
         Updates the precomputed quotient
         """
         self.log_quotient = log(self.smoothing*(1+len(self.word_count))+self.total_count)
+        self._word_scores = {}
 
     def load(self, filename):
         """
-        Loads a pre-trained language model
+        Loads a pre-trained language model, either pickled (.pkl file)
+        or in the compact format (a directory written by save_compact).
         """
+        if os.path.isdir(filename):
+            self.load_compact(filename)
+            return
         with open(filename, 'rb') as f:
             dct = pickle.load(f)
             self.total_count = dct['total_count']
             self.word_count = defaultdict(int, dct['word_count'])
             self._update_log_quotient()
+        self.version = self.base_version = file_version(filename)
 
     def save(self, filename):
         """
@@ -87,39 +273,286 @@ class BOWLanguageModel(object):
                                 if c >= self.threshold ]},
                 f)
 
+    def save_compact(self, path):
+        """
+        Saves the language model in the compact format, in the given directory.
+        """
+        CompactVocabulary.write(
+            ((w,c) for w,c in self.word_count.items() if c >= self.threshold), path)
+        with open(os.path.join(path, 'model.json'), 'w') as f:
+            json.dump({'total_count':self.total_count}, f)
+
+    def load_compact(self, path):
+        """
+        Memory-maps a language model saved in the compact format.
+        The model cannot ingest new words afterwards.
+        """
+        with open(os.path.join(path, 'model.json'), 'r') as f:
+            self.total_count = json.load(f)['total_count']
+        self.word_count = CompactVocabulary(path)
+        self._update_log_quotient()
+        self.version = self.base_version = file_version(os.path.join(path, 'counts.npy'))
+
+    def apply_delta(self, added, removed):
+        """
+        Updates the counts of the words of an item whose
+        label or aliases changed.
+
+        :param added: the words which were added to the item
+        :param removed: the words which were removed from the item
+        """
+        for word in added:
+            self.word_count[word] += 1
+        for word in removed:
+            # checked first, so that no entry is added to a defaultdict for unknown words
+            if word in self.word_count and self.word_count[word] > 0:
+                self.word_count[word] -= 1
+        self.total_count += len(added) - len(removed)
+
+    def apply_deltas(self, fname):
+        """
+        Applies the updates appended to a delta log (written by a
+        LanguageModelUpdater) since the last call to this method.
+
+        :returns: the number of records applied
+        """
+        nb_updates = 0
+        with self._lock:
+            with open(fname, 'r') as f:
+                f.seek(self.deltas_offset)
+                for line in iter(f.readline, ''):
+                    if not line.endswith('\n'):
+                        # the line is still being written
+                        break
+                    record = json.loads(line)
+                    self.apply_delta(record.get('add', []), record.get('remove', []))
+                    self.deltas_offset = f.tell()
+                    nb_updates += 1
+            if nb_updates:
+                self._update_log_quotient()
+                self.version = '{}+{}'.format(self.base_version, self.deltas_offset)
+        return nb_updates
+
+    def refresh_periodically(self, fname, interval):
+        """
+        Applies the updates of a delta log every interval seconds,
+        in a background thread.
+        """
+        def refresh():
+            while True:
+                try:
+                    nb_updates = self.apply_deltas(fname)
+                    if nb_updates:
+                        logger.info('Applied {} updates to the language model'.format(nb_updates))
+                except (IOError, ValueError):
+                    logger.exception('Could not update the language model')
+                time.sleep(interval)
+        thread = threading.Thread(target=refresh, daemon=True)
+        thread.start()
+        return thread
+
+    def merge_counts(self, total_count, word_count):
+        """
+        Adds the word counts of another model, in the order of its words.
+        """
+        if isinstance(self.word_count, ApproximateCounts):
+            self.word_count.add(dict(word_count))
+        else:
+            for word, count in word_count.items():
+                self.word_count[word] += count
+        self.total_count += total_count
+
+    def ingest_item(self, item):
+        """
+        Ingests the English label and aliases of a Wikidata item.
+        """
+        self.ingest(item_words(item))
 
     @classmethod
-    def train_from_dump(cls, filename):
+    def train_from_dump(cls, filename, jobs=1, chunk_size=10000, max_memory=None, partition_size=4*1024*1024):
         """
         Trains a bag of words language model from either a .txt
         file (in which case it is read as plain text) or a .json.bz2
         file (in which case it is read as a wikidata dump).
+
+        :param jobs: the number of processes counting words. With more than one
+            process, the file is read in chunks of lines which are counted by worker
+            processes, and the partial counts are then merged. Dumps made of multiple
+            bz2 streams are split in partitions, which workers decompress themselves.
+            The resulting model is identical to the one trained with a single process.
+        :param chunk_size: the number of lines in each chunk, also used as the
+            number of lines whose words are ingested at once by a single process
+        :param partition_size: the size of the compressed partitions of multistream dumps
+        :param max_memory: if provided, words are counted approximately in a
+            count-min sketch using at most this number of bytes, instead of counting all
+            words exactly. Only the most frequent words above the threshold are kept
+            (as many as fit in the memory reserved for them), and the bounds on the
+            error of their counts are given by `word_count.error_bounds()`.
         """
+        if not filename.endswith('.txt') and not filename.endswith('.json.bz2'):
+            raise ValueError('invalid filename provided (must end in .txt or .json.bz2)')
+        is_dump = filename.endswith('.json.bz2')
         bow = BOWLanguageModel()
-        if filename.endswith('.txt'):
-            with open(filename, 'r') as f:
-                for line in f:
-                    bow.ingest_phrases([line.strip()])
+        if max_memory is not None:
+            bow.word_count = ApproximateCounts(max_memory, threshold=bow.threshold)
+        if jobs > 1:
+            if is_dump and is_multistream(filename, partition_size):
+                return cls._train_partitions(bow, filename, jobs, partition_size)
+            return cls._train_parallel(bow, filename, is_dump, jobs, chunk_size)
 
-        elif filename.endswith('.json.bz2'):
+        # words are ingested in chunks, which approximate counts hash all at once
+        words = []
+        if not is_dump:
+            with open(filename, 'r') as f:
+                for idx, line in enumerate(f):
+                    words.extend(phrases_words([line.strip()]))
+                    if (idx + 1) % chunk_size == 0:
+                        bow.ingest(words)
+                        words = []
+        else:
             with WikidataDumpReader(filename) as reader:
                 for idx, item in enumerate(reader):
                     if idx % 10000 == 0:
                         print(idx)
+                    words.extend(item_words(item))
+                    if (idx + 1) % chunk_size == 0:
+                        bow.ingest(words)
+                        words = []
+        bow.ingest(words)
 
-                    enlabel = item.get('labels', {}).get('en', {}).get('value')
-                    endesc = item.get('descriptions', {}).get('en', {}).get('value')
-                    if enlabel:
-                        # Fetch aliases
-                        enaliases = [
-                            alias['value']
-                            for alias in item.get('aliases', {}).get('en', [])
-                        ]
+        return bow
 
-                        bow.ingest_phrases(enaliases + [enlabel])
+    @classmethod
+    def _train_parallel(cls, bow, filename, is_dump, jobs, chunk_size):
+        """
+        Trains a model by counting chunks of the file in a pool of processes.
+        """
+        if is_dump:
+            logger.info('{} is not a multistream bz2 file, decompressing it in a single process'.format(filename))
+            f = bz2.open(filename, mode='rt', encoding='utf-8')
         else:
-            raise ValueError('invalid filename provided (must end in .txt or .json.bz2)')
+            f = open(filename, 'r')
+        with f, multiprocessing.Pool(jobs) as pool:
+            chunks = ((is_dump, lines) for lines in iter(lambda: list(islice(f, chunk_size)), []))
+            # imap returns the counts in the order of the chunks, so words are
+            # inserted in the merged counts in the same order as in the serial path
+            for idx, (total_count, word_count) in enumerate(pool.imap(_count_chunk, chunks)):
+                bow.merge_counts(total_count, word_count)
+                logger.info('{} lines counted'.format((idx + 1) * chunk_size))
+        return bow
 
+    @classmethod
+    def _train_partitions(cls, bow, filename, jobs, partition_size):
+        """
+        Trains a model on a multistream dump, whose partitions are decompressed
+        and counted in a pool of processes.
+        """
+        partitions = list_partitions(filename, partition_size)
+        with multiprocessing.Pool(jobs) as pool:
+            # The lines which span partitions are counted by the main process, before
+            # the lines of the partition where they end, as in the serial path.
+            pending = b''
+            for idx, (head, total_count, word_count, tail, has_line_break) in enumerate(
+                    pool.imap(_count_partition, partitions)):
+                pending += head
+                if has_line_break:
+                    bow.merge_counts(*_count_chunk((True, pending.decode('utf-8').splitlines(keepends=True))))
+                    bow.merge_counts(total_count, word_count)
+                    pending = tail
+                if idx % 100 == 0:
+                    logger.info('{}/{} partitions counted'.format(idx, len(partitions)))
+            bow.merge_counts(*_count_chunk((True, pending.decode('utf-8').splitlines(keepends=True))))
         return bow
 
+def _count_partition(args):
+    """
+    Decompresses and counts the words of a partition of a multistream dump,
+    in a worker process.
+
+    :returns: the bytes before the first line break, the total count of words
+        and the dictionary of word counts of the complete lines, the bytes after
+        the last line break, and whether the partition contains a line break
+    """
+    idx, fname, start, end = args
+    head, lines, tail, has_line_break = split_partition(fname, start, end)
+    total_count, word_count = _count_chunk((True, lines))
+    return head, total_count, word_count, tail, has_line_break
+
+def _count_chunk(args):
+    """
+    Counts the words of a chunk of lines, in a worker process.
+
+    :returns: the total count of words and the dictionary of word counts
+    """
+    is_dump, lines = args
+    bow = BOWLanguageModel(cache_size=0)
+    for line in lines:
+        if is_dump:
+            item = WikidataDumpReader.parse_line(line)
+            if item is not None:
+                bow.ingest_item(item)
+        else:
+            bow.ingest_phrases([line.strip()])
+    return bow.total_count, bow.word_count
+
+class LanguageModelUpdater(object):
+    """
+    Follows the changes of the labels and aliases of items (for instance
+    from the Wikidata edit stream), and appends the corresponding changes of
+    word counts to a delta log, which language models apply with
+    BOWLanguageModel.apply_deltas.
+
+    The delta log is in JSON lines format. Each line records the words
+    added to and removed from an item. The first time an item is seen, its
+    words are compared to those of the previous revision of the item (the
+    revision counted by the model), or to no words if the item was just
+    created. If the previous revision is not known, its words are assumed
+    to be counted already: the line then records the words known for this
+    item, without changing counts.
+    """
+
+    def __init__(self, fname):
+        """
+        :param fname: the path of the delta log. The words of the items
+            are restored from it if it exists.
+        """
+        self.fname = fname
+        self.item_words = {}
+        if os.path.exists(fname):
+            with open(fname, 'r') as f:
+                for line in f:
+                    record = json.loads(line)
+                    if 'known' in record:
+                        words = set(record['known'])
+                    else:
+                        words = self.item_words.get(record['id'], set())
+                        words = (words - set(record['remove'])) | set(record['add'])
+                    self.item_words[record['id']] = words
+
+    def update(self, item, created=False, previous=None):
+        """
+        Records the changes of the words of an item.
 
+        :param created: True if the item was created after the language model was trained
+        :param previous: the revision of the item before the edit, used the first time
+            the item is seen (see WikidataStreamReader.previous_items)
+        :returns: the record appended to the delta log, or None if the words did not change
+        """
+        qid = item.get('id')
+        words = item_words(item)
+        if qid in self.item_words or created:
+            previous_words = self.item_words.get(qid, set())
+        elif previous is not None:
+            previous_words = item_words(previous)
+        else:
+            previous_words = None
+        self.item_words[qid] = words
+        if previous_words is None:
+            record = {'id': qid, 'known': sorted(words)}
+        elif words == previous_words:
+            return None
+        else:
+            record = {'id': qid, 'add': sorted(words - previous_words), 'remove': sorted(previous_words - words)}
+        with open(self.fname, 'a') as f:
+            f.write(json.dumps(record)+'\n')
+        return record
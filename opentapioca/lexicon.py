@@ -0,0 +1,220 @@
+import json
+import logging
+import os
+import re
+import tempfile
+import unicodedata
+import numpy
+
+from .tagbackends import TagBackend
+from .sortedtable import SortedStringTable
+from .utils import file_version
+
+logger = logging.getLogger(__name__)
+
+token_re = re.compile(r"\w+(?:['’]\w+)*")
+possessive_re = re.compile(r"['’][sS]$")
+folding_table = str.maketrans({
+    'Æ': 'AE', 'æ': 'ae', 'Ø': 'O', 'ø': 'o', 'ß': 'ss', 'Œ': 'OE', 'œ': 'oe',
+    'Đ': 'D', 'đ': 'd', 'Ł': 'L', 'ł': 'l', 'Þ': 'TH', 'þ': 'th', 'ı': 'i',
+})
+separator = b'\x1f'
+
+def analyze(text):
+    """
+    Splits a text into tokens, imitating the analyzer of the
+    "name_tag" field in the Solr schema: words are split on
+    punctuation and whitespace, trailing possessives are removed and
+    accents are folded. Matching stays case-sensitive.
+
+    :returns: a list of (token, start offset, end offset) triples
+
+    >>> analyze("The People's Republic of Élan")
+    [('The', 0, 3), ('People', 4, 12), ('Republic', 13, 21), ('of', 22, 24), ('Elan', 25, 29)]
+    """
+    tokens = []
+    for match in token_re.finditer(text):
+        token = possessive_re.sub('', match.group())
+        token = unicodedata.normalize('NFKD', token.translate(folding_table))
+        token = ''.join(c for c in token if not unicodedata.combining(c))
+        tokens.append((token, match.start(), match.end()))
+    return tokens
+
+def name_key(tokens):
+    """
+    The key under which a sequence of tokens is stored in the lexicon.
+    """
+    return separator.join(token.encode('utf-8') for token in tokens)
+
+class Lexicon(object):
+    """
+    A compact, memory-mapped dictionary of the names (labels, aliases
+    and extra aliases) of the items of an index, used to tag text without
+    Solr. The stored fields of the items are kept alongside.
+
+    A lexicon is a directory containing:
+    - the sorted table of all names (as sequences of analyzed tokens),
+      with, for each name, the range of its postings
+    - the postings, which are indices of documents
+    - the sorted table of item ids, with the stored JSON documents in the same order
+
+    All files are memory-mapped: the lexicon is not loaded in memory, and the
+    pages read are shared between all the processes using the same lexicon.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.names = SortedStringTable.load(
+            os.path.join(path, 'names.bin'), os.path.join(path, 'name_offsets.npy'))
+        self.postings_offsets = numpy.load(os.path.join(path, 'postings_offsets.npy'), mmap_mode='r')
+        self.postings = numpy.load(os.path.join(path, 'postings.npy'), mmap_mode='r')
+        self.ids = SortedStringTable.load(
+            os.path.join(path, 'ids.bin'), os.path.join(path, 'id_offsets.npy'))
+        self.docs = SortedStringTable.load(
+            os.path.join(path, 'docs.bin'), os.path.join(path, 'doc_offsets.npy'))
+
+    @classmethod
+    def build(cls, docs, path):
+        """
+        Builds a lexicon from Solr documents, as generated by
+        IndexingProfile.entity_to_document, and writes it in the
+        given directory.
+
+        :returns: the lexicon, opened
+        """
+        os.makedirs(path, exist_ok=True)
+        name_to_docs = {}
+        doc_locations = []
+        with tempfile.TemporaryFile(dir=path) as doc_file:
+            for doc in docs:
+                if doc is None:
+                    continue
+                stored = json.dumps(cls.stored_document(doc)).encode('utf-8')
+                doc_locations.append((doc['id'].encode('utf-8'), doc_file.tell(), len(stored)))
+                doc_file.write(stored)
+                for name in [doc['label']] + doc.get('aliases', []) + doc.get('extra_aliases', []):
+                    key = name_key(token for token, _, _ in analyze(name))
+                    if key:
+                        name_to_docs.setdefault(key, set()).add(doc['id'].encode('utf-8'))
+                if len(doc_locations) % 100000 == 0:
+                    logger.info('{} documents'.format(len(doc_locations)))
+
+            # Documents are sorted by id, so that they can be looked up by binary search
+            doc_locations.sort()
+            id_to_idx = {id: idx for idx, (id, _, _) in enumerate(doc_locations)}
+            SortedStringTable.write((id for id, _, _ in doc_locations),
+                os.path.join(path, 'ids.bin'), os.path.join(path, 'id_offsets.npy'))
+
+            def sorted_docs():
+                for _, offset, length in doc_locations:
+                    doc_file.seek(offset)
+                    yield doc_file.read(length)
+
+            SortedStringTable.write(sorted_docs(),
+                os.path.join(path, 'docs.bin'), os.path.join(path, 'doc_offsets.npy'))
+
+        sorted_names = sorted(name_to_docs)
+        SortedStringTable.write(sorted_names,
+            os.path.join(path, 'names.bin'), os.path.join(path, 'name_offsets.npy'))
+        postings_offsets = [0]
+        postings = []
+        for name in sorted_names:
+            postings += sorted(id_to_idx[id] for id in name_to_docs[name])
+            postings_offsets.append(len(postings))
+        numpy.save(os.path.join(path, 'postings_offsets.npy'), numpy.array(postings_offsets, dtype=numpy.int64))
+        numpy.save(os.path.join(path, 'postings.npy'), numpy.array(postings, dtype=numpy.int32))
+        logger.info('Lexicon built with {} names for {} documents'.format(len(sorted_names), len(doc_locations)))
+        return cls(path)
+
+    @classmethod
+    def stored_document(cls, doc):
+        """
+        Converts a document to the representation returned by Solr.
+        """
+        stored = {k: v for k, v in doc.items() if k != 'revid'}
+        stored['label'] = [doc['label']]
+        return stored
+
+    def get_documents(self, qids, fields=None):
+        """
+        Retrieves the stored documents of the given items.
+
+        :param fields: the list of fields to return (all of them if None)
+        """
+        docs = []
+        for qid in qids:
+            idx = self.ids.find(qid.encode('utf-8'))
+            if idx is None:
+                continue
+            doc = json.loads(self.docs[idx].decode('utf-8'))
+            if fields is not None:
+                doc = {k: v for k, v in doc.items() if k in fields}
+            docs.append(doc)
+        return docs
+
+    def find_tags(self, text, tags_limit=None):
+        """
+        Finds the mentions of names of the lexicon in the text.
+        As for the Solr tagger with overlaps=NO_SUB, matches which
+        are included in a longer match are discarded.
+
+        :returns: a list of (start offset, end offset, list of ids) triples
+        """
+        tokens = analyze(text)
+        matches = []
+        for i in range(len(tokens)):
+            lo = 0
+            prefix = b''
+            for j in range(i, len(tokens)):
+                prefix = prefix + separator + tokens[j][0].encode('utf-8') if prefix else tokens[j][0].encode('utf-8')
+                lo = self.names.lower_bound(prefix, lo)
+                if lo == len(self.names):
+                    break
+                name = self.names[lo]
+                if name == prefix:
+                    matches.append((tokens[i][1], tokens[j][2], lo))
+                    if lo + 1 == len(self.names):
+                        break
+                    name = self.names[lo + 1]
+                if not name.startswith(prefix + separator):
+                    break
+
+        # Remove matches included in others, and merge matches on the same span
+        spans = {}
+        for start, end, name_idx in matches:
+            spans.setdefault((start, end), set()).update(
+                self.postings[self.postings_offsets[name_idx]:self.postings_offsets[name_idx+1]].tolist())
+        tags = []
+        max_end = -1
+        for start, end in sorted(spans, key=lambda span: (span[0], -span[1])):
+            if end <= max_end:
+                continue
+            max_end = end
+            ids = sorted(self.ids[idx].decode('utf-8') for idx in spans[(start, end)])
+            tags.append((start, end, ids))
+            if tags_limit is not None and len(tags) >= tags_limit:
+                break
+        return tags
+
+class LexiconTagBackend(TagBackend):
+    """
+    A tagging backend which matches mentions in process with a Lexicon,
+    instead of sending the text to Solr.
+    """
+
+    def __init__(self, lexicon):
+        """
+        :param lexicon: the Lexicon of the indexed items
+        """
+        self.lexicon = lexicon
+
+    def tag(self, text, fields, tags_limit):
+        tags = self.lexicon.find_tags(text, tags_limit=tags_limit)
+        qids = sorted({qid for _, _, ids in tags for qid in ids})
+        return tags, self.lexicon.get_documents(qids, fields)
+
+    def fetch_documents(self, qids, fields):
+        return self.lexicon.get_documents(qids, fields)
+
+    def index_version(self):
+        return file_version(os.path.join(self.lexicon.path, 'docs.bin'))
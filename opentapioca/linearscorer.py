@@ -0,0 +1,65 @@
+import json
+import numpy
+
+class LinearScorer(object):
+    """
+    The decision function of a linear classifier, with the feature
+    scaling folded into its weights. It replaces a trained scikit-learn
+    pipeline (StandardScaler followed by LinearSVC) at inference time,
+    without importing scikit-learn.
+    """
+    # the version of the format of the files written by save
+    format_version = 1
+
+    def __init__(self, coef, intercept):
+        """
+        :param coef: the weights of the features
+        :param intercept: the constant term of the decision function
+        """
+        self.coef = numpy.asarray(coef, dtype=numpy.float64).reshape(-1)
+        self.intercept = float(intercept)
+
+    @classmethod
+    def from_pipeline(cls, pipeline):
+        """
+        Folds a pipeline made of a StandardScaler and a linear
+        binary classifier into a single linear function:
+        w.((x - mean)/scale) + b = (w/scale).x + b - w.(mean/scale)
+        """
+        scaler, clf = pipeline.steps[0][1], pipeline.steps[-1][1]
+        coef = numpy.asarray(clf.coef_, dtype=numpy.float64).reshape(-1)
+        intercept = float(numpy.asarray(clf.intercept_).reshape(-1)[0])
+        if scaler.scale_ is not None:
+            coef = coef / scaler.scale_
+        if scaler.mean_ is not None:
+            intercept -= coef.dot(scaler.mean_)
+        return cls(coef, intercept)
+
+    def decision_function(self, feature_array):
+        """
+        Scores the rows of a feature array (positive scores
+        are predicted as valid tags).
+        """
+        return numpy.asarray(feature_array, dtype=numpy.float64).dot(self.coef) + self.intercept
+
+    def json(self):
+        return {
+            'format_version': self.format_version,
+            'coef': self.coef.tolist(),
+            'intercept': self.intercept,
+        }
+
+    @classmethod
+    def from_json(cls, dct):
+        if dct.get('format_version') != cls.format_version:
+            raise ValueError('Unsupported linear scorer format: {}'.format(dct.get('format_version')))
+        return cls(dct['coef'], dct['intercept'])
+
+    def save(self, fname):
+        with open(fname, 'w') as f:
+            json.dump(self.json(), f)
+
+    @classmethod
+    def load(cls, fname):
+        with open(fname, 'r') as f:
+            return cls.from_json(json.load(f))
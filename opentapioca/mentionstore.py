@@ -0,0 +1,189 @@
+import json
+import logging
+import os
+import numpy
+
+from .annotationcache import model_version
+from .mention import Mention
+from .tag import Tag
+
+logger = logging.getLogger(__name__)
+
+class MentionStore(object):
+    """
+    A store of the mentions found by the tagger in the documents of a
+    training corpus, keyed by the URI of their NIF context. Classifiers can
+    then be trained again without tagging the corpus, and without Solr.
+
+    Mentions depend on the tagger which created them: the store records the
+    Solr collection, the version of its index and the versions of the language
+    model and PageRank. A store computed with another tagger is discarded
+    when it is loaded. If the version of the index cannot be determined
+    (for instance because Solr is not running), the stored mentions are used
+    regardless of it.
+
+    The store is saved as a compressed Numpy archive (.npz) with one array
+    per field of the documents, mentions, tags and edges. The mentions and
+    tags only keep the fields used by the classifier.
+
+    It can be passed as docid_to_mentions to SimpleTagClassifier.train_model
+    and evaluate_model: each lookup returns new Mention objects.
+    """
+    # the version of the format of the files written by save
+    format_version = 1
+
+    def __init__(self, fname, version):
+        """
+        :param fname: the path of the .npz file. Mentions are loaded from it
+            if it exists and was computed with the same tagger.
+        :param version: the version of the tagger, as returned by tagger_version
+        """
+        self.fname = fname
+        self.version = version
+        self.documents = {}
+        self.modified = False
+        if os.path.exists(fname):
+            self._load()
+
+    @classmethod
+    def for_tagger(cls, fname, tagger):
+        """
+        Opens the store of the mentions created by a tagger.
+        """
+        return cls(fname, cls.tagger_version(tagger))
+
+    @classmethod
+    def tagger_version(cls, tagger):
+        """
+        Identifies the tagger which creates mentions.
+        """
+        return {
+            'collection': tagger.solr_collection,
+            'index_version': tagger.backend.index_version(),
+            'models': model_version(tagger.bow, tagger.graph),
+        }
+
+    def _compatible(self, version):
+        """
+        Checks if mentions stored with the given version of the tagger can be used.
+        """
+        if version.get('format_version') != self.format_version:
+            return False
+        if (version['collection'], version['models']) != (self.version['collection'], self.version['models']):
+            return False
+        if self.version['index_version'] is None:
+            if version['index_version'] is not None:
+                logger.warning('Using stored mentions without checking the version of the index')
+            return True
+        return version['index_version'] == self.version['index_version']
+
+    def __contains__(self, uri):
+        return uri in self.documents
+
+    def __len__(self):
+        return len(self.documents)
+
+    def __getitem__(self, uri):
+        mentions = self.get(uri)
+        if mentions is None:
+            raise KeyError(uri)
+        return mentions
+
+    def get(self, uri, default=None):
+        """
+        Returns the stored mentions of a document, as new Mention objects.
+        """
+        records = self.documents.get(uri)
+        if records is None:
+            return default
+        return [
+            Mention(phrase=phrase, start=start, end=end, log_likelihood=log_likelihood, tags=[
+                Tag(id=qid, label=label, rank=rank, nb_statements=nb_statements,
+                    nb_sitelinks=nb_sitelinks, edges=list(edges))
+                for qid, label, rank, nb_statements, nb_sitelinks, edges in tags
+            ])
+            for phrase, start, end, log_likelihood, tags in records
+        ]
+
+    def put(self, uri, mentions):
+        """
+        Stores the mentions of a document.
+        """
+        self.documents[uri] = [
+            (mention.phrase, mention.start, mention.end, mention.log_likelihood, [
+                (tag.id, tag.label, tag.rank, tag.nb_statements, tag.nb_sitelinks, tag.edges)
+                for tag in mention.tags
+            ])
+            for mention in mentions
+        ]
+        self.modified = True
+
+    def save(self):
+        """
+        Writes the store to its file.
+        """
+        uris = sorted(self.documents)
+        mentions = [mention for uri in uris for mention in self.documents[uri]]
+        tags = [tag for mention in mentions for tag in mention[4]]
+
+        def offsets(lengths):
+            result = numpy.zeros(len(lengths) + 1, dtype=numpy.int64)
+            numpy.cumsum(lengths, out=result[1:])
+            return result
+
+        def optional_ints(values):
+            return numpy.array([-1 if value is None else value for value in values], dtype=numpy.int64)
+
+        header = dict(self.version, format_version=self.format_version)
+        # written to a temporary file first, so that the store is never left truncated
+        tmp_fname = self.fname + '.tmp.npz'
+        numpy.savez_compressed(tmp_fname,
+            header=numpy.array(json.dumps(header)),
+            uris=numpy.array(uris, dtype=str),
+            document_offsets=offsets([len(self.documents[uri]) for uri in uris]),
+            phrases=numpy.array([mention[0] for mention in mentions], dtype=str),
+            starts=numpy.array([mention[1] for mention in mentions], dtype=numpy.int64),
+            ends=numpy.array([mention[2] for mention in mentions], dtype=numpy.int64),
+            log_likelihoods=numpy.array([mention[3] for mention in mentions], dtype=numpy.float64),
+            mention_offsets=offsets([len(mention[4]) for mention in mentions]),
+            ids=numpy.array([tag[0] for tag in tags], dtype=str),
+            labels=numpy.array([tag[1] or '' for tag in tags], dtype=str),
+            has_labels=numpy.array([tag[1] is not None for tag in tags], dtype=bool),
+            ranks=numpy.array([tag[2] for tag in tags], dtype=numpy.float64),
+            nb_statements=optional_ints([tag[3] for tag in tags]),
+            nb_sitelinks=optional_ints([tag[4] for tag in tags]),
+            edge_offsets=offsets([len(tag[5]) for tag in tags]),
+            edges=numpy.array([edge for tag in tags for edge in tag[5]], dtype=numpy.int64),
+        )
+        os.replace(tmp_fname, self.fname)
+        self.modified = False
+
+    def _load(self):
+        with numpy.load(self.fname, allow_pickle=False) as arrays:
+            version = json.loads(str(arrays['header']))
+            if not self._compatible(version):
+                logger.info('Discarding the mentions stored in {}, created by another tagger'.format(self.fname))
+                return
+            columns = {name: arrays[name].tolist() for name in arrays.files if name != 'header'}
+
+        def optional_int(value):
+            return None if value == -1 else value
+
+        tags = [
+            (qid, label if has_label else None, rank, optional_int(nb_statements), optional_int(nb_sitelinks),
+             columns['edges'][columns['edge_offsets'][idx]:columns['edge_offsets'][idx+1]])
+            for idx, (qid, label, has_label, rank, nb_statements, nb_sitelinks) in enumerate(zip(
+                columns['ids'], columns['labels'], columns['has_labels'], columns['ranks'],
+                columns['nb_statements'], columns['nb_sitelinks']))
+        ]
+        mention_offsets = columns['mention_offsets']
+        mentions = [
+            (phrase, start, end, log_likelihood, tags[mention_offsets[idx]:mention_offsets[idx+1]])
+            for idx, (phrase, start, end, log_likelihood) in enumerate(zip(
+                columns['phrases'], columns['starts'], columns['ends'], columns['log_likelihoods']))
+        ]
+        document_offsets = columns['document_offsets']
+        self.documents = {
+            uri: mentions[document_offsets[idx]:document_offsets[idx+1]]
+            for idx, uri in enumerate(columns['uris'])
+        }
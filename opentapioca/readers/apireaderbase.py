@@ -1,3 +1,4 @@
+import json
 import logging
 import requests
 
@@ -23,24 +24,56 @@ class APIReaderBase(object):
         """
         if not qids:
             return []
+        return self._query({
+            'format':'json',
+            'action':'wbgetentities',
+            'ids':'|'.join(qids)}, 'wbgetentities', lambda response: [
+                WikidataItemDocument(payload)
+                for payload in response.get('entities').values()
+                if 'missing' not in payload
+            ])
+
+    def fetch_revisions(self, revids):
+        """
+        Given a list of revision ids, fetch the documents of the items
+        at these revisions via the MediaWiki API.
+
+        :returns: a dictionary mapping the revision ids found to the documents
+        """
+        if not revids:
+            return {}
+        return self._query({
+            'format':'json',
+            'formatversion':'2',
+            'action':'query',
+            'prop':'revisions',
+            'rvprop':'ids|content',
+            'rvslots':'main',
+            'revids':'|'.join(str(revid) for revid in revids)}, 'revisions', lambda response: {
+                revision['revid']: WikidataItemDocument(json.loads(revision['slots']['main']['content']))
+                for page in response.get('query', {}).get('pages', [])
+                for revision in page.get('revisions', [])
+            })
+
+    def _query(self, params, name, parse):
+        """
+        Queries the MediaWiki API, retrying on errors.
+
+        :param name: the name of the query, for logging
+        :param parse: the function extracting the result from the JSON response
+        """
         for retries in range(self.retries):
             try:
-                req = requests.get(self.mediawiki_api, {
-                    'format':'json',
-                    'action':'wbgetentities',
-                    'ids':'|'.join(qids)})
+                req = requests.get(self.mediawiki_api, params)
                 req.raise_for_status()
-                result = req.json().get('entities').values()
-                return [WikidataItemDocument(payload) for payload in result if 'missing' not in payload]
-            except (requests.exceptions.RequestException, ValueError, TypeError, AttributeError) as e:
+                return parse(req.json())
+            except (requests.exceptions.RequestException, ValueError, TypeError, AttributeError, KeyError) as e:
                 logger.warning(e)
                 if retries < self.retries-1:
                     sleep_time = (1+retries)*self.delay
-                    logger.info('Retrying wbgetentities in {}'.format(sleep_time))
+                    logger.info('Retrying {} in {}'.format(name, sleep_time))
                     sleep(sleep_time)
                 else:
-                    logger.error('Failed to fetch entities')
+                    logger.error('Failed to fetch {}'.format(name))
                     logger.error(req.url)
                     raise
-
-
@@ -25,14 +25,22 @@ class WikidataDumpReader(object):
 
     def __iter__(self):
         for line in self.f:
-            try:
-                # remove the trailing comma
-                if line.rstrip().endswith(','):
-                    line = line[:-2]
-                item = json.loads(line)
-                yield WikidataItemDocument(item)
-            except ValueError as e:
-                # Happens at the beginning or end of dumps with '[', ']'
-                continue
+            item = self.parse_line(line)
+            if item is not None:
+                yield item
+
+    @classmethod
+    def parse_line(cls, line):
+        """
+        Parses a line of a dump, returning None if it does not contain an item.
+        """
+        try:
+            # remove the trailing comma
+            if line.rstrip().endswith(','):
+                line = line[:-2]
+            return WikidataItemDocument(json.loads(line))
+        except ValueError as e:
+            # Happens at the beginning or end of dumps with '[', ']'
+            return None
 
 
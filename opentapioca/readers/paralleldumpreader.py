@@ -0,0 +1,233 @@
+import bz2
+import logging
+import multiprocessing
+import os
+import re
+from itertools import islice
+
+from opentapioca.wditem import WikidataItemDocument
+from .dumpreader import WikidataDumpReader
+
+logger = logging.getLogger(__name__)
+
+# The beginning of a bz2 stream: magic number, block size and block header
+stream_header_re = re.compile(b'BZh[1-9]1AY&SY')
+
+def find_stream_start(f, offset, end=None, read_size=1024*1024):
+    """
+    Finds the offset of the first bz2 stream starting at or after
+    the given offset (and before end, if provided), or None if there is none.
+    """
+    f.seek(offset)
+    data = b''
+    while True:
+        block = f.read(read_size)
+        if not block:
+            return None
+        start = offset - len(data)
+        data += block
+        match = stream_header_re.search(data)
+        if match:
+            found = start + match.start()
+            return found if end is None or found < end else None
+        # keep the end of the data, in case a header spans two blocks
+        data = data[-9:]
+        offset += len(block)
+        if end is not None and offset - len(data) >= end:
+            return None
+
+def decompress_partition(fname, start, end, read_size=1024*1024):
+    """
+    Decompresses the bz2 streams which start in the [start, end) range of a file.
+
+    :returns: the decompressed bytes, or None if no stream starts in this range
+    """
+    with open(fname, 'rb') as f:
+        offset = find_stream_start(f, start, end)
+        while offset is not None:
+            try:
+                f.seek(offset)
+                return b''.join(_decompress_streams(f, offset, end, read_size))
+            except OSError:
+                # the header was found by chance in compressed data
+                offset = find_stream_start(f, offset + 1, end)
+        return None
+
+def _decompress_streams(f, offset, end, read_size):
+    """
+    Decompresses consecutive streams as long as they start before end.
+    """
+    while offset < end:
+        decompressor = bz2.BZ2Decompressor()
+        while not decompressor.eof:
+            block = f.read(read_size)
+            if not block:
+                return
+            yield decompressor.decompress(block)
+            offset += len(block)
+        # rewind to the beginning of the next stream
+        offset -= len(decompressor.unused_data)
+        f.seek(offset)
+
+def split_partition(fname, start, end):
+    """
+    Decompresses a partition of a dump and splits it into lines. Lines
+    which span partitions cannot be parsed from a single partition: the
+    partial lines at the beginning and end of the partition are returned as is.
+
+    :returns: a tuple made of the bytes before the first line break, the
+        complete lines in between, the bytes after the last line break,
+        and whether the partition contains a line break.
+    """
+    data = decompress_partition(fname, start, end)
+    if not data:
+        return b'', [], b'', False
+    first = data.find(b'\n')
+    if first == -1:
+        return data, [], b'', False
+    last = data.rfind(b'\n')
+    lines = data[first+1:last+1].decode('utf-8').splitlines(keepends=True)
+    return data[:first+1], lines, data[last+1:], True
+
+def parse_partition(args):
+    """
+    Decompresses and parses a partition of a dump, in a worker process.
+
+    :returns: a tuple made of the index of the partition, the bytes
+        before the first line break, the parsed items, the bytes after
+        the last line break, and whether the partition contains a line break.
+    """
+    idx, fname, start, end = args
+    head, lines, tail, has_line_break = split_partition(fname, start, end)
+    return idx, head, parse_lines(lines), tail, has_line_break
+
+def list_partitions(fname, partition_size):
+    """
+    Splits a file in partitions of the given size.
+
+    :returns: the list of (index, file name, start, end) tuples of the partitions
+    """
+    size = os.path.getsize(fname)
+    return [
+        (idx, fname, start, min(start + partition_size, size))
+        for idx, start in enumerate(range(0, size, partition_size))
+    ]
+
+def is_multistream(fname, partition_size):
+    """
+    Checks if a dump contains more than one bz2 stream, in its first partition.
+    """
+    with open(fname, 'rb') as f:
+        return find_stream_start(f, 1, partition_size) is not None
+
+def parse_lines(lines):
+    """
+    Parses lines of a dump, skipping those which do not contain items.
+    """
+    items = []
+    for line in lines:
+        item = WikidataDumpReader.parse_line(line)
+        if item is not None:
+            items.append(item.json)
+    return items
+
+class ParallelWikidataDumpReader(object):
+    """
+    Generates a stream of `WikidataItemDocument` from a Wikidata dump,
+    decompressing and parsing it in a pool of processes.
+
+    Wikidata dumps are compressed in multiple bz2 streams. The compressed
+    file is split in partitions at stream boundaries, and each partition is
+    decompressed and parsed by a worker. If the file only contains a single
+    stream, it is decompressed by the main process and only the parsing
+    happens in the workers.
+    """
+
+    def __init__(self, fname, processes=None, ordered=True, partition_size=4*1024*1024, batch_size=1000):
+        """
+        :param fname: the path of the .json.bz2 dump
+        :param processes: the number of worker processes (by default, the number of cores)
+        :param ordered: if True, the items are generated in the order of the dump.
+            Otherwise, they are generated as soon as they are parsed.
+        :param partition_size: the size of the compressed partitions
+        :param batch_size: the number of lines parsed at once by workers, for
+            single-stream files
+        """
+        self.fname = fname
+        self.processes = processes or os.cpu_count()
+        self.ordered = ordered
+        self.partition_size = partition_size
+        self.batch_size = batch_size
+        self.pool = None
+
+    def __enter__(self):
+        self.pool = multiprocessing.Pool(self.processes)
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.pool.terminate()
+        self.pool = None
+
+    def is_multistream(self):
+        """
+        Checks if the dump contains more than one bz2 stream, in its first partition.
+        """
+        return is_multistream(self.fname, self.partition_size)
+
+    def __iter__(self):
+        if self.pool is None:
+            raise ValueError('The reader must be used as a context manager.')
+        if self.is_multistream():
+            items = self._read_partitions()
+        else:
+            logger.info('{} is not a multistream bz2 file, decompressing it in a single process'.format(self.fname))
+            items = self._read_batches()
+        for item in items:
+            yield WikidataItemDocument(item)
+
+    def _read_partitions(self):
+        partitions = list_partitions(self.fname, self.partition_size)
+        if self.ordered:
+            results = self.pool.imap(parse_partition, partitions)
+        else:
+            results = self.pool.imap_unordered(parse_partition, partitions)
+
+        # The lines which span partitions are stitched in the order of the
+        # partitions, from their partial lines at the boundaries.
+        boundaries = {}
+        next_idx = 0
+        pending = b''
+        for idx, head, items, tail, has_line_break in results:
+            boundaries[idx] = (head, tail, has_line_break)
+            while next_idx in boundaries:
+                head, tail, has_line_break = boundaries.pop(next_idx)
+                pending += head
+                if has_line_break:
+                    for item in parse_lines(pending.decode('utf-8').splitlines(keepends=True)):
+                        yield item
+                    pending = tail
+                next_idx += 1
+            for item in items:
+                yield item
+        for item in parse_lines(pending.decode('utf-8').splitlines(keepends=True)):
+            yield item
+
+    def _read_batches(self):
+        with bz2.open(self.fname, mode='rt', encoding='utf-8') as f:
+            batches = iter(lambda: list(islice(f, self.batch_size)), [])
+            if self.ordered:
+                results = self.pool.imap(parse_lines, batches)
+            else:
+                results = self.pool.imap_unordered(parse_lines, batches)
+            for items in results:
+                for item in items:
+                    yield item
+
+def open_dump(fname, jobs=1):
+    """
+    Opens a dump with a sequential reader, or a parallel one
+    if more than one process is requested.
+    """
+    if jobs > 1 and fname != '-':
+        return ParallelWikidataDumpReader(fname, processes=jobs)
+    return WikidataDumpReader(fname)
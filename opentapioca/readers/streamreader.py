@@ -17,7 +17,13 @@ class WikidataStreamReader(APIReaderBase):
                  endpoint='https://stream.wikimedia.org/v2/stream/recentchange',
                  wiki='wikidatawiki',
                  mediawiki_api='https://www.wikidata.org/w/api.php',
-                 from_time=None):
+                 from_time=None,
+                 fetch_previous=False):
+        """
+        :param from_time: if provided, start following the stream from this point in time
+        :param fetch_previous: if True, also fetch the revisions of the items
+            before the edits of each batch, in previous_items
+        """
         super(WikidataStreamReader, self).__init__(mediawiki_api)
         self.endpoint = endpoint
         self.wiki = wiki
@@ -27,6 +33,14 @@ class WikidataStreamReader(APIReaderBase):
         self.batch_size = 50
         self.namespaces = [0]
         self.id_re = re.compile(r'^Q[1-9]\d+$')
+        # Qids of the items created in the stream, which have not been consumed yet
+        self.created_qids = set()
+        self.fetch_previous = fetch_previous
+        # Revision ids preceding the first edit of each item in the current batch
+        self.old_revisions = {}
+        # Documents of the items of the current batch before their first edit in
+        # the batch (if fetch_previous is True), indexed by qid
+        self.previous_items = {}
 
     def __enter__(self):
         url = self.endpoint
@@ -44,11 +58,20 @@ class WikidataStreamReader(APIReaderBase):
         stream_ended = False
         while not stream_ended:
             # Fetch new batch of events
+            self.old_revisions = {}
             qids = [self.fetch_next_qid() for _ in range(self.batch_size)]
 
             stream_ended = None in qids
             qids_without_none = {qid for qid in qids if qid}
 
+            if self.fetch_previous:
+                previous_revisions = self.fetch_revisions(list(self.old_revisions.values()))
+                self.previous_items = {
+                    qid: previous_revisions[revid]
+                    for qid, revid in self.old_revisions.items()
+                    if revid in previous_revisions
+                }
+
             # Fetch item contents
             for item in self.fetch_items(qids_without_none):
                 yield item
@@ -65,6 +88,11 @@ class WikidataStreamReader(APIReaderBase):
                         change.get('namespace') in self.namespaces and
                         change.get('title') and
                         self.id_re.match(change['title'])):
+                        if change.get('type') == 'new':
+                            self.created_qids.add(change['title'])
+                        old_revision = (change.get('revision') or {}).get('old')
+                        if old_revision:
+                            self.old_revisions.setdefault(change['title'], old_revision)
                         return change['title']
                 except ValueError:
                     pass
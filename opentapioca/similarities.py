@@ -1,30 +1,72 @@
-
 """
 A collection of similarity measures between
 items
 """
+import numpy
+from scipy import sparse
+
+def has_edge(edges, qid):
+    """
+    Checks if a sorted array of edges contains an item.
+
+    >>> has_edge(numpy.array([3, 5, 8]), 5)
+    True
+    >>> has_edge(numpy.array([3, 5, 8]), 9)
+    False
+    """
+    idx = numpy.searchsorted(edges, qid)
+    return bool(idx < len(edges) and edges[idx] == qid)
+
+def nb_common_edges(edges_a, edges_b):
+    """
+    Counts the items contained in two sorted arrays of edges.
+    """
+    return len(numpy.intersect1d(edges_a, edges_b, assume_unique=True))
 
 class EdgeSimilarityMeasure(object):
-    def compute_similarity(self, a, b):
+    def compute_similarity(self, a, b, graph=None):
         """
         Computes the similarity between two tags.
 
         :param a: the starting item
         :param b: the target item
+        :param graph: if provided, the WikidataGraph where the edges of
+            the items are read, instead of the edges stored in the tags
         """
         qid_a = int(a.id[1:])
         qid_b = int(b.id[1:])
-        edges_a = set(a.edges)
-        edges_b = set(b.edges)
-        
+        if graph is not None:
+            edges_a = graph.get_edges(a.id)
+            edges_b = graph.get_edges(b.id)
+        else:
+            edges_a = numpy.unique(numpy.array(a.edges, dtype=numpy.int64))
+            edges_b = numpy.unique(numpy.array(b.edges, dtype=numpy.int64))
+
         return self.similarity_from_edges(qid_a, qid_b, edges_a, edges_b)
 
     def similarity_from_edges(self, qid_a, qid_b, edges_a, edges_b):
         """
         This is the method that should be implemented by subclasses.
+        The edges are given as sorted arrays of numeric ids, without duplicates.
         """
         raise NotImplemented
 
+    def pairwise_similarities(self, qids, edges, a, b):
+        """
+        Computes the similarities of many pairs of tags at once.
+        Subclasses can override it with a vectorized implementation.
+
+        :param qids: the array of the numeric ids of the tags
+        :param edges: the list of the edges of the tags, as sorted arrays
+        :param a: the array of the indices of the starting tags
+        :param b: the array of the indices of the target tags
+        :returns: the array of the similarities of each pair
+        """
+        return numpy.array([
+            self.similarity_from_edges(qids[i], qids[j], edges[i], edges[j])
+            for i, j in zip(a, b)
+        ], dtype=numpy.float64)
+
 class DirectLinkSimilarity(EdgeSimilarityMeasure):
     """
     We just replicate Wikidata's edges - weighing is done
@@ -32,19 +74,30 @@ class DirectLinkSimilarity(EdgeSimilarityMeasure):
     """
     def similarity_from_edges(self, qid_a, qid_b, edges_a, edges_b):
         score = 0.
-        if qid_a == qid_b or qid_b in edges_a:
+        if qid_a == qid_b or has_edge(edges_a, qid_b):
             score += 1.
-        if qid_b == qid_a or qid_a in edges_b:
+        if qid_b == qid_a or has_edge(edges_b, qid_a):
             score += 1.
         return score
 
+    def pairwise_similarities(self, qids, edges, a, b):
+        # the edges of all tags, encoded as (tag index, target) 64-bit integers
+        sources = numpy.repeat(numpy.arange(len(qids), dtype=numpy.int64), [len(e) for e in edges])
+        keys = numpy.unique(sources << 32 | (numpy.concatenate(edges) if edges else qids[:0]))
+        a = numpy.asarray(a, dtype=numpy.int64)
+        b = numpy.asarray(b, dtype=numpy.int64)
+        same = qids[a] == qids[b]
+        a_to_b = same | numpy.isin(a << 32 | qids[b], keys)
+        b_to_a = same | numpy.isin(b << 32 | qids[a], keys)
+        return a_to_b.astype(numpy.float64) + b_to_a
+
 class EdgeRatioSimilarity(EdgeSimilarityMeasure):
     def similarity_from_edges(self, qid_a, qid_b, edges_a, edges_b):
         # Add self link
-        edges_a.add(qid_a)
-        edges_b.add(qid_b)
+        edges_a = numpy.union1d(edges_a, [qid_a])
+        edges_b = numpy.union1d(edges_b, [qid_b])
 
-        len_common = float(len(edges_a.intersection(edges_b)))
+        len_common = float(nb_common_edges(edges_a, edges_b))
 
         return 0.5* ( len_common  / len(edges_a) + len_common / len(edges_b))
 
@@ -55,15 +108,90 @@ class OneStepSimilarity(EdgeSimilarityMeasure):
 
     def similarity_from_edges(self, qid_a, qid_b, edges_a, edges_b):
         beta = self.beta
-        len_common = float(len(edges_a.intersection(edges_b)))
+        len_common = float(nb_common_edges(edges_a, edges_b))
         proba = 0.
         if qid_a == qid_b:
             proba += beta * beta
-        if qid_b in edges_a:
+        if has_edge(edges_a, qid_b):
             proba += (1- beta)*beta/len(edges_a)
-        if qid_a in edges_b:
+        if has_edge(edges_b, qid_a):
             proba += beta*(1-beta)/len(edges_b)
         if len_common:
             proba += (1-beta)*(1-beta)*(len_common/len(edges_a))*(len_common/len(edges_b))
 
         return proba
+
+
+def similarity_matrix(mentions, measure, max_distance, smoothing, graph=None):
+    """
+    Computes the similarities between the tags of nearby mentions in a document,
+    as a sparse matrix.
+
+    The tags are numbered in the order of the mentions, and then of the tags
+    in each mention. Each tag is similar to itself with a score of smoothing.
+    It is similar to a tag of another mention at a distance (in characters)
+    below max_distance with a score of smoothing plus their similarity,
+    weighted by (max_distance - distance) / max_distance. Each row of the
+    matrix is normalized so that it sums to one.
+
+    The pairs of nearby mentions are found by interval search on the
+    mentions sorted by offset, so only these pairs are considered.
+
+    :param mentions: the list of mentions of the document
+    :param measure: the EdgeSimilarityMeasure used to compare tags
+    :param graph: if provided, the WikidataGraph where the edges of
+        the items are read, instead of the edges stored in the tags
+    :returns: a sparse matrix, whose cell (i, j) is the normalized
+        similarity of the i-th tag to the j-th tag
+    """
+    tags = [tag for mention in mentions for tag in mention.tags]
+    nb_tags = len(tags)
+    if not nb_tags:
+        return sparse.csr_matrix((0, 0))
+    starts = numpy.array([mention.start for mention in mentions], dtype=numpy.int64)
+    ends = numpy.array([mention.end for mention in mentions], dtype=numpy.int64)
+    nb_mention_tags = numpy.array([len(mention.tags) for mention in mentions], dtype=numpy.int64)
+    tag_offsets = numpy.cumsum(nb_mention_tags) - nb_mention_tags
+
+    # For each mention, the range of mentions (sorted by start) which can be at
+    # a distance below max_distance: those which start before its end plus max_distance,
+    # excluding the first ones, whose ends are all below its start minus max_distance.
+    order = numpy.argsort(starts, kind='stable')
+    sorted_starts = starts[order]
+    max_ends = numpy.maximum.accumulate(ends[order])
+    lower = numpy.searchsorted(max_ends, starts - max_distance, side='right')
+    upper = numpy.searchsorted(sorted_starts, ends + max_distance, side='left')
+    counts = numpy.maximum(upper - lower, 0)
+    first = numpy.repeat(numpy.arange(len(mentions)), counts)
+    second = order[numpy.repeat(lower - numpy.cumsum(counts) + counts, counts) + numpy.arange(counts.sum())]
+
+    distances = numpy.maximum(starts[first] - ends[second], starts[second] - ends[first])
+    kept = (distances < max_distance) & ((starts[first] != starts[second]) | (ends[first] != ends[second]))
+    first, second, distances = first[kept], second[kept], distances[kept]
+
+    # Expand the pairs of mentions into pairs of their tags
+    pair_sizes = nb_mention_tags[first] * nb_mention_tags[second]
+    pair_idx = numpy.repeat(numpy.arange(len(first)), pair_sizes)
+    local = numpy.arange(pair_sizes.sum()) - numpy.repeat(numpy.cumsum(pair_sizes) - pair_sizes, pair_sizes)
+    a = tag_offsets[first][pair_idx] + local // nb_mention_tags[second][pair_idx]
+    b = tag_offsets[second][pair_idx] + local % nb_mention_tags[second][pair_idx]
+
+    qids = numpy.array([int(tag.id[1:]) for tag in tags], dtype=numpy.int64)
+    if graph is not None:
+        edges = [numpy.asarray(graph.get_edges(tag.id), dtype=numpy.int64) for tag in tags]
+    else:
+        edges = [numpy.unique(numpy.array(tag.edges, dtype=numpy.int64)) for tag in tags]
+    scores = smoothing + measure.pairwise_similarities(qids, edges, a, b)
+    scores *= (max_distance - distances[pair_idx]) / float(max_distance)
+    positive = scores > 0.
+
+    diagonal = numpy.arange(nb_tags)
+    matrix = sparse.csr_matrix(
+        (numpy.concatenate([numpy.full(nb_tags, float(smoothing)), scores[positive]]),
+         (numpy.concatenate([diagonal, a[positive]]), numpy.concatenate([diagonal, b[positive]]))),
+        shape=(nb_tags, nb_tags))
+
+    # Normalize
+    weight_sums = numpy.asarray(matrix.sum(axis=1)).reshape(-1)
+    weight_sums[weight_sums <= 0.] = 1.
+    return sparse.diags(1. / weight_sums).dot(matrix).tocsr()
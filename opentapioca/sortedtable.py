@@ -0,0 +1,60 @@
+import os
+import numpy
+
+class SortedStringTable(object):
+    """
+    An immutable, sorted array of byte strings, stored as a blob
+    and an array of offsets. Both can be memory-mapped, so that
+    lookups do not require loading the table in memory.
+    """
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        return self.blob[self.offsets[idx]:self.offsets[idx+1]].tobytes()
+
+    def lower_bound(self, key, lo=0):
+        """
+        Returns the index of the first string which is greater or equal to the key.
+        """
+        hi = len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self[mid] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def find(self, key):
+        """
+        Returns the index of the key, or None if it is not in the table.
+        """
+        idx = self.lower_bound(key)
+        if idx < len(self) and self[idx] == key:
+            return idx
+
+    @classmethod
+    def write(cls, sorted_strings, blob_fname, offsets_fname):
+        """
+        Writes a sorted iterable of byte strings to disk.
+        """
+        offsets = [0]
+        with open(blob_fname, 'wb') as f:
+            for string in sorted_strings:
+                f.write(string)
+                offsets.append(offsets[-1] + len(string))
+        numpy.save(offsets_fname, numpy.array(offsets, dtype=numpy.int64))
+
+    @classmethod
+    def load(cls, blob_fname, offsets_fname):
+        if os.path.getsize(blob_fname):
+            blob = numpy.memmap(blob_fname, dtype=numpy.uint8, mode='r')
+        else:
+            blob = numpy.zeros(0, dtype=numpy.uint8)
+        return cls(blob, numpy.load(offsets_fname, mmap_mode='r'))
@@ -0,0 +1,308 @@
+"""
+Backends used by the Tagger to find mentions of items in text,
+and to retrieve the documents of the candidate items.
+"""
+import hashlib
+import json
+import logging
+import threading
+from abc import ABC
+from abc import abstractmethod
+
+import requests
+
+from .transport import get_default_transport
+from .transport import AsyncHttpTransport
+
+logger = logging.getLogger(__name__)
+
+class TagBackend(ABC):
+    """
+    Interface of a tagging backend. Subclasses must implement
+    tag and fetch_documents.
+
+    Tags are returned as (start offset, end offset, list of ids) triples,
+    and documents as dicts in the format of Solr responses (in particular,
+    the label is a list).
+    """
+
+    #: number of requests which can usefully be sent concurrently to the backend
+    concurrency = 1
+
+    @abstractmethod
+    def tag(self, text, fields, tags_limit):
+        """
+        Finds mentions of items in a text.
+
+        :param text: the text to tag
+        :param fields: the fields of the candidate documents to return
+        :param tags_limit: the maximum number of tags to return
+        :returns: a pair made of the list of tags and the list of the documents of
+            all candidate items
+        """
+
+    @abstractmethod
+    def fetch_documents(self, qids, fields):
+        """
+        Retrieves the documents of the given items.
+
+        :param fields: the fields of the documents to return
+        :returns: the list of documents found
+        """
+
+    def index_version(self):
+        """
+        Identifies the version of the index, which changes when
+        items are indexed again.
+
+        :returns: a string, or None if the version cannot be determined
+        """
+        return None
+
+    async def tag_async(self, text, fields, tags_limit):
+        """
+        Asynchronous version of tag. By default, this simply calls tag,
+        which is suitable for backends which do not perform any I/O.
+        """
+        return self.tag(text, fields, tags_limit)
+
+    async def fetch_documents_async(self, qids, fields):
+        """
+        Asynchronous version of fetch_documents.
+        """
+        return self.fetch_documents(qids, fields)
+
+    async def close(self):
+        """
+        Releases the resources held by the backend.
+        """
+        pass
+
+def text_key(text):
+    """
+    The key under which the tags of a text are recorded.
+
+    >>> text_key('I live in Vanuatu')
+    '3a1a6c4835f89a0914687475e0c9fef03aa9c42c'
+    """
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+class SolrTagBackend(TagBackend):
+    """
+    Tags text with the tag handler of a Solr collection.
+    """
+
+    def __init__(self, solr_collection, solr_endpoint='http://localhost:8983/solr/', transport=None, async_transport=None):
+        """
+        :param solr_collection: the name of the Solr collection where the items are indexed
+        :param solr_endpoint: the base URL of the Solr server
+        :param transport: the HttpTransport used to reach Solr. If not provided,
+            a transport shared with other components is used.
+        :param async_transport: the AsyncHttpTransport used by the asynchronous methods.
+            It is created on first use if not provided.
+        """
+        self.transport = transport or get_default_transport()
+        self.async_transport = async_transport
+        self.tag_endpoint = '{}{}/tag'.format(solr_endpoint, solr_collection)
+        self.select_endpoint = '{}{}/select'.format(solr_endpoint, solr_collection)
+        self.luke_endpoint = '{}{}/admin/luke'.format(solr_endpoint, solr_collection)
+
+    @property
+    def concurrency(self):
+        return self.transport.pool_size
+
+    def _tag_params(self, fields, tags_limit):
+        """
+        The parameters of the request sent to the Solr tag handler.
+        """
+        return {'overlaps':'NO_SUB',
+             'tagsLimit':tags_limit,
+             'fl':','.join(fields),
+             'wt':'json',
+             'indent':'off',
+            }
+
+    def _fetch_params(self, qids, fields):
+        """
+        The parameters of the request fetching the documents of the given items.
+        """
+        return {'q':'{!terms f=id}'+','.join(qids),
+            'fl':','.join(fields),
+            'rows':str(len(qids)),
+            'wt':'json',
+            'indent':'off',
+            }
+
+    def _parse_tag_response(self, resp):
+        """
+        Extracts the tags and documents of a Solr response.
+        """
+        tags = []
+        for lst in resp.get('tags', []):
+            tag = self._dictify(lst)
+            tags.append((tag['startOffset'], tag['endOffset'], tag['ids']))
+        return tags, resp.get('response', {}).get('docs', [])
+
+    def _dictify(self, lst):
+        """
+        Converts a list of [key1,val1,key2,val2,...] to a dict
+        """
+        return {
+            lst[2*k]: lst[2*k+1]
+            for k in range(len(lst)//2)
+        }
+
+    def tag(self, text, fields, tags_limit):
+        logger.debug('Tagging text with solr (length {})'.format(len(text)))
+        r = self.transport.post(self.tag_endpoint,
+            params=self._tag_params(fields, tags_limit),
+            headers ={'Content-Type':'text/plain'},
+            data=text.encode('utf-8'))
+        r.raise_for_status()
+        logger.debug('Tagging succeeded')
+        return self._parse_tag_response(r.json())
+
+    def fetch_documents(self, qids, fields):
+        logger.debug('Fetching {} documents from solr'.format(len(qids)))
+        r = self.transport.post(self.select_endpoint, data=self._fetch_params(qids, fields))
+        r.raise_for_status()
+        return r.json().get('response', {}).get('docs', [])
+
+    def index_version(self):
+        """
+        The version of the Solr index, as reported by the Luke handler.
+        Returns None if Solr cannot be reached.
+        """
+        try:
+            r = self.transport.get(self.luke_endpoint, params={'numTerms':'0', 'wt':'json'})
+            r.raise_for_status()
+            return str(r.json()['index']['version'])
+        except (requests.exceptions.RequestException, ValueError, KeyError):
+            logger.warning('Could not retrieve the version of the Solr index')
+            return None
+
+    def _get_async_transport(self):
+        if self.async_transport is None:
+            self.async_transport = AsyncHttpTransport()
+        return self.async_transport
+
+    async def tag_async(self, text, fields, tags_limit):
+        logger.debug('Tagging text with solr (length {})'.format(len(text)))
+        resp = await self._get_async_transport().request_json('POST', self.tag_endpoint,
+            params=self._tag_params(fields, tags_limit),
+            headers ={'Content-Type':'text/plain'},
+            data=text.encode('utf-8'))
+        logger.debug('Tagging succeeded')
+        return self._parse_tag_response(resp)
+
+    async def fetch_documents_async(self, qids, fields):
+        logger.debug('Fetching {} documents from solr'.format(len(qids)))
+        resp = await self._get_async_transport().request_json('POST', self.select_endpoint,
+            data=self._fetch_params(qids, fields))
+        return resp.get('response', {}).get('docs', [])
+
+    async def close(self):
+        if self.async_transport is not None:
+            await self.async_transport.close()
+
+class MissingRecording(Exception):
+    """
+    Raised when replaying a text which was not recorded.
+    """
+    pass
+
+class RecordingTagBackend(TagBackend):
+    """
+    Wraps another backend, and records its responses in a file
+    which can then be replayed with a ReplayTagBackend.
+
+    The file is in JSON lines format. Each line either records the tags
+    of a text (keyed by the SHA-1 hash of the text), or the document of an item.
+    """
+
+    def __init__(self, backend, fname):
+        """
+        :param backend: the backend to record
+        :param fname: the file where responses are recorded. Records are
+            appended to any existing file.
+        """
+        self.backend = backend
+        self.fname = fname
+        self.recorded_ids = set()
+        self._lock = threading.Lock()
+
+    @property
+    def concurrency(self):
+        return self.backend.concurrency
+
+    def _record(self, text, tags, docs):
+        with self._lock:
+            with open(self.fname, 'a') as f:
+                if text is not None:
+                    f.write(json.dumps({'text': text_key(text), 'tags': tags})+'\n')
+                for doc in docs:
+                    if doc['id'] not in self.recorded_ids and len(doc) > 1:
+                        self.recorded_ids.add(doc['id'])
+                        f.write(json.dumps({'doc': doc})+'\n')
+
+    def tag(self, text, fields, tags_limit):
+        tags, docs = self.backend.tag(text, fields, tags_limit)
+        self._record(text, tags, docs)
+        return tags, docs
+
+    def fetch_documents(self, qids, fields):
+        docs = self.backend.fetch_documents(qids, fields)
+        self._record(None, [], docs)
+        return docs
+
+    def index_version(self):
+        return self.backend.index_version()
+
+    async def tag_async(self, text, fields, tags_limit):
+        tags, docs = await self.backend.tag_async(text, fields, tags_limit)
+        self._record(text, tags, docs)
+        return tags, docs
+
+    async def fetch_documents_async(self, qids, fields):
+        docs = await self.backend.fetch_documents_async(qids, fields)
+        self._record(None, [], docs)
+        return docs
+
+    async def close(self):
+        await self.backend.close()
+
+class ReplayTagBackend(TagBackend):
+    """
+    Serves the responses recorded by a RecordingTagBackend,
+    without any access to the original backend.
+    """
+
+    def __init__(self, fname):
+        """
+        :param fname: the file where responses were recorded
+        """
+        self.fname = fname
+        self.tags = {}
+        self.docs = {}
+        with open(fname, 'r') as f:
+            for line in f:
+                record = json.loads(line)
+                if 'doc' in record:
+                    self.docs[record['doc']['id']] = record['doc']
+                else:
+                    self.tags[record['text']] = [tuple(tag) for tag in record['tags']]
+
+    def tag(self, text, fields, tags_limit):
+        key = text_key(text)
+        if key not in self.tags:
+            raise MissingRecording('No tags recorded for text "{}"'.format(text[:50]))
+        tags = self.tags[key][:tags_limit]
+        qids = sorted({qid for _, _, ids in tags for qid in ids})
+        return tags, self.fetch_documents(qids, fields)
+
+    def fetch_documents(self, qids, fields):
+        return [
+            {k: v for k, v in self.docs[qid].items() if k in fields}
+            for qid in qids
+            if qid in self.docs
+        ]
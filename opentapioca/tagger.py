@@ -1,17 +1,60 @@
+import asyncio
 import json
-import requests
 import logging
 import re
-from math import log
+import numpy
+from concurrent.futures import ThreadPoolExecutor
 
 from .languagemodel import BOWLanguageModel
 from .wikidatagraph import WikidataGraph
 from .tag import Tag
 from .mention import Mention
+from .tagbackends import SolrTagBackend
 
 # solr_collection = 'wd_multilingual'
 logger = logging.getLogger(__name__)
 
+sentence_end_re = re.compile(r'[.!?\n]\s+')
+whitespace_re = re.compile(r'\s+')
+
+def split_windows(text, window_size, overlap):
+    """
+    Splits a text in overlapping windows of at most window_size characters.
+    Windows end on a sentence boundary if there is one in the last
+    part of the window (of length overlap), otherwise on whitespace.
+    Two consecutive windows overlap by about overlap characters, starting
+    after some whitespace.
+
+    :returns: the list of windows, as (offset, text) pairs
+
+    >>> split_windows('One two. Three four five.', 12, 6)
+    [(0, 'One two. '), (4, 'two. Three '), (15, 'four five.')]
+    >>> split_windows('short', 12, 6)
+    [(0, 'short')]
+    """
+    windows = []
+    start = 0
+    while True:
+        end = start + window_size
+        if end >= len(text):
+            windows.append((start, text[start:]))
+            return windows
+        # find the last sentence end in the tail of the window, or the last whitespace
+        tail_start = max(start + 1, end - overlap)
+        boundaries = [m.end() for m in sentence_end_re.finditer(text, tail_start, end)]
+        if not boundaries:
+            boundaries = [m.end() for m in whitespace_re.finditer(text, start + 1, end)]
+        if boundaries:
+            end = boundaries[-1]
+        windows.append((start, text[start:end]))
+
+        # start the next window after some whitespace, overlap characters before the end
+        next_start = end
+        for m in whitespace_re.finditer(text, max(start + 1, end - overlap), end):
+            next_start = m.end()
+            break
+        start = next_start
+
 class Tagger(object):
     """
     The tagger indexes a Wikidata dump in Solr
@@ -19,55 +62,201 @@ class Tagger(object):
     items in text.
     """
 
-    def __init__(self, solr_collection, bow, graph):
+    def __init__(self, solr_collection, bow, graph, transport=None, solr_endpoint='http://localhost:8983/solr/', async_transport=None, windowed=False, candidate_cache=None, backend=None, graph_edges=False):
         """
         Creates a tagger from:
         - a solr collection name, which has been adequately initialized with a compatible index and filled with documents
         - a bag of words language model, adequately trained, which will be used to evaluate the likelihood of phrases
         - a wikidata graph, adequately loaded, which will be used to compute the page rank and the edges between items
+
+        :param transport: the HttpTransport used to reach Solr. If not provided,
+            a transport shared with other components is used.
+        :param solr_endpoint: the base URL of the Solr server
+        :param async_transport: the AsyncHttpTransport used by tag_and_rank_async.
+            It is created on first use if not provided.
+        :param windowed: if True, texts longer than max_length are split in overlapping
+            windows which are tagged in parallel, instead of being truncated.
+        :param candidate_cache: a CandidateCache storing the Solr documents of candidates
+            across requests. When it is provided, Solr only returns the ids of the
+            candidates, and documents missing from the cache are fetched in bulk.
+        :param backend: the TagBackend used to find mentions in text. If it is
+            provided, the Solr-related arguments above are ignored.
+        :param graph_edges: if True, the edges of the candidates are not retrieved
+            with their documents: the similarities between candidates are computed from
+            the edges of the graph (memory-mapped with WikidataGraph.load_edges) instead.
         """
+        self.solr_collection = solr_collection
         self.bow = bow
         self.graph = graph
-        self.solr_endpoint = 'http://localhost:8983/solr/{}/tag'.format(solr_collection)
+        if backend is None:
+            backend = SolrTagBackend(solr_collection, solr_endpoint=solr_endpoint,
+                transport=transport, async_transport=async_transport)
+        self.backend = backend
+        self.graph_edges = graph_edges
+        self.document_fields = ['id', 'label', 'aliases', 'extra_aliases', 'desc', 'nb_statements', 'nb_sitelinks', 'edges', 'types']
+        if graph_edges:
+            self.document_fields.remove('edges')
+        self.candidate_cache = candidate_cache
         self.prune_re = re.compile(r'^(\w\w?|[\d ]{,4})$')
         self.max_length = 10000
+        self.tags_limit = 500
+        self.windowed = windowed
+        self.window_overlap = 300
 
     def tag_and_rank(self, phrase, prune=True):
         """
         Given some text, use the solr index to retrieve candidate items mentioned in the text.
+        Texts longer than max_length are truncated, unless the tagger is windowed.
+
+        :param prune: if True, ignores lowercase mentions shorter than 3 characters
+        """
+        if self.windowed and len(phrase) > self.max_length:
+            windows = split_windows(phrase, self.max_length, self.window_overlap)
+            max_workers = min(self.backend.concurrency, len(windows))
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                responses = list(executor.map(self._tag, [window for _, window in windows]))
+            tags, docs = self._merge_window_responses(windows, responses)
+        else:
+            phrase = phrase[:self.max_length]
+            tags, docs = self._tag(phrase)
+        if self.candidate_cache is not None:
+            docs, missing = self._cached_documents(tags)
+            if missing:
+                docs += self._fetch_documents(missing)
+        return self._mentions_from_response(phrase, tags, docs, prune)
+
+    def tag_and_rank_many(self, phrases, prune=True, max_workers=None):
+        """
+        Tags and ranks many texts at once. The requests to the backend are sent
+        concurrently from a bounded pool of threads.
+
+        :param phrases: the list of texts to tag
         :param prune: if True, ignores lowercase mentions shorter than 3 characters
+        :param max_workers: the maximum number of concurrent requests. Defaults
+            to the concurrency supported by the backend (for Solr, the size of the
+            connection pool of the transport).
+        :returns: the list of mentions of each text, in the same order as the input
+        """
+        if not phrases:
+            return []
+        max_workers = min(max_workers or self.backend.concurrency, len(phrases))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(lambda phrase: self.tag_and_rank(phrase, prune), phrases))
+
+    async def tag_and_rank_async(self, phrase, prune=True, executor=None):
+        """
+        Asynchronous version of tag_and_rank. The request to the backend is sent
+        without blocking the event loop, and the ranking of the candidates runs in
+        the given executor (by default, the default executor of the loop).
+        """
+        if self.windowed and len(phrase) > self.max_length:
+            windows = split_windows(phrase, self.max_length, self.window_overlap)
+            responses = await asyncio.gather(*[
+                self.backend.tag_async(window, self._requested_fields(), self.tags_limit)
+                for _, window in windows
+            ])
+            tags, docs = self._merge_window_responses(windows, responses)
+        else:
+            phrase = phrase[:self.max_length]
+            tags, docs = await self.backend.tag_async(phrase, self._requested_fields(), self.tags_limit)
+        if self.candidate_cache is not None:
+            docs, missing = self._cached_documents(tags)
+            if missing:
+                fetched = await self.backend.fetch_documents_async(missing, self.document_fields)
+                self.candidate_cache.put_many(fetched)
+                docs += fetched
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, self._mentions_from_response, phrase, tags, docs, prune)
+
+    def _requested_fields(self):
+        """
+        The fields of the candidate documents requested when tagging.
+        """
+        return ['id'] if self.candidate_cache is not None else self.document_fields
+
+    def _tag(self, phrase):
+        """
+        Finds the mentions in the text with the backend.
+
+        :returns: the list of (start, end, ids) tags and the list of candidate documents
+        """
+        return self.backend.tag(phrase, self._requested_fields(), self.tags_limit)
+
+    def _cached_documents(self, tags):
+        """
+        Looks up the documents of the candidates in the candidate cache.
+
+        :returns: the list of documents found, and the list of missing qids
+        """
+        qids = {qid for _, _, ids in tags for qid in ids}
+        return self.candidate_cache.get_many(sorted(qids))
+
+    def _fetch_documents(self, qids):
+        """
+        Fetches the documents of the given items from the backend,
+        in a single request, and adds them to the candidate cache.
+        """
+        docs = self.backend.fetch_documents(qids, self.document_fields)
+        self.candidate_cache.put_many(docs)
+        return docs
+
+    def _merge_window_responses(self, windows, responses):
+        """
+        Merges the tags found in the windows of a text, as if the whole
+        text had been tagged at once. The offsets of the tags are shifted to
+        the original text. Tags found twice in the overlap of two windows are
+        only kept once, and tags contained in a longer tag are removed (as with
+        overlaps=NO_SUB in Solr).
+
+        :param windows: the list of (offset, text) windows of the text
+        :param responses: the (tags, docs) pairs returned by the backend for each window
         """
-        # Tag
-        phrase = phrase[:self.max_length]
-        logger.debug('Tagging text with solr (length {})'.format(len(phrase)))
-        r = requests.post(self.solr_endpoint,
-            params={'overlaps':'NO_SUB',
-             'tagsLimit':500,
-             'fl':'id,label,aliases,extra_aliases,desc,nb_statements,nb_sitelinks,edges,types',
-             'wt':'json',
-             'indent':'off',
-            },
-            headers ={'Content-Type':'text/plain'},
-            data=phrase.encode('utf-8'))
-        r.raise_for_status()
-        logger.debug('Tagging succeeded')
-        resp = r.json()
+        spans = {}
+        docs = {}
+        for (offset, _), (window_tags, window_docs) in zip(windows, responses):
+            for start, end, ids in window_tags:
+                spans.setdefault((offset + start, offset + end), ids)
+            for doc in window_docs:
+                docs[doc['id']] = doc
 
+        # Remove the tags strictly included in another one. Sorting by start
+        # and decreasing end ensures the enclosing tag comes first.
+        tags = []
+        max_end = -1
+        for start, end in sorted(spans, key=lambda span: (span[0], -span[1])):
+            if end <= max_end:
+                continue
+            max_end = end
+            tags.append((start, end, spans[(start, end)]))
+
+        return tags, list(docs.values())
+
+    def _mentions_from_response(self, phrase, tags, docs, prune=True):
+        """
+        Creates the mentions from the tags found by the backend.
+
+        :param phrase: the text which was tagged
+        :param tags: the list of (start, end, ids) tags
+        :param docs: the list of candidate documents
+        :param prune: if True, ignores lowercase mentions shorter than 3 characters
+        """
         # Enhance mentions with page rank and edge similarity
-        mentions_json = [
-            self._dictify(mention)
-            for mention in resp.get('tags', [])
-        ]
         docs = {
             doc['id']:doc
-            for doc in resp.get('response', {}).get('docs', [])
+            for doc in docs
         }
 
+        surface_scores = self.bow.log_likelihood_many([phrase[start:end] for start, end, _ in tags])
+        qids = list({qid for _, _, ids in tags for qid in ids})
+        ranks = dict(zip(qids, 23. + numpy.log(self.graph.get_pageranks(qids))))
         mentions = [
-            self._create_mention(phrase, mention, docs, mentions_json)
-            for mention in mentions_json
+            self._create_mention(phrase, tag, docs, surface_score, ranks)
+            for tag, surface_score in zip(tags, surface_scores)
         ]
 
+        if not prune:
+            return mentions
+
         pruned_mentions = [
             mention
             for mention in mentions
@@ -88,25 +277,24 @@ class Tagger(object):
         """
         return self.prune_re.match(phrase) is not None and phrase.lower() == phrase
 
-    def _create_mention(self, phrase, mention, docs, mentions):
+    def _create_mention(self, phrase, tag, docs, surface_score, ranks):
         """
-        Adds more info to the mentions returned from Solr, to prepare
+        Adds more info to the mentions returned by the backend, to prepare
         them for ranking by the classifier.
 
         :param phrase: the original document
-        :param mention: the JSON mention to enhance with scores
+        :param tag: the (start, end, ids) tag to enhance with scores
         :param docs: dictionary from qid to item
-        :param mentions: the list of all mentions in the document
+        :param surface_score: the log-likelihood of the surface of the mention
+        :param ranks: dictionary from qid to the rank feature, derived from the PageRank
         :returns: the enhanced mention, as a Mention object
         """
-        start = mention['startOffset']
-        end = mention['endOffset']
+        start, end, ids = tag
         surface = phrase[start:end]
-        surface_score = self.bow.log_likelihood(surface)
         ranked_tags = []
-        for qid in mention['ids']:
+        for qid in ids:
             item = dict(docs[qid].items())
-            item['rank'] = 23. + log(self.graph.get_pagerank(qid))
+            item['rank'] = float(ranks[qid])
             item['label'] = item['label'][0] if item.get('label') else None
             ranked_tags.append(Tag(**item))
 
@@ -118,15 +306,6 @@ class Tagger(object):
             tags=sorted(ranked_tags, key=lambda tag: -tag.rank)[:10],
         )
 
-    def _dictify(self, lst):
-        """
-        Converts a list of [key1,val1,key2,val2,...] to a dict
-        """
-        return {
-            lst[2*k]: lst[2*k+1]
-            for k in range(len(lst)//2)
-        }
-
 
 if __name__ == '__main__':
     import sys
@@ -2,6 +2,7 @@ import json
 import requests
 import logging
 from opentapioca.typematcher import TypeMatcher
+from opentapioca.transport import get_default_transport
 
 logger = logging.getLogger(__name__)
 
@@ -17,20 +18,25 @@ class TaggerFactory(object):
 
     def __init__(self,
                  solr_endpoint='http://localhost:8983/solr/',
-                 type_matcher=None):
+                 type_matcher=None,
+                 transport=None):
         """
         A type matcher can be provided to restrict the indexed
         items to particular classes.
+
+        :param transport: the HttpTransport used to reach Solr. If not provided,
+            a transport shared with other components is used.
         """
         self.solr_endpoint = solr_endpoint
         self.type_matcher = type_matcher or TypeMatcher()
+        self.transport = transport or get_default_transport()
 
     def create_collection(self, collection_name, num_shards=1, configset='tapioca'):
         """
         Creates a collection and inits it with the
         appropriate index structure to be used by a tagger object.
         """
-        r = requests.get(self.solr_endpoint + 'admin/collections', {
+        r = self.transport.get(self.solr_endpoint + 'admin/collections', {
             'action':'CREATE',
             'name':collection_name,
             'collection.configName':configset,
@@ -43,7 +49,7 @@ class TaggerFactory(object):
         """
         Drops a solr collection.
         """
-        r = requests.get(self.solr_endpoint + 'admin/collections', {'action':'DELETE','name':collection_name})
+        r = self.transport.get(self.solr_endpoint + 'admin/collections', {'action':'DELETE','name':collection_name})
         r.raise_for_status()
 
     def index_stream(self,
@@ -115,7 +121,7 @@ class TaggerFactory(object):
             'add': docs_to_add,
             'delete': ids_to_delete,
         }
-        r = requests.post(self._collection_update_endpoint(collection),
+        r = self.transport.post(self._collection_update_endpoint(collection),
             params={'commit': 'true' if commit else 'false'},
             data=json.dumps(payload), headers={'Content-Type':'application/json'})
         try:
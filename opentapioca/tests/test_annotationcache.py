@@ -0,0 +1,33 @@
+from opentapioca.annotationcache import AnnotationCache
+from opentapioca.annotationcache import model_version
+
+class VersionedModel(object):
+    version = 'v1'
+
+def test_lru():
+    cache = AnnotationCache(lambda: 'v1', max_entries=2)
+    cache.put('a', [{'start': 0}])
+    cache.put('b', [])
+    assert cache.get('a') == [{'start': 0}]
+    cache.put('c', [])
+    assert cache.get('b') is None
+    assert cache.get('c') == []
+    stats = cache.stats()
+    assert stats['entries'] == 2
+    assert stats['hits'] == 2
+    assert stats['misses'] == 1
+
+def test_invalidation_on_reload(tmpdir):
+    model = VersionedModel()
+    path = str(tmpdir.join('annotations.sqlite'))
+    cache = AnnotationCache(lambda: model_version(model), path=path)
+    cache.put('some text', [{'start': 0}])
+    model.version = 'v2'
+    assert cache.get('some text') is None
+    assert cache.stats()['invalidations'] == 1
+
+    cache.put('some text', [{'start': 1}])
+    # the annotations survive a restart
+    restarted = AnnotationCache(lambda: model_version(model), path=path)
+    assert restarted.get('some text') == [{'start': 1}]
+    assert restarted.stats()['disk_hits'] == 1
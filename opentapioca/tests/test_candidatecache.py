@@ -0,0 +1,74 @@
+import asyncio
+import os
+import pytest
+from opentapioca.candidatecache import CandidateCache
+from opentapioca.tagger import Tagger
+from opentapioca.languagemodel import BOWLanguageModel
+from opentapioca.wikidatagraph import WikidataGraph
+from .test_fixtures import testdir
+from .test_fixtures import sample_solr_docs
+from .test_fixtures import mock_solr
+from .test_fixtures import solr_server
+
+def test_lru_eviction():
+    cache = CandidateCache(max_bytes=60)
+    cache.put_many([{'id':'Q1', 'label':'one'}, {'id':'Q2', 'label':'two'}])
+    found, missing = cache.get_many(['Q1', 'Q3'])
+    assert found == [{'id':'Q1', 'label':'one'}]
+    assert missing == ['Q3']
+
+    # Q2 is the least recently used document
+    cache.put_many([{'id':'Q3', 'label':'three'}])
+    found, missing = cache.get_many(['Q1', 'Q2', 'Q3'])
+    assert missing == ['Q2']
+
+    stats = cache.stats()
+    assert stats['evictions'] == 1
+    assert stats['hits'] == 3
+    assert stats['misses'] == 2
+    assert stats['hit_rate'] == pytest.approx(0.6)
+    assert stats['bytes'] <= 60
+
+def test_expiration():
+    cache = CandidateCache(ttl=0)
+    cache.put_many([{'id':'Q1'}])
+    assert cache.get_many(['Q1']) == ([], ['Q1'])
+    assert cache.stats()['expirations'] == 1
+
+def test_tagger_with_cache(mock_solr, testdir):
+    bow = BOWLanguageModel()
+    bow.load(os.path.join(testdir, 'data/sample_bow.pkl'))
+    graph = WikidataGraph()
+    graph.load_pagerank(os.path.join(testdir, 'data/sample_wikidata_items.pgrank.npy'))
+    reference = Tagger('wd_test_collection', bow, graph)
+    tagger = Tagger('wd_test_collection', bow, graph, candidate_cache=CandidateCache())
+
+    for text in ['From Lisbon to Oslo', 'Oslo and Bonn', 'Lisbon, Oslo, Bonn']:
+        expected = reference.tag_and_rank(text)
+        mentions = tagger.tag_and_rank(text)
+        assert [m.json() for m in mentions] == [m.json() for m in expected]
+
+    # the last request was entirely served from the cache
+    assert mock_solr.nb_select_requests == 2
+    assert tagger.candidate_cache.stats()['hits'] == 4
+
+def test_async_tagger_with_cache(solr_server, testdir):
+    pytest.importorskip('aiohttp')
+    bow = BOWLanguageModel()
+    bow.load(os.path.join(testdir, 'data/sample_bow.pkl'))
+    graph = WikidataGraph()
+    graph.load_pagerank(os.path.join(testdir, 'data/sample_wikidata_items.pgrank.npy'))
+    tagger = Tagger('wd_test_collection', bow, graph, solr_endpoint=solr_server, candidate_cache=CandidateCache())
+
+    async def tag_twice(text):
+        try:
+            first = await tagger.tag_and_rank_async(text)
+            second = await tagger.tag_and_rank_async(text)
+            return first, second
+        finally:
+            await tagger.backend.close()
+
+    first, second = asyncio.run(tag_twice('From Lisbon to Oslo'))
+    assert [m.json() for m in first] == [m.json() for m in second]
+    assert first[0].tags[0].label == 'Lisbon'
+    assert tagger.candidate_cache.stats()['hits'] == 2
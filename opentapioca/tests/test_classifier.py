@@ -1,18 +1,25 @@
 
 import unittest
 import os
+import numpy
 import pytest
 from opentapioca.languagemodel import BOWLanguageModel
 from opentapioca.wikidatagraph import WikidataGraph
 from opentapioca.taggerfactory import TaggerFactory
 from opentapioca.tagger import Tagger
 from opentapioca.classifier import SimpleTagClassifier
+from opentapioca.similarities import OneStepSimilarity
+from opentapioca.linearscorer import LinearScorer
+from opentapioca.mentionstore import MentionStore
 from opentapioca.indexingprofile import IndexingProfile
 from opentapioca.readers.dumpreader import WikidataDumpReader
 from opentapioca.tag import Tag
 from opentapioca.mention import Mention
 from pynif import NIFCollection
 from opentapioca.taggerfactory import CollectionAlreadyExists
+from .test_fixtures import testdir
+from .test_fixtures import sample_solr_docs
+from .test_fixtures import mock_solr
 
 class ClassifierTest(unittest.TestCase):
     
@@ -67,8 +74,9 @@ class ClassifierTest(unittest.TestCase):
             Mention(phrase='Sweden', start=37, end=43, tags=[Tag(id='Q34', edges=[458])], log_likelihood=1),
             Mention(phrase='EU', start=48, end=50, tags=[Tag(id='Q458')], log_likelihood=1),
         ]
+        similarities = self.classifier.compute_similarity_matrix(mentions)
         for mention in mentions:
-            self.classifier.compute_similarities(mention, mentions)
+            self.classifier.compute_similarities(mention, mentions, similarities)
             
         id1 = (0, 7, 'Q686')
         id2 = (37, 43, 'Q34')
@@ -83,3 +91,120 @@ class ClassifierTest(unittest.TestCase):
         
 
         
+
+class RankFitStub(object):
+    """
+    Stands for a trained model: scores tags by their rank
+    """
+    def decision_function(self, feature_array):
+        return numpy.asarray(feature_array)[:,1]
+
+@pytest.fixture
+def mocked_classifier(testdir, mock_solr):
+    bow = BOWLanguageModel()
+    bow.load(os.path.join(testdir, 'data/sample_bow.pkl'))
+    graph = WikidataGraph()
+    graph.load_pagerank(os.path.join(testdir, 'data/sample_wikidata_items.pgrank.npy'))
+    classifier = SimpleTagClassifier(Tagger('wd_test_collection', bow, graph), max_similarity_distance=10)
+    classifier.fit = RankFitStub()
+    return classifier
+
+def test_classify_mentions_many(mocked_classifier):
+    texts = ['Lisbon and Portugal', 'Nothing', 'Oslo, Bonn and Lisbon']
+    batch = mocked_classifier.create_mentions_many(texts)
+    mocked_classifier.classify_mentions_many(batch)
+
+    for text, batch_mentions in zip(texts, batch):
+        mentions = mocked_classifier.create_mentions(text)
+        mocked_classifier.classify_mentions(mentions)
+        assert [m.json() for m in mentions] == [m.json() for m in batch_mentions]
+    assert [m.best_qid for m in batch[2]] == ['Q585', 'Q586', 'Q597']
+
+def test_build_feature_vectors_for_doc():
+    mentions = [
+        Mention(phrase='Vanuatu', start=0, end=7, tags=[Tag(id='Q686', rank=2, nb_statements=3, nb_sitelinks=4)], log_likelihood=-1),
+        Mention(phrase='Sweden', start=37, end=43, tags=[
+            Tag(id='Q34', edges=[458], rank=1, nb_statements=5, nb_sitelinks=6),
+            Tag(id='Q35', rank=7, nb_statements=1, nb_sitelinks=1)], log_likelihood=-2),
+        Mention(phrase='EU', start=48, end=50, tags=[Tag(id='Q458', rank=3, nb_statements=2, nb_sitelinks=8)], log_likelihood=-3),
+    ]
+    classifier = SimpleTagClassifier(Tagger('wd_test_collection', None, None), nb_steps=3, max_similarity_distance=10)
+    feature_array, tag_key_to_idx = classifier.build_feature_vectors_for_doc(mentions)
+
+    assert tag_key_to_idx == {(0, 7, 'Q686'): 0, (37, 43, 'Q34'): 1, (37, 43, 'Q35'): 2, (48, 50, 'Q458'): 3}
+    raw_features = numpy.array([
+        [-1, 2, 3, 4, 1],
+        [-2, 1, 5, 6, 1],
+        [-2, 7, 1, 1, 1],
+        [-3, 3, 2, 8, 1],
+    ], dtype=float)
+    adj_matrix = classifier.compute_similarity_matrix(mentions).toarray().T
+    expected = [raw_features]
+    for i in range(3):
+        expected.append(adj_matrix.dot(expected[-1]))
+    assert numpy.allclose(feature_array, numpy.hstack(expected))
+    assert classifier.build_feature_vectors_for_doc([]) == ([], {})
+
+def test_export_classifier(tmpdir):
+    from sklearn import preprocessing, svm
+    from sklearn.pipeline import Pipeline
+    random = numpy.random.RandomState(0)
+    features = random.normal(loc=3., scale=[1., 10., 100., 0.1, 1.], size=(200, 5))
+    classes = (features[:,0] + features[:,1]/10 > 4).astype(int)
+    classifier = SimpleTagClassifier(None, similarity='one_step', beta=0.2, nb_steps=4)
+    classifier.fit = Pipeline([('scaler',preprocessing.StandardScaler()),('svm',svm.LinearSVC(C=1.))]).fit(features, classes)
+
+    fname = str(tmpdir.join('classifier.json'))
+    classifier.export(fname)
+    exported = SimpleTagClassifier(None)
+    exported.load(fname)
+    assert exported.nb_steps == 4
+    assert isinstance(exported.similarity_method, OneStepSimilarity) and exported.similarity_method.beta == 0.2
+    assert isinstance(exported.fit, LinearScorer)
+    assert numpy.allclose(exported.fit.decision_function(features), classifier.fit.decision_function(features))
+
+def countries_dataset():
+    # only the countries are annotated: the cities are negative examples
+    texts = [
+        'Lisbon and Portugal',
+        'Oslo, Bonn and Sweden',
+        'Portugal and Oslo',
+        'Bonn, Lisbon and Portugal',
+        'Sweden, Oslo and Bonn',
+        'Oslo and Portugal',
+        'Lisbon and Sweden',
+    ]
+    countries = {'Portugal': 'Q45', 'Sweden': 'Q34'}
+    dataset = NIFCollection(uri='http://example.com/dataset')
+    for idx, text in enumerate(texts):
+        context = dataset.add_context(uri='http://example.com/dataset/{}'.format(idx), mention=text)
+        for country, qid in countries.items():
+            if country in text:
+                start = text.index(country)
+                context.add_phrase(beginIndex=start, endIndex=start+len(country), taIdentRef='http://www.wikidata.org/entity/'+qid)
+    return dataset
+
+def test_crossfit_model_jobs(mocked_classifier):
+    dataset = countries_dataset()
+    grid = [
+        {'similarity': similarity, 'beta': 0.2, 'C': C, 'max_similarity_distance': 50, 'nb_steps': 2}
+        for similarity in ['one_step', 'direct_link']
+        for C in [1.0, 0.01]
+    ]
+
+    serial = mocked_classifier.crossfit_model(dataset, grid, jobs=1)
+    parallel = mocked_classifier.crossfit_model(dataset, grid, jobs=2)
+    assert serial[1] > 0.
+    assert serial == parallel
+    assert mocked_classifier.similarity == parallel[0]['similarity']
+
+def test_crossfit_model_mention_store(mocked_classifier, mock_solr, tmpdir):
+    dataset = countries_dataset()
+    grid = [{'similarity': 'direct_link', 'C': C, 'max_similarity_distance': 50} for C in [1.0, 0.01]]
+    fname = str(tmpdir.join('mentions.npz'))
+    expected = mocked_classifier.crossfit_model(dataset, grid, mention_store=MentionStore.for_tagger(fname, mocked_classifier.tagger))
+    nb_requests = mock_solr.nb_requests
+    store = MentionStore.for_tagger(fname, mocked_classifier.tagger)
+    assert len(store) == len(dataset.contexts)
+    assert mocked_classifier.crossfit_model(dataset, grid, mention_store=store) == expected
+    assert mock_solr.nb_requests == nb_requests
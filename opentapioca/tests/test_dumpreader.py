@@ -2,7 +2,10 @@
 import unittest
 import os
 import re
+import bz2
+import tempfile
 from opentapioca.readers.dumpreader import WikidataDumpReader
+from opentapioca.readers.paralleldumpreader import ParallelWikidataDumpReader
 
 class WikidataDumpReaderTest(unittest.TestCase):
     @classmethod
@@ -18,3 +21,28 @@ class WikidataDumpReaderTest(unittest.TestCase):
                 count += 1
                 assert entity_ids.match(item.get('id')) is not None
         assert count == 100
+
+    def test_parallel_read_dump(self):
+        with WikidataDumpReader(self.dump_fname) as reader:
+            expected = [item.get('id') for item in reader]
+        with ParallelWikidataDumpReader(self.dump_fname, processes=2) as reader:
+            self.assertEqual([item.get('id') for item in reader], expected)
+
+    def test_parallel_read_multistream_dump(self):
+        with bz2.open(self.dump_fname, 'rb') as f:
+            lines = f.readlines()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, 'multistream.json.bz2')
+            with open(fname, 'wb') as f:
+                # streams which do not end at line boundaries
+                data = b''.join(lines)
+                for start in range(0, len(data), 5000):
+                    f.write(bz2.compress(data[start:start+5000]))
+
+            with WikidataDumpReader(self.dump_fname) as reader:
+                expected = [item.get('id') for item in reader]
+            with ParallelWikidataDumpReader(fname, processes=3, partition_size=2000) as reader:
+                self.assertTrue(reader.is_multistream())
+                self.assertEqual([item.get('id') for item in reader], expected)
+            with ParallelWikidataDumpReader(fname, processes=3, partition_size=2000, ordered=False) as reader:
+                self.assertEqual(sorted(item.get('id') for item in reader), sorted(expected))
@@ -1,9 +1,20 @@
 import os
+import re
+import threading
 import pytest
 import json
 import requests_cache
+import requests_mock
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
 
 from opentapioca.wditem import WikidataItemDocument
+from opentapioca.indexingprofile import IndexingProfile
+from opentapioca.typematcher import TypeMatcher
+from opentapioca.readers.dumpreader import WikidataDumpReader
 
 @pytest.fixture()
 def cache_requests():
@@ -32,3 +43,148 @@ def wbgetentities_response(testdir):
 
 
 
+@pytest.fixture
+def sample_solr_docs(testdir):
+    """
+    The Solr documents obtained by indexing the sample dump
+    with a profile which keeps all items.
+    """
+    profile = IndexingProfile.load(os.path.join(testdir, 'data', 'all_items_profile.json'))
+    type_matcher = TypeMatcher()
+    docs = []
+    with WikidataDumpReader(os.path.join(testdir, 'data', 'sample_wikidata_items.json.bz2')) as reader:
+        for item in reader:
+            doc = profile.entity_to_document(item, type_matcher)
+            if doc is not None:
+                docs.append(doc)
+    return docs
+
+class SolrTaggerStub(object):
+    """
+    Imitates the tag handler of Solr on a set of documents: labels and
+    aliases are matched case-sensitively on word boundaries, and matches
+    contained in longer ones are discarded (overlaps=NO_SUB).
+    """
+
+    def __init__(self, docs):
+        self.docs = {doc['id']: doc for doc in docs}
+        self.names = defaultdict(set)
+        for doc in docs:
+            for name in [doc['label']] + doc['aliases'] + doc['extra_aliases']:
+                self.names[name].add(doc['id'])
+        self.nb_requests = 0
+        self.nb_select_requests = 0
+        self.index_version = 1
+
+    def find_tags(self, text):
+        word_char = re.compile(r'\w')
+        boundaries = [
+            i for i in range(len(text) + 1)
+            if i == 0 or i == len(text) or not (word_char.match(text[i-1]) and word_char.match(text[i]))
+        ]
+        max_length = max(len(name) for name in self.names)
+        spans = {}
+        for idx, start in enumerate(boundaries):
+            for end in boundaries[idx+1:]:
+                if end - start > max_length:
+                    break
+                ids = self.names.get(text[start:end])
+                if ids:
+                    spans[(start, end)] = ids
+        return [
+            (start, end, sorted(ids))
+            for (start, end), ids in sorted(spans.items())
+            if not any(s <= start and end <= e and (s, e) != (start, end) for s, e in spans)
+        ]
+
+    def stored_document(self, doc, fields):
+        stored = {
+            'id': doc['id'],
+            'label': [doc['label']],
+            'aliases': doc['aliases'],
+            'extra_aliases': doc['extra_aliases'],
+            'desc': doc['desc'],
+            'nb_statements': [doc['nb_statements']],
+            'nb_sitelinks': [doc['nb_sitelinks']],
+            'edges': doc['edges'],
+            'types': doc['types'],
+        }
+        return {k: v for k, v in stored.items() if k in fields}
+
+    def __call__(self, request, context):
+        return self.respond(request.url, request.body)
+
+    def select(self, body):
+        """
+        Imitates the select handler, for queries of the form {!terms f=id}Q1,Q2,…
+        """
+        self.nb_select_requests += 1
+        if isinstance(body, bytes):
+            body = body.decode('utf-8')
+        params = parse_qs(body)
+        qids = params['q'][0][len('{!terms f=id}'):].split(',')
+        fields = params['fl'][0].split(',')
+        docs = [self.stored_document(self.docs[qid], fields) for qid in qids if qid in self.docs]
+        return {'response': {'numFound': len(docs), 'docs': docs}}
+
+    def respond(self, url, body):
+        self.nb_requests += 1
+        params = parse_qs(urlparse(url).query)
+        fields = params['fl'][0].split(',')
+        tags = self.find_tags(body.decode('utf-8'))
+        ids = sorted({qid for _, _, qids in tags for qid in qids})
+        return {
+            'tags': [
+                ['startOffset', start, 'endOffset', end, 'ids', qids]
+                for start, end, qids in tags
+            ],
+            'response': {
+                'numFound': len(ids),
+                'docs': [self.stored_document(self.docs[qid], fields) for qid in ids],
+            },
+        }
+
+@pytest.fixture
+def mock_solr(sample_solr_docs):
+    """
+    Mocks the Solr tag handler of any collection.
+    """
+    stub = SolrTaggerStub(sample_solr_docs)
+    with requests_mock.Mocker() as mocker:
+        mocker.post(re.compile(r'.*/tag'), json=stub)
+        mocker.post(re.compile(r'.*/select'), json=lambda request, context: stub.select(request.body))
+        mocker.get(re.compile(r'.*/admin/luke'), json=lambda request, context: {'index': {'version': stub.index_version}})
+        yield stub
+
+@pytest.fixture
+def solr_server(sample_solr_docs):
+    """
+    Serves a stub of the Solr tag handler over HTTP, on a random port.
+    Yields the base URL of the stub Solr server.
+    """
+    stub = SolrTaggerStub(sample_solr_docs)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if urlparse(self.path).path.endswith('/select'):
+                payload = json.dumps(stub.select(body)).encode('utf-8')
+            else:
+                payload = json.dumps(stub.respond(self.path, body)).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{}/solr/'.format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
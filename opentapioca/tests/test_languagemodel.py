@@ -1,6 +1,14 @@
+import bz2
+import os
+import threading
+import tracemalloc
+import json
 import unittest
+from collections import defaultdict
 from opentapioca.languagemodel import tokenize
 from opentapioca.languagemodel import BOWLanguageModel
+from opentapioca.languagemodel import LanguageModelUpdater
+from opentapioca.countmin import ApproximateCounts
 
 class BOWTest(unittest.TestCase):
     def test_tokenize(self):
@@ -15,3 +23,191 @@ class BOWTest(unittest.TestCase):
         assert bow.total_count == 8
         ll = bow.log_likelihood('dear speaker')
         assert ll > -4.2 and ll < -4.1
+
+def test_compact(tmpdir):
+    bow = BOWLanguageModel()
+    bow.ingest(['the', 'invited', 'speaker', 'été'])
+    bow.ingest(['the', 'speaker', 'of', 'the', 'house', 'été'])
+    bow.threshold = 1
+    path = str(tmpdir.join('compact.bow'))
+    bow.save_compact(path)
+
+    compact = BOWLanguageModel()
+    compact.load(path)
+    assert compact.word_count['speaker'] == 2
+    assert compact.word_count['été'] == 2
+    assert compact.word_count['unknown'] == 0
+    assert len(compact.word_count) == len(bow.word_count)
+    assert compact.log_likelihood('dear speaker') == bow.log_likelihood('dear speaker')
+
+def test_log_likelihood_many():
+    bow = BOWLanguageModel(cache_size=3)
+    bow.ingest(['the', 'invited', 'speaker'])
+    bow.ingest(['the', 'speaker', 'of', 'the', 'house'])
+    phrases = ['dear speaker', 'the house', 'dear speaker', 'of']
+    scores = bow.log_likelihood_many(phrases)
+    assert scores == [bow.log_likelihood(phrase) for phrase in phrases]
+    stats = bow.cache_stats()
+    assert stats['tokenize_hits'] > 0
+    assert stats['word_hits'] > 0
+    assert stats['word_misses'] == 5
+
+def test_train_parallel():
+    fname = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data/sample_wikidata_items.json.bz2')
+    serial = BOWLanguageModel.train_from_dump(fname)
+    parallel = BOWLanguageModel.train_from_dump(fname, jobs=2, chunk_size=100)
+    assert parallel.total_count == serial.total_count
+    assert list(parallel.word_count.items()) == list(serial.word_count.items())
+
+def test_train_parallel_multistream(tmpdir):
+    fname = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data/sample_wikidata_items.json.bz2')
+    multistream_fname = str(tmpdir.join('multistream.json.bz2'))
+    with bz2.open(fname, 'rb') as f:
+        data = f.read()
+    with open(multistream_fname, 'wb') as f:
+        # streams which do not end at line boundaries
+        for start in range(0, len(data), 5000):
+            f.write(bz2.compress(data[start:start+5000]))
+
+    serial = BOWLanguageModel.train_from_dump(fname)
+    parallel = BOWLanguageModel.train_from_dump(multistream_fname, jobs=3, partition_size=2000)
+    assert parallel.total_count == serial.total_count
+    assert list(parallel.word_count.items()) == list(serial.word_count.items())
+
+def test_approximate_counts():
+    fname = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data/sample_wikidata_items.json.bz2')
+    exact = BOWLanguageModel.train_from_dump(fname)
+    approximate = BOWLanguageModel.train_from_dump(fname, max_memory=64*1024)
+    bounds = approximate.word_count.error_bounds()
+    assert approximate.total_count == exact.total_count
+    assert bounds['total_count'] == exact.total_count
+    for word, count in exact.word_count.items():
+        assert count <= approximate.word_count[word] <= count + bounds['max_overcount']
+    frequent = {word for word, count in exact.word_count.items() if count >= exact.threshold}
+    assert frequent <= {word for word, count in approximate.word_count.items()}
+
+def test_approximate_counts_bounded():
+    counts = ApproximateCounts(64*1024)
+    assert (counts._cells(['été']) == counts._cells(['a much longer word', 'été'])[1]).all()
+    for batch in range(20):
+        counts.add(['word{}'.format(i) for i in range(batch*1000, (batch+1)*1000)] * 2)
+        assert len(counts) <= counts.max_candidates
+        assert len(counts.heap) == len(counts.candidates)
+    counts.add({'frequent': 1000})
+    counts['frequent'] += 1
+    assert counts['frequent'] >= 1001
+    assert 'frequent' in dict(counts.items())
+    assert counts.total_count == 41001
+
+def test_approximate_counts_long_token():
+    # hashing does not pad the words of a batch to the longest one
+    words = ['word{}'.format(i) for i in range(50000)] + ['x' * 2000, 'y' * 100]
+    counts = ApproximateCounts(1000000)
+    tracemalloc.start()
+    try:
+        counts.add(words)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert peak < 50 * 1024 * 1024
+    assert counts['x' * 2000] >= 1
+    assert (counts._cells(['x' * 2000, 'y' * 100]) == counts._cells(['a', 'y' * 100, 'x' * 2000])[[2, 1]]).all()
+
+def item(qid, label, aliases=()):
+    return {'id': qid, 'labels': {'en': {'value': label}},
+            'aliases': {'en': [{'value': alias} for alias in aliases]}}
+
+def test_delta_log(tmpdir):
+    bow = BOWLanguageModel()
+    bow.ingest_item(item('Q1', 'New York'))
+    bow.threshold = 1
+    path = str(tmpdir.join('compact.bow'))
+    bow.save_compact(path)
+    deltas = str(tmpdir.join('deltas.jsonl'))
+
+    updater = LanguageModelUpdater(deltas)
+    assert updater.update(item('Q1', 'New York')) == {'id': 'Q1', 'known': ['New', 'York']}
+    assert updater.update(item('Q1', 'New York', ['NYC'])) == {'id': 'Q1', 'add': ['NYC'], 'remove': []}
+    # the words of items are restored from the log
+    updater = LanguageModelUpdater(deltas)
+    updater.update(item('Q1', 'New York City'))
+    updater.update(item('Q2', 'York'), created=True)
+
+    for model in [bow, BOWLanguageModel()]:
+        if model is not bow:
+            model.load(path)
+        version = model.version
+        assert model.apply_deltas(deltas) == 4
+        assert model.word_count['York'] == 2
+        assert model.word_count['NYC'] == 0
+        assert model.word_count['City'] == 1
+        assert model.total_count == 4
+        assert model.apply_deltas(deltas) == 0
+        assert model.version != version
+
+def test_delta_log_previous_revision(tmpdir):
+    bow = BOWLanguageModel()
+    bow.ingest_item(item('Q1', 'New York'))
+    bow.ingest_item(item('Q2', 'York'))
+    deltas = str(tmpdir.join('deltas.jsonl'))
+
+    updater = LanguageModelUpdater(deltas)
+    # the item gained an alias in the edit where it is first seen
+    assert updater.update(item('Q1', 'New York', ['NYC']), previous=item('Q1', 'New York')) == {
+        'id': 'Q1', 'add': ['NYC'], 'remove': []}
+    assert updater.update(item('Q2', 'York'), previous=item('Q2', 'York')) is None
+    assert updater.update(item('Q1', 'New York', ['NYC']), previous=item('Q1', 'New York')) is None
+
+    assert bow.apply_deltas(deltas) == 1
+    assert bow.word_count['NYC'] == 1
+    assert bow.total_count == 4
+
+def test_remove_unknown_word(tmpdir):
+    bow = BOWLanguageModel()
+    bow.ingest(['New', 'York'])
+    bow.threshold = 1
+    fname = str(tmpdir.join('bow.pkl'))
+    bow.save(fname)
+    model = BOWLanguageModel()
+    model.load(fname)
+    quotient = model.log_quotient
+    model.log_likelihood('Unknown words')
+    model.apply_delta(['York'], ['Unknown'])
+    assert len(model.word_count) == 2
+    model._update_log_quotient()
+    assert model.log_quotient == quotient
+
+def test_concurrent_refresh(tmpdir):
+    reading = threading.Event()
+    applied = threading.Event()
+    reader = None
+
+    class BlockingCounts(defaultdict):
+        """
+        Blocks the reader thread after it reads a count, until the deltas are applied.
+        """
+        def __getitem__(self, word):
+            count = super(BlockingCounts, self).__getitem__(word)
+            if threading.current_thread() is reader:
+                reading.set()
+                applied.wait(10)
+            return count
+
+    bow = BOWLanguageModel()
+    bow.word_count = BlockingCounts(int)
+    bow.ingest(['New', 'York', 'City'])
+    deltas = str(tmpdir.join('deltas.jsonl'))
+    with open(deltas, 'w') as f:
+        f.write(json.dumps({'id': 'Q1', 'add': ['New', 'Jersey'], 'remove': []})+'\n')
+
+    reader = threading.Thread(target=bow.log_likelihood_many, args=(['New York'],))
+    reader.start()
+    assert reading.wait(10)
+    bow.apply_deltas(deltas)
+    applied.set()
+    reader.join()
+
+    # scores computed with the previous quotient are not cached
+    for word, score in bow._word_scores.items():
+        assert score == bow._word_log_likelihood(word)
+    assert bow.log_likelihood('New York') == bow._word_log_likelihood('New') + bow._word_log_likelihood('York')
@@ -0,0 +1,54 @@
+import os
+import pytest
+from opentapioca.lexicon import Lexicon
+from opentapioca.lexicon import LexiconTagBackend
+from opentapioca.tagger import Tagger
+from opentapioca.languagemodel import BOWLanguageModel
+from opentapioca.wikidatagraph import WikidataGraph
+from .test_fixtures import testdir
+from .test_fixtures import sample_solr_docs
+
+def doc(qid, label, aliases=None):
+    return {'id': qid, 'label': label, 'aliases': aliases or [], 'extra_aliases': [],
+            'desc': '', 'edges': [], 'types': '{}', 'nb_statements': 1, 'nb_sitelinks': 1}
+
+@pytest.fixture
+def lexicon(tmpdir):
+    return Lexicon.build([
+        doc('Q1', 'New York', ['NYC']),
+        doc('Q2', 'New York City'),
+        doc('Q3', 'York'),
+        doc('Q4', 'Newark'),
+        doc('Q5', 'City'),
+        doc('Q6', 'New'),
+        doc('Q7', 'Gödel', ['Kurt Gödel']),
+    ], str(tmpdir.join('lexicon')))
+
+def test_longest_match(lexicon):
+    text = 'From New York City to Newark, New York'
+    assert lexicon.find_tags(text) == [
+        (5, 18, ['Q2']),
+        (22, 28, ['Q4']),
+        (30, 38, ['Q1']),
+    ]
+
+def test_folding(lexicon):
+    assert lexicon.find_tags("Kurt Godel's theorem") == [(0, 12, ['Q7'])]
+
+def test_get_documents(lexicon):
+    docs = lexicon.get_documents(['Q3', 'Q42', 'Q1'], fields=['id', 'label'])
+    assert docs == [{'id': 'Q3', 'label': ['York']}, {'id': 'Q1', 'label': ['New York']}]
+
+def test_lexicon_tag_backend(sample_solr_docs, testdir, tmpdir):
+    lexicon = Lexicon.build(sample_solr_docs, str(tmpdir.join('lexicon')))
+    bow = BOWLanguageModel()
+    bow.load(os.path.join(testdir, 'data/sample_bow.pkl'))
+    graph = WikidataGraph()
+    graph.load_pagerank(os.path.join(testdir, 'data/sample_wikidata_items.pgrank.npy'))
+    tagger = Tagger(None, bow, graph, backend=LexiconTagBackend(lexicon))
+
+    mentions = tagger.tag_and_rank("I live in Vanuatu, not in the People's Republic of China")
+    assert [mention.phrase for mention in mentions] == ['Vanuatu', "People's Republic of China"]
+    assert mentions[0].tags[0].id == 'Q686'
+    assert mentions[0].tags[0].label == 'Vanuatu'
+    assert mentions[1].tags[0].id == 'Q148'
@@ -0,0 +1,35 @@
+import os
+from opentapioca.mentionstore import MentionStore
+from .test_fixtures import testdir
+from .test_fixtures import sample_solr_docs
+from .test_fixtures import mock_solr
+from .test_classifier import mocked_classifier
+
+def test_store_mentions(mocked_classifier, mock_solr, tmpdir):
+    tagger = mocked_classifier.tagger
+    fname = str(tmpdir.join('mentions.npz'))
+    texts = {'doc1': 'Lisbon and Portugal', 'doc2': 'Nothing', 'doc3': 'Oslo, Bonn and Lisbon'}
+    store = MentionStore.for_tagger(fname, tagger)
+    assert store.version['index_version'] == '1'
+    for uri, text in texts.items():
+        store.put(uri, mocked_classifier.create_mentions(text))
+    store.save()
+
+    loaded = MentionStore.for_tagger(fname, tagger)
+    assert len(loaded) == 3
+    for uri, text in texts.items():
+        mentions = mocked_classifier.create_mentions(text)
+        stored = loaded[uri]
+        assert [m.key() for m in stored] == [m.key() for m in mentions]
+        assert [m.log_likelihood for m in stored] == [m.log_likelihood for m in mentions]
+        for stored_mention, mention in zip(stored, mentions):
+            assert [(t.id, t.label, t.rank, t.nb_statements, t.nb_sitelinks, t.edges) for t in stored_mention.tags] == \
+                [(t.id, t.label, t.rank, t.nb_statements, t.nb_sitelinks, t.edges) for t in mention.tags]
+        mocked_classifier.classify_mentions(mentions)
+        mocked_classifier.classify_mentions(stored)
+        assert [m.best_qid for m in stored] == [m.best_qid for m in mentions]
+    assert loaded.get('doc4') is None
+
+    # mentions computed with another version of the index are discarded
+    mock_solr.index_version = 2
+    assert len(MentionStore.for_tagger(fname, tagger)) == 0
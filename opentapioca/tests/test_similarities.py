@@ -0,0 +1,61 @@
+import os
+import numpy
+import pytest
+from opentapioca.tag import Tag
+from opentapioca.mention import Mention
+from opentapioca.wikidatagraph import WikidataGraph
+from opentapioca.similarities import DirectLinkSimilarity
+from opentapioca.similarities import EdgeRatioSimilarity
+from opentapioca.similarities import OneStepSimilarity
+from opentapioca.similarities import similarity_matrix
+from .test_fixtures import testdir
+
+@pytest.mark.parametrize('measure', [DirectLinkSimilarity(), EdgeRatioSimilarity(), OneStepSimilarity(0.2)])
+def test_graph_edges(measure, testdir, tmpdir):
+    graph = WikidataGraph()
+    graph.load_from_matrix(os.path.join(testdir, 'data/sample_wikidata_items.npz'))
+    prefix = str(tmpdir.join('edges'))
+    graph.save_edges(prefix)
+    mmapped = WikidataGraph()
+    mmapped.load_edges(prefix)
+
+    qids = ['Q1', 'Q5', 'Q30', 'Q31', 'Q45', 'Q148', 'Q686', 'Q1000000']
+    tags = [Tag(id=qid, edges=[int(idx) for idx in graph.get_edges(qid)]) for qid in qids]
+    for a in tags:
+        assert list(mmapped.get_edges(a.id)) == a.edges
+        for b in tags:
+            assert measure.compute_similarity(a, b, graph=mmapped) == pytest.approx(measure.compute_similarity(a, b))
+
+def brute_force_similarities(mentions, measure, max_distance, smoothing):
+    """
+    The similarities computed pair by pair, without pruning by offset.
+    """
+    tags = [(mention, tag) for mention in mentions for tag in mention.tags]
+    expected = numpy.zeros((len(tags), len(tags)))
+    for i, (mention, tag) in enumerate(tags):
+        expected[i, i] = smoothing
+        for j, (other_mention, other_tag) in enumerate(tags):
+            distance = max(mention.start - other_mention.end, other_mention.start - mention.end)
+            if mention.key() == other_mention.key() or distance > max_distance:
+                continue
+            similarity = smoothing + measure.compute_similarity(tag, other_tag)
+            expected[i, j] += similarity * float(max_distance - distance) / max_distance
+        expected[i] /= expected[i].sum()
+    return expected
+
+@pytest.mark.parametrize('measure', [DirectLinkSimilarity(), EdgeRatioSimilarity(), OneStepSimilarity(0.2)])
+def test_similarity_matrix(measure):
+    random = numpy.random.RandomState(42)
+    mentions = []
+    for start in sorted(random.randint(0, 1000, size=60)):
+        end = start + random.randint(1, 20)
+        tags = [Tag(id='Q{}'.format(qid), edges=[int(e) for e in random.randint(1, 30, size=random.randint(0, 5))])
+                for qid in random.randint(1, 30, size=random.randint(0, 4))]
+        mentions.append(Mention(phrase='', start=int(start), end=int(end), tags=tags, log_likelihood=0))
+    # a mention containing others
+    mentions.insert(3, Mention(phrase='', start=0, end=200, tags=[Tag(id='Q3', edges=[4, 5])], log_likelihood=0))
+
+    matrix = similarity_matrix(mentions, measure, 50, 0.1)
+    expected = brute_force_similarities(mentions, measure, 50, 0.1)
+    assert numpy.allclose(matrix.toarray(), expected)
+    assert similarity_matrix([], measure, 50, 0.1).shape == (0, 0)
@@ -14,9 +14,9 @@ from opentapioca.wditem import WikidataItemDocument
 EventStubBase = namedtuple('EventStubBase', ['data', 'event'])
 
 
-def EventStub(event='message', wiki='wikidatawiki', namespace=0, title='Q123'):
+def EventStub(event='message', wiki='wikidatawiki', namespace=0, title='Q123', revision=None):
     return EventStubBase(event=event, data=json.dumps(
-            {'wiki':wiki, 'namespace':namespace, 'title':title}
+            {'wiki':wiki, 'namespace':namespace, 'title':title, 'revision':revision}
             ))
 
 
@@ -84,3 +84,38 @@ def test_iterate(event_stream, wbgetentities_response, mocker):
 
 
 
+
+
+def test_fetch_revisions():
+    reader = WikidataStreamReader()
+    content = {'id': 'Q123', 'labels': {'en': {'language': 'en', 'value': 'New York'}}}
+    with requests_mock.mock() as mocker:
+        mocker.get('https://www.wikidata.org/w/api.php?action=query&prop=revisions&revids=12%7C34', json={
+            'query': {'pages': [{'title': 'Q123', 'revisions': [
+                {'revid': 12, 'slots': {'main': {'content': json.dumps(content)}}}]}]}})
+
+        items = reader.fetch_revisions([12, 34])
+
+        assert list(items.keys()) == [12]
+        assert items[12].get('labels') == content['labels']
+
+
+def test_iterate_previous_items(mocker):
+    events = [
+        EventStub(title='Q123', revision={'old': 12, 'new': 13}),
+        EventStub(title='Q123', revision={'old': 13, 'new': 14}),
+        EventStub(title='Q456', revision={'new': 56}),
+    ]
+    reader = StreamReaderStub(events)
+    reader.fetch_previous = True
+    mocker.patch.object(reader, 'fetch_items').return_value = [
+        WikidataItemDocument({'id':'Q123'}), WikidataItemDocument({'id':'Q456'})]
+    fetch_revisions = mocker.patch.object(reader, 'fetch_revisions')
+    fetch_revisions.return_value = {12: WikidataItemDocument({'id':'Q123'})}
+
+    with reader as entered_reader:
+        for item in entered_reader:
+            pass
+
+        fetch_revisions.assert_called_once_with([12])
+        assert list(reader.previous_items.keys()) == ['Q123']
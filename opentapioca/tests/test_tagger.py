@@ -1,5 +1,7 @@
+import asyncio
 import unittest
 import os
+import pytest
 import requests
 from opentapioca.tagger import Tagger
 from opentapioca.languagemodel import BOWLanguageModel
@@ -7,6 +9,15 @@ from opentapioca.wikidatagraph import WikidataGraph
 from opentapioca.taggerfactory import TaggerFactory
 from opentapioca.indexingprofile import IndexingProfile
 from opentapioca.readers.dumpreader import WikidataDumpReader
+from opentapioca.tagbackends import TagBackend
+from opentapioca.tagbackends import SolrTagBackend
+from opentapioca.tagbackends import RecordingTagBackend
+from opentapioca.tagbackends import ReplayTagBackend
+from opentapioca.tagbackends import MissingRecording
+from .test_fixtures import testdir
+from .test_fixtures import sample_solr_docs
+from .test_fixtures import mock_solr
+from .test_fixtures import solr_server
 
 class TaggerTest(unittest.TestCase):
 
@@ -63,3 +74,79 @@ class TaggerTest(unittest.TestCase):
 
 
 
+@pytest.fixture
+def bow(testdir):
+    bow = BOWLanguageModel()
+    bow.load(os.path.join(testdir, 'data/sample_bow.pkl'))
+    return bow
+
+@pytest.fixture
+def graph(testdir):
+    graph = WikidataGraph()
+    graph.load_pagerank(os.path.join(testdir, 'data/sample_wikidata_items.pgrank.npy'))
+    return graph
+
+def test_tag_and_rank_mocked(mock_solr, bow, graph):
+    tagger = Tagger('wd_test_collection', bow, graph)
+    mentions = tagger.tag_and_rank('I live in Vanuatu')
+    assert [(m.start, m.end) for m in mentions] == [(10, 17)]
+    assert mentions[0].tags[0].id == 'Q686'
+    assert mentions[0].tags[0].label == 'Vanuatu'
+
+def test_tag_and_rank_many(mock_solr, bow, graph):
+    tagger = Tagger('wd_test_collection', bow, graph)
+    texts = ['I live in Vanuatu', 'Nothing here', 'From Lisbon to Oslo', 'Bonn']
+    all_mentions = tagger.tag_and_rank_many(texts, max_workers=3)
+    assert [[m.phrase for m in mentions] for mentions in all_mentions] == [
+        ['Vanuatu'], [], ['Lisbon', 'Oslo'], ['Bonn']]
+    assert mock_solr.nb_requests == 4
+
+def test_tag_and_rank_async(solr_server, bow, graph):
+    pytest.importorskip('aiohttp')
+    tagger = Tagger('wd_test_collection', bow, graph, solr_endpoint=solr_server)
+
+    async def tag_all(texts):
+        try:
+            return await asyncio.gather(*[tagger.tag_and_rank_async(text) for text in texts])
+        finally:
+            await tagger.backend.close()
+
+    all_mentions = asyncio.run(tag_all(['I live in Vanuatu', 'From Lisbon to Oslo']))
+    assert [[m.phrase for m in mentions] for mentions in all_mentions] == [
+        ['Vanuatu'], ['Lisbon', 'Oslo']]
+    assert all_mentions[0][0].tags[0].id == 'Q686'
+
+def test_record_and_replay(mock_solr, bow, graph, tmpdir):
+    fname = str(tmpdir.join('recording.jsonl'))
+    texts = ['I live in Vanuatu', 'From Lisbon to Oslo']
+    backend = RecordingTagBackend(SolrTagBackend('wd_test_collection'), fname)
+    recorded = Tagger(None, bow, graph, backend=backend).tag_and_rank_many(texts)
+    nb_requests = mock_solr.nb_requests
+
+    replayed = Tagger(None, bow, graph, backend=ReplayTagBackend(fname)).tag_and_rank_many(texts)
+    assert [[m.json() for m in mentions] for mentions in replayed] == [[m.json() for m in mentions] for mentions in recorded]
+    assert mock_solr.nb_requests == nb_requests
+    with pytest.raises(MissingRecording):
+        ReplayTagBackend(fname).tag('Not recorded', ['id'], 10)
+
+def test_incomplete_backend():
+    class TagOnlyBackend(TagBackend):
+        def tag(self, text, fields, tags_limit):
+            return [], []
+
+    with pytest.raises(TypeError):
+        TagOnlyBackend()
+
+def test_windowed_tagging(mock_solr, bow, graph):
+    text = ' '.join(['I went from Lisbon to Oslo.', 'Then to People\'s Republic of China and Vanuatu.'] * 20)
+
+    reference = Tagger('wd_test_collection', bow, graph)
+    expected = reference.tag_and_rank(text)
+    tagger = Tagger('wd_test_collection', bow, graph, windowed=True)
+    tagger.max_length = 60
+    tagger.window_overlap = 30
+    mentions = tagger.tag_and_rank(text)
+
+    assert len(mentions) == 80
+    assert [m.json() for m in mentions] == [m.json() for m in expected]
+    assert mock_solr.nb_requests > 20
@@ -0,0 +1,63 @@
+import threading
+import pytest
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+from opentapioca.transport import HttpTransport
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    failures_left = 0
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        if StubHandler.failures_left > 0:
+            StubHandler.failures_left -= 1
+            status = 503
+            body = b''
+        else:
+            status = 200
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def stub_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{}/'.format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+def test_connections_are_reused(stub_server):
+    transport = HttpTransport(pool_size=2)
+    for i in range(5):
+        r = transport.post(stub_server, data=b'hello')
+        assert r.content == b'hello'
+
+    stats = transport.pool_stats()
+    assert stats['requests'] == 5
+    host_stats = list(stats['hosts'].values())[0]
+    assert host_stats['connections_opened'] == 1
+    assert host_stats['requests'] == 5
+    assert host_stats['idle_connections'] == 1
+    assert host_stats['max_size'] == 2
+
+def test_retry_on_unavailable(stub_server):
+    StubHandler.failures_left = 2
+    transport = HttpTransport(max_retries=3, backoff_factor=0)
+    r = transport.post(stub_server, data=b'hello')
+    assert r.status_code == 200
+
+def test_give_up_after_retries(stub_server):
+    StubHandler.failures_left = 5
+    transport = HttpTransport(max_retries=1, backoff_factor=0)
+    r = transport.post(stub_server, data=b'hello')
+    assert r.status_code == 503
+    StubHandler.failures_left = 0
@@ -1,6 +1,12 @@
 import unittest
 import os
+import numpy
+import tempfile
+import json
+from scipy import sparse
 from opentapioca.wikidatagraph import WikidataGraph
+from opentapioca.wikidatagraph import GraphUpdater
+from opentapioca.wditem import WikidataItemDocument
 
 class WikidataGraphTest(unittest.TestCase):
     @classmethod
@@ -23,4 +29,144 @@ class WikidataGraphTest(unittest.TestCase):
         graph = WikidataGraph()
         graph.load_from_matrix(os.path.join(self.testdir, 'data/sample_wikidata_items.npz'))
         graph.compute_pagerank()
-        self.assertTrue(graph.get_pagerank('Q45') > 0.0003 and graph.get_pagerank('Q45') < 0.0004)
\ No newline at end of file
+        self.assertTrue(graph.get_pagerank('Q45') > 0.0003 and graph.get_pagerank('Q45') < 0.0004)
+
+    def test_compute_pagerank_threads(self):
+        graph = WikidataGraph()
+        graph.load_from_matrix(os.path.join(self.testdir, 'data/sample_wikidata_items.npz'))
+        graph.compute_pagerank()
+        expected = graph.pagerank
+        graph.compute_pagerank(threads=3)
+        self.assertTrue(numpy.allclose(graph.pagerank, expected))
+        graph.compute_pagerank(damping=0.85, max_iterations=200)
+        self.assertAlmostEqual(graph.pagerank.sum(), 1.)
+
+    def test_compile_binary(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            WikidataGraph.preprocess_dump_binary(os.path.join(self.testdir, 'data/sample_wikidata_items.json.bz2'),
+                os.path.join(tmpdir, 'chunks'), chunk_size=100)
+            graph = WikidataGraph()
+            graph.compile_binary_chunks(os.path.join(tmpdir, 'chunks'), os.path.join(tmpdir, 'graph'))
+            graph.mat.check_format(full_check=True)
+
+            expected = WikidataGraph()
+            expected.load_from_preprocessed_dump(os.path.join(self.testdir, 'data/sample_wikidata_items.tsv'))
+            self.assertEqual(graph.shape, expected.shape)
+            self.assertEqual((graph.mat != expected.mat).nnz, 0)
+            del graph
+
+    def test_load_pagerank_mmap(self):
+        fname = os.path.join(self.testdir, 'data/sample_wikidata_items.pgrank.npy')
+        graph = WikidataGraph()
+        graph.load_pagerank(fname)
+        self.assertEqual(graph.pagerank.ndim, 1)
+        mapped = WikidataGraph()
+        mapped.load_pagerank(fname, mmap_mode='r')
+        self.assertIsInstance(mapped.pagerank, numpy.memmap)
+        self.assertEqual(mapped.get_pagerank('Q45'), graph.get_pagerank('Q45'))
+        single = WikidataGraph()
+        single.load_pagerank(fname, dtype=numpy.float32)
+        self.assertEqual(single.pagerank.dtype, numpy.float32)
+
+    def test_get_pageranks(self):
+        graph = WikidataGraph()
+        graph.load_pagerank(os.path.join(self.testdir, 'data/sample_wikidata_items.pgrank.npy'), mmap_mode='r')
+        qids = ['Q45', 'Q1', 'Q123456789', 'Q45']
+        ranks = graph.get_pageranks(qids)
+        self.assertEqual(list(ranks), [graph.get_pagerank(qid) for qid in qids])
+        self.assertEqual(len(graph.get_pageranks([])), 0)
+
+    def test_refresh_pagerank(self):
+        for damping in [1., 0.85]:
+            graph = WikidataGraph()
+            graph.load_from_matrix(os.path.join(self.testdir, 'data/sample_wikidata_items.npz'))
+            graph.compute_pagerank(damping=damping, max_iterations=500, tolerance=1e-14)
+            N = graph.shape
+            changes = {
+                'Q45': ([5, 30, N + 1], [2, 1, 1]),  # N + 1 is a new item
+                'Q1': ([], []),
+                'Q{}'.format(N + 1): ([45], [1]),
+            }
+            with tempfile.TemporaryDirectory() as tmpdir:
+                fname = os.path.join(tmpdir, 'edges.jsonl')
+                with open(fname, 'w') as f:
+                    for qid, (targets, counts) in changes.items():
+                        f.write(json.dumps({'id': qid, 'targets': targets, 'counts': counts})+'\n')
+                rows, delta = graph.apply_edge_deltas(fname)
+                self.assertEqual(list(rows), [1, 45, N + 1])
+                self.assertEqual(graph.shape, N + 2)
+                graph.refresh_pagerank(rows, delta, damping=damping, tolerance=1e-14, max_iterations=500)
+                self.assertEqual(list(graph.get_edges('Q45')), [5, 30, N + 1])
+                self.assertEqual(graph.apply_edge_deltas(fname)[0].tolist(), [])
+
+            # compare with the PageRank of the changed matrix
+            mat = sparse.lil_matrix((N + 2, N + 2))
+            mat[:N, :N] = graph.mat
+            mat[1, :] = 0
+            mat[45, :] = 0
+            mat[45, 5], mat[45, 30], mat[45, N + 1] = 0.5, 0.25, 0.25
+            mat[N + 1, 45] = 1.
+            expected = WikidataGraph()
+            expected.mat = mat.tocsr()
+            expected.compute_pagerank(damping=damping, max_iterations=500, tolerance=1e-14)
+            self.assertTrue(numpy.allclose(graph.pagerank, expected.pagerank, rtol=0, atol=1e-10))
+
+    def test_refresh_pagerank_local_edit(self):
+        graph = WikidataGraph()
+        graph.load_from_matrix(os.path.join(self.testdir, 'data/sample_wikidata_items.npz'))
+        graph.compute_pagerank(damping=0.85, max_iterations=500, tolerance=1e-14)
+        N = graph.shape
+        mat = graph.mat.tolil()
+        mat[45, :] = 0
+        mat[45, 5], mat[45, 30] = 2/3, 1/3
+        expected = WikidataGraph()
+        expected.mat = mat.tocsr()
+        expected.compute_pagerank(damping=0.85, max_iterations=500, tolerance=1e-14)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, 'edges.jsonl')
+            with open(fname, 'w') as f:
+                f.write(json.dumps({'id': 'Q45', 'targets': [5, 30], 'counts': [2, 1]})+'\n')
+            rows, delta = graph.apply_edge_deltas(fname)
+            pagerank = graph.pagerank.copy()
+            with self.assertLogs('opentapioca.wikidatagraph', level='WARNING'):
+                graph.refresh_pagerank(rows, delta, damping=0.85, tolerance=1e-6, max_iterations=1)
+            graph.pagerank = pagerank
+            iterations, touched = graph.refresh_pagerank(rows, delta, damping=0.85, tolerance=1e-6)
+
+        # only the neighbourhood of the changed item is visited
+        self.assertLess(iterations, 100)
+        self.assertLess(touched, N / 10)
+        self.assertTrue(numpy.allclose(graph.pagerank, expected.pagerank, rtol=0, atol=1e-8))
+
+    def test_graph_updater(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, 'edges.jsonl')
+            updater = GraphUpdater(fname)
+            item = WikidataItemDocument({'id': 'Q3', 'claims': {'P31': [
+                {'mainsnak': {'datavalue': {'value': {'numeric-id': 5}}}},
+                {'mainsnak': {'datavalue': {'value': {'numeric-id': 5}}}},
+                {'mainsnak': {'datavalue': {'value': {'numeric-id': 2}}}},
+            ]}})
+            self.assertEqual(updater.update(item), {'id': 'Q3', 'targets': [2, 5], 'counts': [1, 2]})
+            self.assertIsNone(updater.update(item))
+            self.assertIsNone(GraphUpdater(fname).update(item))
+
+    def test_compute_pagerank_out_of_core(self):
+        graph = WikidataGraph()
+        graph.load_from_matrix(os.path.join(self.testdir, 'data/sample_wikidata_items.npz'))
+        graph.compute_pagerank()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            graph.save_csr(os.path.join(tmpdir, 'graph'))
+            mapped = WikidataGraph()
+            mapped.load_csr(os.path.join(tmpdir, 'graph'))
+            self.assertIsInstance(mapped.edges_indices, numpy.memmap)
+            # scipy keeps using the memory-mapped arrays, even after validating them
+            mapped.mat.check_format(full_check=True)
+            self.assertTrue(numpy.shares_memory(mapped.mat.indices, mapped.edges_indices))
+            self.assertTrue(numpy.shares_memory(mapped.mat.indptr, mapped.edges_indptr))
+            self.assertFalse(mapped.mat.data.flags.owndata)
+            # blocks of about 100 edges
+            mapped.compute_pagerank(max_memory=1200, threads=2)
+            self.assertTrue(numpy.allclose(mapped.pagerank, graph.pagerank))
+            del mapped
@@ -0,0 +1,235 @@
+import asyncio
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+class HttpTransport(object):
+    """
+    A shared HTTP transport for the calls we make to Solr.
+
+    All requests go through a single keep-alive connection pool, so that
+    repeated calls to the same Solr node reuse their TCP connections instead
+    of opening a new one for each annotation. Failed requests are retried
+    a bounded number of times, with exponential backoff.
+
+    The transport can be shared between threads: each thread gets its own
+    `requests.Session` (sessions are not thread-safe), but all sessions
+    are mounted on the same pooled adapter.
+    """
+
+    def __init__(self,
+                 pool_size=10,
+                 timeout=(3.05, 60),
+                 max_retries=3,
+                 backoff_factor=0.2,
+                 retry_statuses=(502, 503, 504)):
+        """
+        :param pool_size: the maximum number of connections kept alive per host.
+                          This should be at least the number of worker threads
+                          issuing requests concurrently.
+        :param timeout: default timeout of each request, in seconds. Either a single
+                        number or a (connect timeout, read timeout) pair.
+        :param max_retries: number of times a failed request is retried
+        :param backoff_factor: the delay between retries is backoff_factor * 2^(retry number - 1)
+        :param retry_statuses: HTTP statuses which trigger a retry
+        """
+        self.pool_size = pool_size
+        self.timeout = timeout
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=retry_statuses,
+            allowed_methods=None, # Solr tagging and updates are safe to replay
+            raise_on_status=False)
+        self.adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=retry,
+            pool_block=False)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.nb_requests = 0
+        self.nb_errors = 0
+
+    @property
+    def session(self):
+        """
+        The session used by the current thread.
+        """
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.mount('http://', self.adapter)
+            session.mount('https://', self.adapter)
+            self._local.session = session
+        return session
+
+    def request(self, method, url, **kwargs):
+        """
+        Sends a request through the pool, with the default timeout
+        unless another one is supplied.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        with self._lock:
+            self.nb_requests += 1
+        try:
+            return self.session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            with self._lock:
+                self.nb_errors += 1
+            raise
+
+    def get(self, url, params=None, **kwargs):
+        return self.request('GET', url, params=params, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def pool_stats(self):
+        """
+        Returns statistics about the connection pools, to help
+        sizing them.
+
+        :returns: a dict with the number of requests sent, the number of requests
+            which failed after retries, and for each host the number of connections
+            opened so far, the number of requests served and the number of
+            idle connections currently kept alive.
+        """
+        hosts = {}
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            idle = sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool else 0
+            hosts['{}://{}:{}'.format(pool.scheme, pool.host, pool.port)] = {
+                'connections_opened': pool.num_connections,
+                'requests': pool.num_requests,
+                'idle_connections': idle,
+                'max_size': pool.pool.maxsize if pool.pool else 0,
+            }
+        return {
+            'pool_size': self.pool_size,
+            'requests': self.nb_requests,
+            'errors': self.nb_errors,
+            'hosts': hosts,
+        }
+
+    def close(self):
+        """
+        Closes all pooled connections.
+        """
+        self.adapter.close()
+
+class AsyncHttpTransport(object):
+    """
+    Asynchronous counterpart of HttpTransport, based on aiohttp
+    (which must be installed separately).
+
+    Connections are kept alive in a pool shared by all the coroutines
+    running in the same event loop.
+    """
+
+    def __init__(self,
+                 pool_size=100,
+                 timeout=(3.05, 60),
+                 max_retries=3,
+                 backoff_factor=0.2,
+                 retry_statuses=(502, 503, 504)):
+        """
+        :param pool_size: the maximum number of simultaneous connections.
+                          This bounds the number of requests in flight.
+        :param timeout: default timeout of each request, in seconds. Either a single
+                        number or a (connect timeout, read timeout) pair.
+        :param max_retries: number of times a failed request is retried
+        :param backoff_factor: the delay between retries is backoff_factor * 2^(retry number - 1)
+        :param retry_statuses: HTTP statuses which trigger a retry
+        """
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.retry_statuses = set(retry_statuses)
+        self.session = None
+        self.nb_requests = 0
+        self.nb_errors = 0
+
+    def _get_session(self):
+        import aiohttp
+        if self.session is None or self.session.closed:
+            if isinstance(self.timeout, tuple):
+                timeout = aiohttp.ClientTimeout(sock_connect=self.timeout[0], sock_read=self.timeout[1])
+            else:
+                timeout = aiohttp.ClientTimeout(total=self.timeout)
+            connector = aiohttp.TCPConnector(limit=self.pool_size, limit_per_host=self.pool_size)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self.session
+
+    async def request_json(self, method, url, **kwargs):
+        """
+        Sends a request through the pool and returns the decoded
+        JSON response. Raises aiohttp.ClientError if the request
+        still fails after the configured retries.
+        """
+        import aiohttp
+        session = self._get_session()
+        self.nb_requests += 1
+        for retry in range(self.max_retries + 1):
+            last_attempt = retry == self.max_retries
+            try:
+                async with session.request(method, url, **kwargs) as r:
+                    if r.status in self.retry_statuses and not last_attempt:
+                        raise aiohttp.ClientResponseError(r.request_info, r.history, status=r.status)
+                    r.raise_for_status()
+                    return await r.json(content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if isinstance(e, aiohttp.ClientResponseError) and e.status not in self.retry_statuses:
+                    self.nb_errors += 1
+                    raise
+                if last_attempt:
+                    self.nb_errors += 1
+                    raise
+                sleep_time = self.backoff_factor * (2 ** retry)
+                logger.debug('Retrying {} in {}s: {}'.format(url, sleep_time, e))
+                await asyncio.sleep(sleep_time)
+
+    def pool_stats(self):
+        """
+        Returns statistics about the connection pool.
+        """
+        stats = {
+            'pool_size': self.pool_size,
+            'requests': self.nb_requests,
+            'errors': self.nb_errors,
+        }
+        if self.session is not None and not self.session.closed:
+            connector = self.session.connector
+            stats['idle_connections'] = sum(len(conns) for conns in connector._conns.values())
+            stats['active_connections'] = len(connector._acquired)
+        return stats
+
+    async def close(self):
+        """
+        Closes all pooled connections.
+        """
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+default_transport = None
+default_transport_lock = threading.Lock()
+
+def get_default_transport():
+    """
+    Returns a transport shared by all the components which
+    were not given one explicitly.
+    """
+    global default_transport
+    with default_transport_lock:
+        if default_transport is None:
+            default_transport = HttpTransport()
+        return default_transport
@@ -1,3 +1,4 @@
+import os
 import re
 
 q_re = re.compile(r'(<?https?://www.wikidata.org/(entity|wiki)/)?(Q[0-9]+)>?')
@@ -33,4 +34,10 @@ def to_p(url):
     if match:
         return match.group(3)
 
-
+def file_version(fname):
+    """
+    Identifies the version of a file from its path, size
+    and modification time, which change when the file is replaced.
+    """
+    stat = os.stat(fname)
+    return '{}:{}:{}'.format(os.path.abspath(fname), stat.st_size, stat.st_mtime_ns)
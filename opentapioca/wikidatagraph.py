@@ -1,7 +1,21 @@
 import numpy
 import json
+import glob
+import logging
+import os
+import time
+from array import array
+from collections import Counter
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from scipy import sparse
-from .readers.dumpreader import WikidataDumpReader
+from .readers.paralleldumpreader import open_dump
+from .utils import file_version
+
+logger = logging.getLogger(__name__)
+
+# the type of the edges stored in binary chunks
+edge_dtype = numpy.dtype([('src', '<i4'), ('dst', '<i4'), ('count', '<i4')])
 
 class WikidataGraph(object):
     """
@@ -15,22 +29,36 @@ class WikidataGraph(object):
       the sorting externally is more efficient than doing it inside Python itself.
     - third, the sorted dump is converted into a Numpy sparse adjacency matrix (.npz)
     - fourth, we can compute the pagerank from the Numpy sparse matrix and store
-      it as a dense matrix (.npy)
+      it as a dense vector (.npy)
 
     This slightly convoluted setup makes it possible to process entire dumps on
     a machine with little memory (8GB).
+
+    The adjacency matrix can also be stored as separate Numpy arrays (see
+    save_csr and compile_binary_chunks), which are memory-mapped by load_csr.
+    The PageRank then streams them by blocks of rows, in bounded memory.
     """
+    version = None
+    edges_indptr = None
+    edges_indices = None
+    # rows of the adjacency matrix changed by apply_edge_deltas,
+    # as (targets, weights) pairs of arrays
+    edge_deltas = None
+    edge_deltas_offset = 0
+
     @classmethod
-    def preprocess_dump(cls, fname, output_fname):
+    def preprocess_dump(cls, fname, output_fname, jobs=1):
         """
         Compresses a JSON Wikidata dump in a custom, smaller format
         that only stores the edges and their weights. This file should
         then be sorted (for instance with GNU sort) before being loaded
         as a pre-processed dump.
+
+        :param jobs: the number of processes decompressing and parsing the dump
         """
         output_file = open(output_fname, 'w')
 
-        with WikidataDumpReader(fname) as reader:
+        with open_dump(fname, jobs=jobs) as reader:
             counter = 0
             for item in reader:
                 qid = item.get('id')
@@ -59,6 +87,126 @@ class WikidataGraph(object):
                 output_file.write('\t'.join(fields)+'\n')
                 counter = counter + 1
 
+    @classmethod
+    def preprocess_dump_binary(cls, fname, output_dir, chunk_size=10000000, jobs=1):
+        """
+        Extracts the edges of a JSON Wikidata dump in binary chunks, which
+        can then be compiled by compile_binary_chunks. This replaces the
+        preprocessing to TSV and the external sort.
+
+        Each chunk is a Numpy array of (src, dst, count) records of
+        32-bit integers, sorted by source and target.
+
+        :param output_dir: the directory where chunks are written
+        :param chunk_size: the number of edges in each chunk
+        :param jobs: the number of processes decompressing and parsing the dump
+        """
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        buffers = [array('i'), array('i'), array('i')]
+        nb_chunks = 0
+
+        def write_chunk():
+            chunk = numpy.empty(len(buffers[0]), dtype=edge_dtype)
+            for field, buf in zip(('src', 'dst', 'count'), buffers):
+                chunk[field] = numpy.frombuffer(buf, dtype=numpy.int32)
+                del buf[:]
+            chunk.sort(order=('src', 'dst'))
+            numpy.save(os.path.join(output_dir, 'chunk-{:05d}.npy'.format(nb_chunks)), chunk)
+
+        with open_dump(fname, jobs=jobs) as reader:
+            for idx, item in enumerate(reader):
+                if idx % 100000 == 0:
+                    logger.info('Preprocessed {} items'.format(idx))
+                qid = item.get('id')
+                if qid[0] != 'Q':
+                    continue
+                rowid = int(qid[1:])
+                edges = Counter(item.get_outgoing_edges())
+                for target, count in edges.items():
+                    buffers[0].append(rowid)
+                    buffers[1].append(target)
+                    buffers[2].append(count)
+                if len(buffers[0]) >= chunk_size:
+                    write_chunk()
+                    nb_chunks += 1
+        if len(buffers[0]) or not nb_chunks:
+            write_chunk()
+
+    def compile_binary_chunks(self, chunk_dir, prefix):
+        """
+        Compiles the chunks of edges written by preprocess_dump_binary into
+        an adjacency matrix in CSR format, stored as Numpy arrays (prefix.indptr.npy,
+        prefix.indices.npy and prefix.data.npy). The arrays are filled out of
+        core: only vectors of the size of the number of items are kept in memory.
+        The matrix is then memory-mapped as with load_csr.
+
+        The resulting matrix is the same as with load_from_preprocessed_dump.
+        """
+        chunks = [numpy.load(fname, mmap_mode='r')
+                  for fname in sorted(glob.glob(os.path.join(chunk_dir, 'chunk-*.npy')))]
+        last_qid = max(int(chunk['src'].max()) for chunk in chunks if len(chunk))
+        N = last_qid + 1
+
+        def kept_edges(chunk):
+            src = numpy.asarray(chunk['src'])
+            dst = numpy.asarray(chunk['dst'])
+            counts = numpy.asarray(chunk['count'])
+            kept = (dst <= last_qid) & (dst >= 0)
+            return src[kept], dst[kept], counts[kept]
+
+        # First pass: count the edges and sum the weights of each row
+        row_sizes = numpy.zeros(N, dtype=numpy.int64)
+        row_sums = numpy.zeros(N, dtype=numpy.float64)
+        for chunk in chunks:
+            src, dst, counts = kept_edges(chunk)
+            if not len(src):
+                continue
+            rows, starts, sizes = numpy.unique(src, return_index=True, return_counts=True)
+            row_sizes[rows] += sizes
+            row_sums[rows] += numpy.add.reduceat(counts.astype(numpy.float64), starts)
+        indptr = numpy.zeros(N + 1, dtype=numpy.int64)
+        numpy.cumsum(row_sizes, out=indptr[1:])
+        del row_sizes
+        nnz = int(indptr[-1])
+        index_dtype = self.index_dtype(N, nnz)
+        numpy.save(prefix+'.indptr.npy', indptr.astype(index_dtype))
+
+        # Second pass: write the edges of each row at their position.
+        # Each item is in a single chunk, where its edges are sorted by target.
+        indices = numpy.lib.format.open_memmap(prefix+'.indices.npy', mode='w+', dtype=index_dtype, shape=(nnz,))
+        data = numpy.lib.format.open_memmap(prefix+'.data.npy', mode='w+', dtype=numpy.float64, shape=(nnz,))
+        for chunk in chunks:
+            src, dst, counts = kept_edges(chunk)
+            if not len(src):
+                continue
+            positions = indptr[src] + numpy.arange(len(src)) - numpy.searchsorted(src, src)
+            indices[positions] = dst
+            data[positions] = counts / row_sums[src]
+        indices.flush()
+        data.flush()
+        del indices, data
+        self.load_csr(prefix)
+
+    def load_csr(self, prefix):
+        """
+        Memory-maps an adjacency matrix stored as Numpy arrays
+        by compile_binary_chunks or save_csr. The edges are memory-mapped
+        as well, as with load_edges.
+        """
+        self.load_edges(prefix)
+        data = numpy.load(prefix+'.data.npy', mmap_mode='r')
+        N = len(self.edges_indptr) - 1
+        index_dtype = self.index_dtype(N, len(self.edges_indices))
+        if self.edges_indptr.dtype != index_dtype or self.edges_indices.dtype != index_dtype:
+            logger.warning('The index arrays of {} are not of type {}: they will be copied in memory. '
+                'Save them again with save_csr to memory-map them.'.format(prefix, numpy.dtype(index_dtype).name))
+        # The matrix uses the memory-mapped arrays as long as they have
+        # the index type chosen by scipy: otherwise they are copied.
+        self.mat = sparse.csr_matrix((data, self.edges_indices, self.edges_indptr), shape=(N, N), copy=False)
+        self.N = int(numpy.count_nonzero(numpy.diff(self.edges_indptr)))
+        self.shape = N
+
     def load_from_preprocessed_dump(self, fname, batch_size=1000000):
         """
         Loads the pre-processed dump in a sparse matrix. The dump must be sorted.
@@ -128,45 +276,410 @@ class WikidataGraph(object):
     def save_matrix(self, fname):
         sparse.save_npz(fname, self.mat)
 
-    def compute_pagerank(self):
-        N = self.mat.shape[0]
-        print(self.mat.shape)
-        # create uniform vector
-        data = [1./N] * N
-        rows = [0]*N
-        cols = list(range(N))
-        v = sparse.csr_matrix((data, (rows, cols)), shape=(1,N))
+    @classmethod
+    def index_dtype(cls, N, nnz):
+        """
+        The type of the indptr and indices arrays of a square matrix of size N
+        with nnz edges, as chosen by scipy: both arrays must have this type for
+        scipy to use them without copying them.
+        """
+        if max(N, nnz) <= numpy.iinfo(numpy.int32).max:
+            return numpy.int32
+        return numpy.int64
 
-        max_iterations = 16
-        for i in range(max_iterations):
-            print('---- %d ----' % i)
-            nv = v.dot(self.mat)
+    def save_edges(self, prefix):
+        """
+        Saves the edges of the adjacency matrix in CSR format, split in
+        two Numpy arrays (prefix.indptr.npy and prefix.indices.npy), which
+        can be memory-mapped by load_edges.
+        """
+        mat = sparse.csr_matrix(self.mat)
+        mat.sort_indices()
+        index_dtype = self.index_dtype(mat.shape[0], mat.nnz)
+        numpy.save(prefix+'.indptr.npy', mat.indptr.astype(index_dtype))
+        numpy.save(prefix+'.indices.npy', mat.indices.astype(index_dtype))
 
-            # loss compensation
-            l1norm = nv.sum()
-            comp = sparse.csr_matrix(([(1. - l1norm)/N]*N, (rows, cols)), shape=(1,N))
-            nv += comp
+    def save_csr(self, prefix):
+        """
+        Saves the adjacency matrix in CSR format, split in three Numpy arrays
+        (prefix.indptr.npy, prefix.indices.npy and prefix.data.npy), which
+        can be memory-mapped by load_csr.
+        """
+        self.save_edges(prefix)
+        mat = sparse.csr_matrix(self.mat)
+        mat.sort_indices()
+        numpy.save(prefix+'.data.npy', mat.data.astype(numpy.float64))
 
-            # convergence control
-            diff = nv - v
-            div = diff.multiply(diff.sign()).sum()
-            print(div)
+    def load_edges(self, prefix):
+        """
+        Memory-maps the edges saved by save_edges.
+        """
+        self.edges_indptr = numpy.load(prefix+'.indptr.npy', mmap_mode='r')
+        self.edges_indices = numpy.load(prefix+'.indices.npy', mmap_mode='r')
 
-            # update
-            v = nv
-        self.pagerank = v.todense()
+    def get_edges(self, qid):
+        """
+        Returns the sorted array of the numeric ids of the items
+        an item links to. The edges are read from the memory-mapped
+        arrays if they were loaded, or from the adjacency matrix otherwise.
+        """
+        if self.edges_indptr is not None:
+            indptr, indices = self.edges_indptr, self.edges_indices
+        else:
+            indptr, indices = self.mat.indptr, self.mat.indices
+        row = int(qid[1:])
+        if self.edge_deltas and row in self.edge_deltas:
+            return self.edge_deltas[row][0]
+        if row + 1 >= len(indptr):
+            return indices[0:0]
+        return indices[indptr[row]:indptr[row+1]]
+
+    def compute_pagerank(self, damping=1., tolerance=1e-10, max_iterations=100, dtype=numpy.float64, threads=1, max_memory=None):
+        """
+        Computes the PageRank of the items by power iteration on a dense vector.
+        The mass lost at each iteration (random jumps, and the mass of items
+        without outgoing edges) is redistributed uniformly to all items.
+
+        The adjacency matrix is streamed by blocks of rows at each iteration, so
+        it can be memory-mapped (see load_csr) and larger than the available memory.
+
+        :param damping: the probability of following an edge rather than jumping
+            to a random item. With 1, the only random jumps happen from items without
+            outgoing edges.
+        :param tolerance: stop iterating when the L1 distance between two consecutive
+            vectors falls below this value
+        :param max_iterations: the maximum number of iterations
+        :param dtype: the type of floats used in the computation (numpy.float32
+            halves the memory used)
+        :param threads: the number of threads computing the product with
+            the adjacency matrix, each on a block of rows
+        :param max_memory: if provided, the number of bytes of the blocks of the
+            matrix read at the same time (by all threads). Besides the blocks,
+            the computation keeps threads + 2 dense vectors in memory.
+        """
+        mat = self.mat
+        if not sparse.isspmatrix_csr(mat):
+            mat = sparse.csr_matrix(mat)
+        N = mat.shape[0]
+        logger.info('Computing the PageRank of a {}x{} matrix'.format(*mat.shape))
+        nb_blocks = threads
+        if max_memory is not None:
+            # the edges are copied to blocks with their target and weight
+            edge_size = numpy.dtype(dtype).itemsize + mat.indices.dtype.itemsize
+            block_size = max(1, max_memory // (threads * edge_size))
+            nb_blocks = max(nb_blocks, -(-mat.nnz // block_size))
+        blocks = self._row_blocks(mat.indptr, nb_blocks)
+        logger.info('Streaming the matrix in {} blocks'.format(len(blocks)))
+        v = numpy.full(N, 1./N, dtype=dtype)
+
+        def product(block):
+            # v.dot(mat) restricted to a block of rows
+            start, end = block
+            indptr = numpy.asarray(mat.indptr[start:end+1])
+            edges = slice(indptr[0], indptr[-1])
+            block_mat = sparse.csr_matrix(
+                (numpy.asarray(mat.data[edges], dtype=dtype), numpy.asarray(mat.indices[edges]), indptr - indptr[0]),
+                shape=(end - start, mat.shape[1]))
+            return block_mat.T.dot(v[start:end])
+
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            for i in range(max_iterations):
+                start_time = time.time()
+                nv = numpy.zeros(N, dtype=dtype)
+                # only threads blocks are read at the same time
+                for group_start in range(0, len(blocks), threads):
+                    for partial in executor.map(product, blocks[group_start:group_start+threads]):
+                        nv += partial
+                nv *= damping
 
-    def load_pagerank(self, fname):
-        self.pagerank = numpy.load(fname)
+                # redistribute the lost mass
+                nv += (1. - nv.sum())/N
+
+                # convergence control
+                residual = numpy.abs(nv - v).sum()
+                v = nv
+                logger.info('Iteration {}: residual {:.3e} ({:.2f}s)'.format(i, residual, time.time() - start_time))
+                if residual < tolerance:
+                    break
+
+        self.pagerank = v
+
+    @classmethod
+    def _row_blocks(cls, indptr, nb_blocks):
+        """
+        Splits the rows of a CSR matrix into blocks with similar numbers of edges.
+
+        :param indptr: the row pointers of the matrix
+        :returns: a list of (first row, end row) pairs
+        """
+        nb_rows = len(indptr) - 1
+        bounds = numpy.searchsorted(indptr, numpy.linspace(0, indptr[-1], nb_blocks + 1)[1:-1])
+        bounds = [0] + sorted(set(int(b) for b in bounds) - {0, nb_rows}) + [nb_rows]
+        return list(zip(bounds, bounds[1:]))
+
+    def apply_edge_deltas(self, fname):
+        """
+        Applies the changes of edges appended to a delta log (written by
+        a GraphUpdater) since the last call to this method. The adjacency matrix
+        itself is left untouched (it can be memory-mapped): the changed rows
+        are kept in memory and override the rows of the matrix.
+        Items created after the matrix was compiled extend the graph.
+
+        :returns: a pair made of the sorted array of the changed rows, and a sparse
+            matrix of the changes of their transition probabilities (one row for each
+            changed row, with the new weights minus the previous ones)
+        """
+        if self.edge_deltas is None:
+            self.edge_deltas = {}
+        records = {}
+        with open(fname, 'r') as f:
+            f.seek(self.edge_deltas_offset)
+            for line in iter(f.readline, ''):
+                if not line.endswith('\n'):
+                    # the line is still being written
+                    break
+                record = json.loads(line)
+                records[int(record['id'][1:])] = record
+                self.edge_deltas_offset = f.tell()
+
+        N = max([self.shape] + [row + 1 for row in records])
+        rows = numpy.array(sorted(records), dtype=numpy.int64)
+        data = []
+        indices = []
+        indptr = [0]
+        for row in rows:
+            old_targets, old_weights = self._transition_row(row)
+            targets = numpy.array(records[row]['targets'], dtype=numpy.int64)
+            counts = numpy.array(records[row]['counts'], dtype=numpy.float64)
+            kept = (targets >= 0) & (targets < N)
+            targets, counts = targets[kept], counts[kept]
+            weights = counts / counts.sum() if len(counts) else counts
+            self.edge_deltas[int(row)] = (targets, weights)
+            indices += [old_targets, targets]
+            data += [-old_weights, weights]
+            indptr.append(indptr[-1] + len(old_targets) + len(targets))
+        delta = sparse.csr_matrix(
+            (numpy.concatenate(data) if data else [], numpy.concatenate(indices) if indices else [], indptr),
+            shape=(len(rows), N))
+        delta.sum_duplicates()
+        self.shape = N
+        return rows, delta
+
+    def _transition_row(self, row):
+        """
+        The targets and weights of the edges of an item, taking
+        the changed rows into account.
+        """
+        if self.edge_deltas and row in self.edge_deltas:
+            return self.edge_deltas[row]
+        if row >= self.mat.shape[0]:
+            return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0)
+        start, end = self.mat.indptr[row], self.mat.indptr[row+1]
+        return numpy.asarray(self.mat.indices[start:end]), numpy.asarray(self.mat.data[start:end])
+
+    def _propagate(self, rows, values):
+        """
+        Computes the product of a vector, nonzero on the given rows
+        only, with the adjacency matrix (taking the changed rows into account).
+        Only the edges of these rows are read.
+
+        :returns: a pair made of the sorted array of the items reached
+            by these edges, and the array of their values in the product
+        """
+        targets = []
+        weights = []
+        overlaid = numpy.array([int(row) in self.edge_deltas for row in rows], dtype=bool)
+        base = (rows < self.mat.shape[0]) & ~overlaid
+        if base.any():
+            indptr = self.mat.indptr
+            starts = numpy.asarray(indptr[rows[base]], dtype=numpy.int64)
+            lengths = numpy.asarray(indptr[rows[base] + 1], dtype=numpy.int64) - starts
+            # the positions of the edges of the rows in the indices and data arrays
+            positions = numpy.repeat(starts - numpy.cumsum(lengths) + lengths, lengths) + numpy.arange(lengths.sum())
+            targets.append(numpy.asarray(self.mat.indices[positions], dtype=numpy.int64))
+            weights.append(self.mat.data[positions] * numpy.repeat(values[base], lengths))
+        for row, value in zip(rows[overlaid], values[overlaid]):
+            row_targets, row_weights = self.edge_deltas[int(row)]
+            targets.append(row_targets)
+            weights.append(value * row_weights)
+        if not targets:
+            return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0)
+        reached, positions = numpy.unique(numpy.concatenate(targets), return_inverse=True)
+        return reached, numpy.bincount(positions, weights=numpy.concatenate(weights), minlength=len(reached))
+
+    def _old_teleport(self, rows, delta, pagerank, damping):
+        """
+        The mass redistributed to each item by the previous PageRank vector
+        (random jumps, and the mass of items without outgoing edges), before the
+        changes of edges. This reads the number of edges of all items.
+        """
+        has_edges = numpy.zeros(self.shape, dtype=bool)
+        has_edges[:self.mat.shape[0]] = numpy.diff(self.mat.indptr) > 0
+        for row, (targets, _) in self.edge_deltas.items():
+            has_edges[row] = len(targets) > 0
+        has_edges = has_edges[:len(pagerank)]
+        mass_with_edges = pagerank[has_edges].sum()
+        # the rows whose weights summed to 1 before the changes had edges
+        old_rows = rows < len(pagerank)
+        old_row_sums = numpy.asarray(delta.sum(axis=1)).reshape(-1)[old_rows]
+        mass_with_edges -= pagerank[rows[old_rows]].dot(old_row_sums)
+        return (1. - damping * mass_with_edges) / len(pagerank)
+
+    def refresh_pagerank(self, rows, delta, damping=1., tolerance=1e-10, max_iterations=100):
+        """
+        Updates the PageRank after changes of edges returned by apply_edge_deltas,
+        without recomputing it from scratch.
+
+        The PageRank x of a graph with transition matrix M is the solution of
+        x = damping * M^T x + c, where c is the uniform mass redistributed to each
+        item, normalized so that x sums to one. As the solution is proportional to c,
+        the unnormalized vector y = damping * M^T y + c_old, where c_old is the
+        constant of the previous vector, is computed instead and normalized at the end.
+        The previous vector solves this equation except around the changed rows
+        (and on the items created since), so its residual is sparse. It is corrected
+        by pushing residuals: at each iteration, only the items whose residual
+        exceeds tolerance / N pass it on to the items they link to. Only the edges
+        of these items are read, and the residuals are kept in a dictionary.
+
+        :param rows: the changed rows, as returned by apply_edge_deltas
+        :param delta: the changes of transition probabilities, as returned by apply_edge_deltas
+        :param damping: the damping used to compute the previous vector
+        :param tolerance: residuals below tolerance / N are not pushed
+        :param max_iterations: the maximum number of iterations
+        :returns: the number of iterations and the number of items whose residual was pushed
+        """
+        pagerank = numpy.asarray(self.pagerank, dtype=numpy.float64)
+        old_N = len(pagerank)
+        N = self.shape
+
+        # Residual of the previous vector: the changes of the edges of the changed
+        # rows, and the redistributed mass, which the items created since did not get.
+        residual = defaultdict(float)
+        changed = delta.tocsc().T.tocsr()
+        old_rows = rows < old_N
+        values = changed.dot(numpy.where(old_rows, pagerank[numpy.minimum(rows, old_N - 1)], 0.)) * damping
+        for item in numpy.flatnonzero(values).tolist():
+            residual[item] += values[item]
+        if N > old_N:
+            teleport = self._old_teleport(rows, delta, pagerank, damping)
+            for item in range(old_N, N):
+                residual[item] += teleport
+
+        increments = defaultdict(float)
+        threshold = tolerance / N
+        converged = False
+        for i in range(max_iterations):
+            start_time = time.time()
+            frontier = [item for item, value in residual.items() if abs(value) > threshold]
+            if not frontier:
+                converged = True
+                break
+            frontier = numpy.array(sorted(frontier), dtype=numpy.int64)
+            pushed = numpy.array([residual.pop(item) for item in frontier.tolist()])
+            for item, value in zip(frontier.tolist(), pushed.tolist()):
+                increments[item] += value
+            reached, values = self._propagate(frontier, pushed)
+            for item, value in zip(reached.tolist(), (damping * values).tolist()):
+                residual[item] += value
+            logger.info('Iteration {}: pushed residuals of {} items ({:.2f}s)'.format(
+                i, len(frontier), time.time() - start_time))
+        if not converged:
+            logger.warning('The refreshed PageRank did not converge in {} iterations: '
+                'the residuals of {} items are above the tolerance'.format(
+                    max_iterations, sum(1 for value in residual.values() if abs(value) > threshold)))
+
+        logger.info('Refreshed the PageRank of {} items out of {}'.format(len(increments), N))
+        x = numpy.zeros(N)
+        x[:old_N] = pagerank
+        if increments:
+            items = numpy.fromiter(increments.keys(), dtype=numpy.int64, count=len(increments))
+            x[items] += numpy.fromiter(increments.values(), dtype=numpy.float64, count=len(increments))
+        x /= x.sum()
+        self.pagerank = x.astype(self.pagerank.dtype)
+        return i if converged else max_iterations, len(increments)
+
+    def load_pagerank(self, fname, mmap_mode=None, dtype=None):
+        """
+        Loads a PageRank vector saved by save_pagerank.
+
+        :param mmap_mode: if set (for instance to 'r'), the vector is memory-mapped
+            instead of being read in memory, so that processes which load the same
+            file share a single copy of it in the page cache
+        :param dtype: if set, converts the vector to this type (for instance
+            numpy.float32, to halve its size). A converted vector is read in memory.
+        """
+        pagerank = numpy.load(fname, mmap_mode=mmap_mode)
+        # vectors computed by earlier versions are stored as 1xN matrices
+        pagerank = pagerank.reshape(-1)
+        if dtype is not None and pagerank.dtype != dtype:
+            pagerank = pagerank.astype(dtype)
+        self.pagerank = pagerank
+        self.version = file_version(fname)
 
     def save_pagerank(self, fname):
-        numpy.save(fname, self.pagerank)
+        numpy.save(fname, numpy.asarray(self.pagerank).reshape(-1))
 
     def get_pagerank(self, qid):
         id = int(qid[1:])
-        if id < self.pagerank.shape[1]:
-            return self.pagerank[(0,int(qid[1:]))]
+        if id < len(self.pagerank):
+            return float(self.pagerank[id])
         else:
-            return 0.01/self.pagerank.shape[1]
+            return 0.01/len(self.pagerank)
+
+    def get_pageranks(self, qids):
+        """
+        Looks up the PageRank of many items at once.
+
+        :param qids: a list of item ids, such as 'Q42'
+        :returns: a Numpy array of the PageRanks, in the same order
+        """
+        ids = numpy.fromiter((int(qid[1:]) for qid in qids), dtype=numpy.int64, count=len(qids))
+        N = len(self.pagerank)
+        known = ids < N
+        ranks = numpy.full(len(ids), 0.01/N, dtype=numpy.float64)
+        ranks[known] = self.pagerank[ids[known]]
+        return ranks
+
+
+
+class GraphUpdater(object):
+    """
+    Follows the changes of the statements of items (for instance from
+    the Wikidata edit stream), and appends their new outgoing edges to a
+    delta log, which graphs apply with WikidataGraph.apply_edge_deltas.
+
+    The delta log is in JSON lines format. Each line records all the
+    edges of an item after a change: their targets (as numeric ids) and
+    the number of links to each target.
+    """
+
+    def __init__(self, fname):
+        """
+        :param fname: the path of the delta log. The edges of the items
+            are restored from it if it exists.
+        """
+        self.fname = fname
+        self.item_edges = {}
+        if os.path.exists(fname):
+            with open(fname, 'r') as f:
+                for line in f:
+                    record = json.loads(line)
+                    self.item_edges[record['id']] = (record['targets'], record['counts'])
 
+    def update(self, item):
+        """
+        Records the edges of an item, if they changed since it was last seen.
 
+        :returns: the record appended to the delta log, or None if the edges did not change
+        """
+        qid = item.get('id')
+        edges = Counter(item.get_outgoing_edges())
+        targets = sorted(edges)
+        counts = [edges[target] for target in targets]
+        if self.item_edges.get(qid) == (targets, counts):
+            return None
+        self.item_edges[qid] = (targets, counts)
+        record = {'id': qid, 'targets': targets, 'counts': counts}
+        with open(self.fname, 'a') as f:
+            f.write(json.dumps(record)+'\n')
+        return record
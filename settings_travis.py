@@ -2,9 +2,49 @@
 # The name of the Solr collection where Wikidata is indexed
 SOLR_COLLECTION = None
 
+# The path to a lexicon built with "tapioca build-lexicon". If it is set,
+# text is tagged in process with this lexicon instead of Solr.
+LEXICON_PATH = None
+
+# Number of keep-alive connections to Solr. This should be at least
+# the number of threads serving requests in each worker.
+SOLR_POOL_SIZE = 10
+# Timeout of each Solr request, in seconds
+SOLR_TIMEOUT = 60
+# Number of times a failed Solr request is retried
+SOLR_MAX_RETRIES = 3
+# Split texts longer than 10000 characters in overlapping windows
+# tagged in parallel, instead of truncating them
+WINDOWED_TAGGING = False
+# Memory budget (in MB) of the cache of candidate documents shared
+# across requests, or None to fetch all documents from Solr every time
+CANDIDATE_CACHE_SIZE = None
+# Number of seconds after which cached candidate documents expire
+CANDIDATE_CACHE_TTL = 3600
+# Number of annotated texts whose annotations are cached in memory,
+# or None to disable the cache of annotations
+ANNOTATION_CACHE_SIZE = None
+# Path of an SQLite database where cached annotations are also
+# stored, so that they survive restarts
+ANNOTATION_CACHE_PATH = None
+# Number of threads ranking candidates in the ASGI app (asgi.py)
+RANKING_THREADS = 4
+
 # The path to the language model, trained with "tapioca train-bow"
+# (or converted to the compact format with "tapioca convert-bow")
 LANGUAGE_MODEL_PATH=None
-# The path to the pagerank Numpy vector, computed with "tapioca compute-pagerank"
+# The path to the delta log written by "tapioca update-bow", whose updates
+# are applied to the language model every LANGUAGE_MODEL_REFRESH_INTERVAL seconds
+LANGUAGE_MODEL_DELTAS_PATH=None
+LANGUAGE_MODEL_REFRESH_INTERVAL=600
+# The path to the pagerank Numpy vector, computed with "tapioca compute-pagerank".
+# It is memory-mapped, so that the processes of the web app share a single copy
 PAGERANK_PATH=None
-# The path to the trained classifier, obtained from "tapioca train-classifier"
+# The prefix of the edges of the graph exported with "tapioca export-edges".
+# If it is set, the edges of candidates are read from these files
+# instead of being retrieved from Solr
+GRAPH_EDGES_PATH=None
+# The path to the trained classifier, obtained from "tapioca train-classifier".
+# Classifiers exported to JSON with "tapioca export-classifier" load faster,
+# as they do not require scikit-learn
 CLASSIFIER_PATH=None
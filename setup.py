@@ -89,6 +89,7 @@ setup(
     extras_require={
         'dev': ['check-manifest'],
         'test': ['coverage', 'pytest'],
+        'async': ['aiohttp', 'uvicorn'],
     },
 
     # If there are data files included in your packages that need to be